@@ -0,0 +1,334 @@
+"""
+Benchmark suite for the ingest -> triangulate -> broadcast pipeline
+Writes machine-readable results and can compare them with an earlier run
+
+    python benchmark.py                          # full suite
+    python benchmark.py --quick                  # skip the 100k cases
+    python benchmark.py --compare previous.json  # exit 1 on a regression
+"""
+
+import argparse
+import contextlib
+import itertools
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from density import FLOOR_BOUNDS
+from device_table import DeviceTable
+from receiver import ESP32Receiver
+from scan_format import SCAN_DTYPE, encode_binary_scan, format_id
+from simulator import CrowdSimulator, chunk_payload, random_macs
+from triangulation import RadioMapLocator
+
+import map_websocket as server
+
+
+CHUNK_COUNTS = [1, 10, 100, 1000]
+JSON_SIZES = [100, 1000, 10000]
+TRIANGULATION_SIZES = [10, 1000, 10000, 100000]
+PAYLOAD_SIZES = [100, 1000, 10000]
+PIPELINE_SIZES = [1000, 10000]
+
+
+@contextlib.contextmanager
+def quiet():
+    """Silence the receivers' per-scan prints while timing"""
+    with open(os.devnull, 'w') as sink, contextlib.redirect_stdout(sink):
+        yield
+
+
+def measure(fn, repeat=7, number=1):
+    """Time fn() `repeat` times, `number` calls each; returns seconds per call"""
+    samples = []
+    fn()  # warm-up
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        samples.append((time.perf_counter() - start) / number)
+    return {
+        'median': statistics.median(samples),
+        'mean': statistics.fmean(samples),
+        'min': min(samples),
+        'stdev': statistics.stdev(samples) if len(samples) > 1 else 0.0,
+        'repeat': repeat,
+        'number': number,
+    }
+
+
+def common_scans(registry, n, seed=0, noise=1.0):
+    """One scan per node, every node hearing the same n devices"""
+    rng = np.random.default_rng(seed)
+    low, high = np.array(FLOOR_BOUNDS[:2]), np.array(FLOOR_BOUNDS[2:])
+    positions = rng.uniform(low, high, size=(n, 2))
+    macs = random_macs(rng, n)
+    ids = rng.integers(0, 1 << 32, size=n, dtype=np.uint32)
+
+    scans = []
+    for node_position in registry.positions():
+        distance = np.linalg.norm(positions - node_position, axis=1)
+        scan = np.empty(n, dtype=SCAN_DTYPE)
+        scan['mac'] = macs
+        scan['distance'] = np.maximum(distance + rng.normal(0, noise, n), 0.1)
+        scan['rssi'] = -59 - 22 * np.log10(np.maximum(distance, 1.0))
+        scan['id'] = ids
+        scans.append(scan)
+    return scans
+
+
+def scan_rounds(registry, n, rounds=8, seed=0, noise=1.0):
+    """`rounds` rounds of common_scans for the same devices, each with fresh range noise"""
+    rng = np.random.default_rng(seed + 1)
+    exact = common_scans(registry, n, seed, noise=0.0)
+    out = []
+    for _ in range(rounds):
+        scans = [scan.copy() for scan in exact]
+        for scan in scans:
+            scan['distance'] = np.maximum(scan['distance'] + rng.normal(0, noise, n), 0.1)
+        out.append(scans)
+    return out
+
+
+def json_scan(scan):
+    return json.dumps({'devices': [
+        {
+            'mac': ':'.join(f'{mac:012X}'[i:i + 2] for i in range(0, 12, 2)),
+            'distance': round(distance, 2),
+            'rssi': rssi,
+            'id': format_id(device_id)
+        }
+        for mac, distance, rssi, device_id in zip(
+            scan['mac'].tolist(), scan['distance'].tolist(),
+            scan['rssi'].tolist(), scan['id'].tolist())
+    ]})
+
+
+def build_engine(n, seed=0):
+    """A TriangulationEngine whose table holds n devices heard by every node"""
+    registry = server.registry
+    table = DeviceTable(len(registry))
+    receivers = [ESP32Receiver(node.device_name, table, k) for k, node in enumerate(registry)]
+    for receiver, scan in zip(receivers, common_scans(registry, n, seed)):
+        receiver.process_scan(scan)
+    return server.TriangulationEngine(receivers, registry, table, server.FUSION_WINDOW)
+
+
+def bench_reassembly(results):
+    for chunks in CHUNK_COUNTS:
+        # ~13 bytes per device in the binary format, 180 bytes per chunk
+        scan = common_scans(server.registry, max(1, chunks * 180 // 13 - 1))[0]
+        notifications = [bytearray(c) for c in chunk_payload(encode_binary_scan(scan), 180)]
+        receiver = ESP32Receiver('bench')
+        chunks = len(notifications)
+
+        def feed():
+            for data in notifications:
+                receiver.notification_handler(None, data)
+
+        with quiet():
+            stats = measure(feed, number=max(1, 200 // chunks))
+        results.append(dict(name='reassembly', params={'chunks': chunks},
+                            items=chunks, **stats))
+
+
+def bench_decode(results):
+    for n in JSON_SIZES:
+        scan = common_scans(server.registry, n)[0]
+        document = json_scan(scan)
+        binary = encode_binary_scan(scan)
+        receiver = ESP32Receiver('bench')
+
+        stats = measure(lambda: receiver.process_data(json.loads(document)))
+        results.append(dict(name='decode_json', params={'devices': n},
+                            items=n, bytes=len(document), **stats))
+
+        stats = measure(lambda: receiver.process_payload(binary))
+        results.append(dict(name='decode_binary', params={'devices': n},
+                            items=n, bytes=len(binary), **stats))
+
+
+def bench_triangulation(results, sizes):
+    for n in sizes:
+        engine = build_engine(n)
+        repeat = 3 if n >= 100000 else 7
+        distances = engine.table.distance[:engine.table.size].astype(float)
+
+        stats = measure(lambda: engine.solver.solve(distances), repeat=repeat)
+        results.append(dict(name='multilateration', params={'devices': n}, items=n, **stats))
+
+        # measure() warms up first, so the one-off radio map build is not timed
+        locator = RadioMapLocator(engine.registry.positions())
+        stats = measure(lambda: locator.solve(distances), repeat=repeat)
+        results.append(dict(name='radiomap', params={'devices': n}, items=n, **stats))
+
+        # Includes fusion, the tracker and building the device dicts
+        engine.get_triangulated_devices()
+        stats = measure(engine.get_triangulated_devices, repeat=repeat)
+        results.append(dict(name='get_triangulated_devices', params={'devices': n},
+                            items=n, **stats))
+
+
+def bench_payload(results):
+    for n in PAYLOAD_SIZES:
+        server.triangulation = build_engine(n)
+        server.delta_encoder = server.DeltaEncoder(server.KEYFRAME_INTERVAL, server.MOVE_THRESHOLD)
+        server.density_grid = server.DensityGrid(cell_size=server.GRID_CELL_SIZE,
+                                                 sigma=server.GRID_SIGMA,
+                                                 half_life=server.GRID_HALF_LIFE)
+
+        stats = measure(server.triangulation.get_node_positions, number=100)
+        results.append(dict(name='get_node_positions', params={'devices': n}, **stats))
+
+        # Every timed frame first takes a new round of scans, as after a real
+        # scan: a repeated round is an idle frame (nothing fused, empty delta)
+        rounds = itertools.cycle(scan_rounds(server.registry, n))
+
+        def feed():
+            for receiver, scan in zip(server.triangulation.receivers, next(rounds)):
+                receiver.process_scan(scan)
+
+        # Confirm the tracks so frames carry every device
+        feed()
+        server.build_frames()
+        feed()
+        full, delta, density, zones = server.build_frames()
+        sizes = {
+            'map_update': len(json.dumps(full)),
+            'map_delta': len(json.dumps(delta)),
+            'density_update': len(density['cells']) + len(json.dumps(
+                {k: v for k, v in density.items() if k != 'cells'})),
+            'zone_update': len(json.dumps(zones)),
+        }
+
+        def frame():
+            feed()
+            server.build_frames()
+
+        stats = measure(frame)
+        results.append(dict(name='build_frames', params={'devices': n}, items=n, **stats))
+
+        stats = measure(lambda: json.dumps(full))
+        results.append(dict(name='serialize_map_update', params={'devices': n}, items=n,
+                            bytes=sizes['map_update'], **stats))
+
+        def broadcast():
+            feed()
+            server.broadcast_data()
+
+        stats = measure(broadcast)
+        results.append(dict(name='broadcast_data', params={'devices': n}, items=n,
+                            bytes=sizes, **stats))
+
+
+def bench_pipeline(results):
+    """Notifications in, frames out, driven by the crowd simulator"""
+    for n in PIPELINE_SIZES:
+        registry = server.registry
+        table = DeviceTable(len(registry))
+        receivers = [ESP32Receiver(node.device_name, table, k) for k, node in enumerate(registry)]
+        simulator = CrowdSimulator(registry, n, seed=1)
+        with quiet():
+            simulator.attach(receivers)
+            simulator.pump(simulator.scan_interval * 3)
+
+        server.triangulation = server.TriangulationEngine(receivers, registry, table,
+                                                          server.FUSION_WINDOW)
+        server.delta_encoder = server.DeltaEncoder(server.KEYFRAME_INTERVAL, server.MOVE_THRESHOLD)
+
+        def frame():
+            simulator.pump(simulator.scan_interval)
+            server.broadcast_data()
+
+        with quiet():
+            stats = measure(frame, repeat=5)
+        results.append(dict(name='pipeline_frame', params={'devices': n}, items=n,
+                            fps=1.0 / stats['median'], **stats))
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def key(result):
+    return result['name'], json.dumps(result['params'], sort_keys=True)
+
+
+def compare(results, previous_path, tolerance):
+    """Print best-time ratios against an earlier run; returns the regressed cases"""
+    with open(previous_path) as f:
+        previous = {key(r): r for r in json.load(f)['results']}
+
+    regressions = []
+    print(f"\nCompared with {previous_path} (tolerance {tolerance:.0%}):")
+    for result in results:
+        before = previous.get(key(result))
+        if not before:
+            continue
+        ratio = result['min'] / before['min']
+        flag = ''
+        if ratio > 1 + tolerance:
+            flag = '  ⚠️ regression'
+            regressions.append(result)
+        print(f"  {result['name']:<26} {json.dumps(result['params']):<20} {ratio:6.2f}x{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CrowdMap pipeline benchmarks")
+    parser.add_argument('--output', default='benchmark_results.json',
+                        help="Where to write the results")
+    parser.add_argument('--quick', action='store_true', help="Skip the 100k-device cases")
+    parser.add_argument('--compare', metavar='RESULTS',
+                        help="Earlier results file to check for regressions")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="Allowed slowdown before a case counts as a regression")
+    args = parser.parse_args()
+
+    sizes = [n for n in TRIANGULATION_SIZES if not (args.quick and n >= 100000)]
+    results = []
+    for name, bench in [
+        ('reassembly', lambda: bench_reassembly(results)),
+        ('decode', lambda: bench_decode(results)),
+        ('triangulation', lambda: bench_triangulation(results, sizes)),
+        ('payload', lambda: bench_payload(results)),
+        ('pipeline', lambda: bench_pipeline(results)),
+    ]:
+        print(f"⏱ {name}...")
+        bench()
+
+    print()
+    for result in results:
+        line = f"  {result['name']:<26} {json.dumps(result['params']):<20} {result['median'] * 1000:10.3f} ms"
+        if 'fps' in result:
+            line += f"  ({result['fps']:.1f} fps)"
+        print(line)
+
+    report = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\n💾 Results written to {args.output}")
+
+    if args.compare and compare(results, args.compare, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
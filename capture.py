@@ -0,0 +1,337 @@
+"""
+Record and replay raw BLE notifications
+The log is a header followed by (time, node, length, bytes) records; a
+sidecar .idx file holds one fixed-size entry per record so a replay can
+memory-map the log and jump straight to any notification
+"""
+
+import argparse
+import asyncio
+import functools
+import inspect
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+
+import numpy as np
+
+from simulator import SimulatedClient
+
+
+MAGIC = b'CMCAP'
+VERSION = 1
+
+# Magic, version, length of the JSON metadata that follows
+HEADER = struct.Struct('<5sBI')
+
+# Monotonic receive time, node index, payload length
+RECORD = struct.Struct('<dHI')
+
+# One entry per record; offset points at the payload, not the record header
+INDEX_DTYPE = np.dtype([
+    ('time', '<f8'),
+    ('offset', '<u8'),
+    ('length', '<u4'),
+    ('node', '<u2'),
+])
+
+
+def index_path(path):
+    return path + '.idx'
+
+
+class CaptureRecorder:
+    """Append every notification from the attached receivers to a capture log"""
+
+    def __init__(self, path, node_names, clock=time.monotonic, wall_clock=time.time,
+                 flush_interval=1.0):
+        self.path = path
+        self.clock = clock
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.records = 0
+        self.bytes = 0
+
+        now = clock()
+        meta = json.dumps({
+            'nodes': list(node_names),
+            'monotonic': now,
+            'wall': wall_clock(),
+        }).encode()
+
+        self.log = open(path, 'wb')
+        self.index = open(index_path(path), 'wb')
+        self.log.write(HEADER.pack(MAGIC, VERSION, len(meta)) + meta)
+        self.offset = HEADER.size + len(meta)
+        self.last_flush = now
+
+    def attach(self, receivers):
+        for k, receiver in enumerate(receivers):
+            receiver.recorder = functools.partial(self.record, k)
+        print(f"⏺ Recording notifications to {self.path}")
+
+    def record(self, node, data, now=None):
+        if now is None:
+            now = self.clock()
+        length = len(data)
+        entry = np.array([(now, self.offset + RECORD.size, length, node)], dtype=INDEX_DTYPE)
+
+        with self.lock:
+            self.log.write(RECORD.pack(now, node, length))
+            self.log.write(data)
+            self.index.write(entry.tobytes())
+            self.offset += RECORD.size + length
+            self.records += 1
+            self.bytes += length
+
+            # Bounded data loss if the process dies, without a syscall per chunk
+            if now - self.last_flush >= self.flush_interval:
+                self._flush(now)
+
+    def _flush(self, now):
+        self.log.flush()
+        self.index.flush()
+        self.last_flush = now
+
+    def close(self):
+        with self.lock:
+            if self.log.closed:
+                return
+            self._flush(self.clock())
+            self.log.close()
+            self.index.close()
+        print(f"⏹ Recorded {self.records} notifications ({self.bytes} bytes) to {self.path}")
+
+
+class CaptureLog:
+    """Read-only, memory-mapped view of a capture log"""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.data = memoryview(self.mmap)
+
+        magic, version, meta_length = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a capture log")
+        if version != VERSION:
+            raise ValueError(f"Unsupported capture log version {version}")
+
+        meta = json.loads(bytes(self.data[HEADER.size:HEADER.size + meta_length]))
+        self.nodes = meta['nodes']
+        self.monotonic = meta['monotonic']
+        self.wall = meta['wall']
+        self.start = HEADER.size + meta_length
+        self.index = self._load_index()
+
+    def _load_index(self):
+        """Read the sidecar index, trusting only entries the log fully contains"""
+        size = len(self.data)
+        index = np.zeros(0, dtype=INDEX_DTYPE)
+        path = index_path(self.path)
+        if os.path.exists(path):
+            index = np.fromfile(path, dtype=INDEX_DTYPE,
+                                count=os.path.getsize(path) // INDEX_DTYPE.itemsize)
+            ends = index['offset'] + index['length']
+            index = index[:np.searchsorted(ends > size, True)]
+
+        # Records written after the last index flush (or a missing index)
+        offset = int(index['offset'][-1] + index['length'][-1]) if len(index) else self.start
+        tail = []
+        while offset + RECORD.size <= size:
+            now, node, length = RECORD.unpack_from(self.data, offset)
+            if offset + RECORD.size + length > size:
+                break
+            tail.append((now, offset + RECORD.size, length, node))
+            offset += RECORD.size + length
+        if tail:
+            index = np.concatenate([index, np.array(tail, dtype=INDEX_DTYPE)])
+        return index
+
+    def __len__(self):
+        return len(self.index)
+
+    @property
+    def duration(self):
+        if not len(self.index):
+            return 0.0
+        return float(self.index['time'][-1] - self.index['time'][0])
+
+    def payload(self, i):
+        offset = int(self.index['offset'][i])
+        return self.data[offset:offset + int(self.index['length'][i])]
+
+    def close(self):
+        self.data.release()
+        self.mmap.close()
+        self.file.close()
+
+
+class ReplayClock:
+    """Clock that reads the recorded time of the notification being replayed"""
+
+    def __init__(self, now, wall_offset):
+        self.now = now
+        self.wall_offset = wall_offset
+
+    def __call__(self):
+        return self.now
+
+    def time(self):
+        """Epoch seconds matching the recorded time"""
+        return self.now + self.wall_offset
+
+
+class Replayer:
+    """
+    Feed a capture log into receivers' notification handlers
+    Receivers, the device table and the engine must all use `clock` so that
+    two replays of one log produce identical frames
+    """
+
+    def __init__(self, log, speed=1.0, tick=2.0):
+        self.log = log
+        self.speed = speed     # recorded seconds per wall second, 0 = as fast as possible
+        self.tick = tick       # recorded seconds between on_tick calls
+        start = float(log.index['time'][0]) if len(log) else log.monotonic
+        self.clock = ReplayClock(start, log.wall - log.monotonic)
+        self.clients = []
+        self.position = 0
+
+    def attach(self, receivers):
+        """Node k of the log feeds receivers[k]"""
+        self.clients = []
+        for k, receiver in enumerate(receivers):
+            if k < len(self.log.nodes) and self.log.nodes[k] != receiver.name:
+                print(f"⚠️ Log node {k} is '{self.log.nodes[k]}', replaying into '{receiver.name}'")
+            client = SimulatedClient(f"REPLAY:{k:02d}")
+            client.is_connected = True
+            client.handler = receiver.notification_handler
+            receiver.address = client.address
+            receiver.client = client
+            receiver.link_state = 'online'
+            self.clients.append(client)
+        print(f"⏯ Replaying {len(self.log)} notifications ({self.log.duration:.1f} s) "
+              f"from {self.log.path}")
+
+    def _feed(self, i):
+        node = int(self.log.index['node'][i])
+        if node >= len(self.clients):
+            return
+        client = self.clients[node]
+        if client.handler is not None:
+            client.handler(client, bytearray(self.log.payload(i)))
+
+    def run_sync(self, on_tick=None):
+        """Replay the whole log immediately, calling on_tick every `tick` recorded seconds"""
+        times = self.log.index['time']
+        next_tick = self.clock.now + self.tick
+        for i in range(self.position, len(self.log)):
+            now = float(times[i])
+            while on_tick and next_tick <= now:
+                self.clock.now = next_tick
+                on_tick()
+                next_tick += self.tick
+            self.clock.now = now
+            self._feed(i)
+            self.position = i + 1
+        if on_tick:
+            self.clock.now = next_tick
+            on_tick()
+
+    async def run(self, on_tick=None):
+        """Replay paced by `speed`; on_tick may be a plain function or a coroutine"""
+        async def tick():
+            result = on_tick()
+            if inspect.isawaitable(result):
+                await result
+
+        times = self.log.index['time']
+        origin = self.clock.now
+        wall_origin = time.monotonic()
+        next_tick = origin + self.tick
+
+        async def wait_until(recorded):
+            if self.speed:
+                delay = (recorded - origin) / self.speed - (time.monotonic() - wall_origin)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+        for i in range(self.position, len(self.log)):
+            now = float(times[i])
+            while on_tick and next_tick <= now:
+                await wait_until(next_tick)
+                self.clock.now = next_tick
+                await tick()
+                next_tick += self.tick
+            await wait_until(now)
+            self.clock.now = now
+            self._feed(i)
+            self.position = i + 1
+            if not self.speed and i % 256 == 0:
+                await asyncio.sleep(0)
+        if on_tick:
+            self.clock.now = next_tick
+            await tick()
+
+
+def replay_digest(path, nodes_file=None, tick=2.0):
+    """
+    Replay a log through the full server pipeline as fast as possible
+    Returns (device count per emitted frame, hex digest of every map_update frame)
+    """
+    import hashlib
+    import map_websocket as server
+    from density import DensityGrid
+    from device_table import DeviceTable
+    from nodes import NodeRegistry
+    from receiver import ESP32Receiver
+
+    log = CaptureLog(path)
+    replayer = Replayer(log, speed=0, tick=tick)
+    clock = replayer.clock
+
+    registry = NodeRegistry.from_file(nodes_file) if nodes_file else server.registry
+    table = DeviceTable(len(registry), clock=clock)
+    receivers = [ESP32Receiver(node.device_name, table, k, clock=clock)
+                 for k, node in enumerate(registry)]
+    replayer.attach(receivers)
+
+    server.triangulation = server.TriangulationEngine(
+        receivers, registry, table, server.FUSION_WINDOW, clock=clock, wall_clock=clock.time)
+    server.delta_encoder = server.DeltaEncoder(server.KEYFRAME_INTERVAL, server.MOVE_THRESHOLD)
+    server.density_grid = DensityGrid(cell_size=server.GRID_CELL_SIZE, sigma=server.GRID_SIGMA,
+                                      half_life=server.GRID_HALF_LIFE, clock=clock)
+
+    digest = hashlib.sha256()
+    frames = []
+
+    def on_tick():
+        result = server.build_frames()
+        if result is None:
+            return
+        full, delta, density, zones = result
+        digest.update(json.dumps(full, sort_keys=True).encode())
+        digest.update(density['cells'])
+        frames.append(len(full['devices']))
+
+    replayer.run_sync(on_tick)
+    log.close()
+    return frames, digest.hexdigest()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a CrowdMap capture log offline")
+    parser.add_argument('log', help="Capture log written with map_websocket.py --record")
+    parser.add_argument('--nodes', help="JSON file with the ESP32 node registry")
+    parser.add_argument('--tick', type=float, default=2.0,
+                        help="Recorded seconds between frames")
+    args = parser.parse_args()
+
+    frames, digest = replay_digest(args.log, args.nodes, args.tick)
+    print(f"\n{len(frames)} frames, {max(frames, default=0)} devices at most")
+    print(f"digest {digest}")
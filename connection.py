@@ -0,0 +1,216 @@
+"""
+BLE connection manager for the ESP32 nodes
+One shared discovery scan resolves every node, addresses are cached on disk
+so restarts connect directly, and each link is supervised with
+exponential-backoff reconnects
+"""
+
+import asyncio
+import json
+import os
+import random
+
+from bleak import BleakClient, BleakScanner
+
+from receiver import CHAR_UUID
+
+
+# name -> address, kept between runs
+ADDRESS_CACHE = os.path.join(os.path.expanduser('~'), '.cache', 'crowdmap', 'addresses.json')
+
+# A shared scan stops as soon as every wanted node has been seen
+SCAN_TIMEOUT = 10.0
+CONNECT_TIMEOUT = 10.0
+
+# Reconnect delays double from INITIAL_BACKOFF up to MAX_BACKOFF
+INITIAL_BACKOFF = 0.5
+MAX_BACKOFF = 30.0
+
+
+class AddressCache:
+    """Persistent name -> BLE address map"""
+
+    def __init__(self, path=ADDRESS_CACHE):
+        self.path = path
+        self.addresses = {}
+        try:
+            with open(path) as f:
+                self.addresses = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    def get(self, name):
+        return self.addresses.get(name)
+
+    def update(self, addresses):
+        changed = {k: v for k, v in addresses.items() if self.addresses.get(k) != v}
+        if changed:
+            self.addresses.update(changed)
+            self.save()
+
+    def save(self):
+        # Ingest workers share the file; keep entries other processes wrote since we loaded it
+        try:
+            with open(self.path) as f:
+                self.addresses = {**json.load(f), **self.addresses}
+        except (OSError, ValueError):
+            pass
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp = self.path + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(self.addresses, f, indent=2)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            print(f"⚠️ Could not save address cache: {e}")
+
+
+class ConnectionManager:
+    """Connects every receiver and keeps it connected"""
+
+    def __init__(self, receivers, cache=None, scan_timeout=SCAN_TIMEOUT,
+                 connect_timeout=CONNECT_TIMEOUT, initial_backoff=INITIAL_BACKOFF,
+                 max_backoff=MAX_BACKOFF, adapter=None):
+        self.receivers = receivers
+        self.cache = cache if cache is not None else AddressCache()
+        # HCI adapter to scan and connect with (BlueZ, e.g. 'hci1'); None = the default one
+        self.bleak_args = {'adapter': adapter} if adapter else {}
+        self.scan_timeout = scan_timeout
+        self.connect_timeout = connect_timeout
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+
+        self.devices = {}          # name -> BLEDevice from the latest scan
+        self.scan_generation = 0
+        self.scan_lock = asyncio.Lock()
+        self.disconnected = {receiver.name: asyncio.Event() for receiver in receivers}
+        self.tasks = []
+        self.running = False
+
+    async def discover(self, names):
+        """One BLE scan for all of `names`; returns the devices it found"""
+        wanted = set(names)
+        found = {}
+        done = asyncio.Event()
+
+        def on_detect(device, advertisement):
+            name = device.name or advertisement.local_name
+            if name in wanted and name not in found:
+                found[name] = device
+                if len(found) == len(wanted):
+                    done.set()
+
+        print(f"🔍 Scanning for {', '.join(sorted(wanted))}...")
+        scanner = BleakScanner(detection_callback=on_detect, **self.bleak_args)
+        await scanner.start()
+        try:
+            await asyncio.wait_for(done.wait(), self.scan_timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            await scanner.stop()
+
+        for name in sorted(wanted - set(found)):
+            print(f"✗ {name} not found")
+        self.devices.update(found)
+        self.scan_generation += 1
+        self.cache.update({name: device.address for name, device in found.items()})
+        return found
+
+    async def resolve(self, name):
+        """
+        Find a node by name, sharing one scan between every caller that asks
+        while a scan is already running
+        """
+        generation = self.scan_generation
+        async with self.scan_lock:
+            if self.scan_generation == generation:
+                unlinked = [r.name for r in self.receivers if r.link_state != 'online']
+                await self.discover(unlinked or [name])
+            return self.devices.get(name)
+
+    async def connect(self, receiver, target):
+        """Connect and subscribe; target is a BLEDevice or an address"""
+        event = self.disconnected[receiver.name]
+        event.clear()
+        loop = asyncio.get_running_loop()
+
+        def on_disconnect(client):
+            loop.call_soon_threadsafe(event.set)
+
+        client = BleakClient(target, disconnected_callback=on_disconnect,
+                             timeout=self.connect_timeout, **self.bleak_args)
+        try:
+            print(f"🔗 Connecting to {receiver.name}...")
+            await client.connect()
+            await client.start_notify(CHAR_UUID, receiver.notification_handler)
+        except Exception as e:
+            print(f"✗ {receiver.name} connection failed: {e}")
+            try:
+                await client.disconnect()
+            except Exception:
+                pass
+            return False
+
+        receiver.client = client
+        receiver.address = client.address
+        receiver.link_state = 'online'
+        receiver.last_data = receiver.clock()
+        self.cache.update({receiver.name: client.address})
+        print(f"✓ [{receiver.name}] Connected and subscribed ({client.address})")
+        return True
+
+    async def supervise(self, receiver):
+        """Keep one receiver linked, backing off exponentially between failures"""
+        backoff = self.initial_backoff
+        address = self.cache.get(receiver.name)
+
+        while self.running:
+            # Cached address first; a scan only when that fails
+            try:
+                target = address or await self.resolve(receiver.name)
+            except Exception as e:
+                print(f"✗ Bluetooth error: {e}")
+                target = None
+            if target is not None and await self.connect(receiver, target):
+                backoff = self.initial_backoff
+                await self.disconnected[receiver.name].wait()
+                if not self.running:
+                    break
+                receiver.link_state = 'reconnecting'
+                receiver.reconnects += 1
+                print(f"⚠️ {receiver.name} disconnected, reconnecting...")
+                address = receiver.address
+                continue
+
+            # Stale cache entry or the node changed address; scan next time
+            address = None
+
+            delay = backoff * random.uniform(0.8, 1.2)
+            print(f"⏳ Retrying {receiver.name} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+            backoff = min(backoff * 2, self.max_backoff)
+
+    def start(self):
+        self.running = True
+        self.tasks = [asyncio.ensure_future(self.supervise(r)) for r in self.receivers]
+
+    async def wait_connected(self, timeout):
+        """Wait until every node is online or timeout passes; returns the count online"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while loop.time() < deadline:
+            if all(r.link_state == 'online' for r in self.receivers):
+                break
+            await asyncio.sleep(0.05)
+        return sum(r.link_state == 'online' for r in self.receivers)
+
+    async def stop(self):
+        self.running = False
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        for receiver in self.receivers:
+            await receiver.disconnect()
+            receiver.link_state = 'offline'
@@ -0,0 +1,88 @@
+"""
+Delta-encoded map stream
+Frames carry a sequence number; keyframes hold every device, deltas only
+the devices that were added, moved past a threshold, or removed
+"""
+
+import math
+import threading
+
+
+class DeltaEncoder:
+    def __init__(self, keyframe_interval=30, move_threshold=0.5):
+        self.keyframe_interval = keyframe_interval
+        self.move_threshold = move_threshold
+        self.seq = 0
+        self.frames_since_keyframe = 0
+
+        # Device state as clients have it after frame `seq`, keyed by id
+        self.baseline = {}
+        self.nodes = []
+        self.lock = threading.Lock()
+
+    def encode(self, nodes, devices):
+        """
+        Produce the next frame for the shared delta stream
+        Returns None, without using a sequence number, when nothing changed
+        """
+        with self.lock:
+            if not self.seq or self.frames_since_keyframe + 1 >= self.keyframe_interval:
+                self.seq += 1
+                self.nodes = nodes
+                self.baseline = {device['id']: device for device in devices}
+                self.frames_since_keyframe = 0
+                return self._keyframe()
+
+            baseline = self.baseline
+            threshold = self.move_threshold
+            current = set()
+            added, moved, changed = [], [], []
+
+            for device in devices:
+                device_id = device['id']
+                current.add(device_id)
+                previous = baseline.get(device_id)
+                if previous is None:
+                    added.append(device)
+                    changed.append(device)
+                    continue
+
+                x, y = device['position']
+                px, py = previous['position']
+                if math.hypot(x - px, y - py) > threshold:
+                    moved.append([device_id, round(x, 2), round(y, 2)])
+                    changed.append(device)
+
+            removed = [device_id for device_id in baseline if device_id not in current]
+            if not (added or moved or removed) and nodes == self.nodes:
+                return None
+
+            self.seq += 1
+            self.frames_since_keyframe += 1
+            self.nodes = nodes
+            for device in changed:
+                baseline[device['id']] = device
+            for device_id in removed:
+                del baseline[device_id]
+
+            return {
+                'seq': self.seq,
+                'keyframe': False,
+                'nodes': nodes,
+                'added': added,
+                'moved': moved,
+                'removed': removed
+            }
+
+    def keyframe(self):
+        """Full state matching the latest frame, for a client that fell out of sync"""
+        with self.lock:
+            return self._keyframe()
+
+    def _keyframe(self):
+        return {
+            'seq': self.seq,
+            'keyframe': True,
+            'nodes': self.nodes,
+            'devices': list(self.baseline.values())
+        }
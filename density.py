@@ -0,0 +1,108 @@
+"""
+Server-side density grid for heatmap clients
+Positions are binned into a fixed grid over the floor plan and averaged over
+time with exponential decay, so the payload size depends on the grid, not the
+crowd, and the values do not depend on how often the grid is updated
+"""
+
+import time
+
+import numpy as np
+
+
+# Floor plan extent in metres: (x_min, y_min, x_max, y_max), matching
+# the image bounds in frontend/src/components/HeatMap.jsx
+FLOOR_BOUNDS = (0.0, 0.0, 120.0, 100.0)
+
+
+def gaussian_kernel(sigma):
+    radius = max(1, int(round(3 * sigma)))
+    x = np.arange(-radius, radius + 1)
+    kernel = np.exp(-0.5 * (x / sigma) ** 2)
+    return kernel / kernel.sum()
+
+
+def smooth(grid, sigma):
+    """Separable Gaussian blur with zero padding; sigma is in cells"""
+    if not sigma:
+        return grid
+    kernel = gaussian_kernel(sigma)
+    radius = len(kernel) // 2
+    out = grid
+    for axis in (0, 1):
+        pad = [(0, 0), (0, 0)]
+        pad[axis] = (radius, radius)
+        padded = np.pad(out, pad)
+        size = out.shape[axis]
+        out = sum(
+            w * np.take(padded, np.arange(i, i + size), axis=axis)
+            for i, w in enumerate(kernel)
+        )
+    return out
+
+
+class DensityGrid:
+    def __init__(self, bounds=FLOOR_BOUNDS, cell_size=2.0, sigma=1.0, half_life=10.0,
+                 clock=time.monotonic):
+        self.bounds = tuple(float(b) for b in bounds)
+        self.cell_size = float(cell_size)
+        self.sigma = sigma
+        self.half_life = half_life
+        self.clock = clock
+
+        x0, y0, x1, y1 = self.bounds
+        self.width = max(1, int(np.ceil((x1 - x0) / self.cell_size)))
+        self.height = max(1, int(np.ceil((y1 - y0) / self.cell_size)))
+        self.grid = np.zeros((self.height, self.width))
+        self.time = None
+        self.devices = 0
+
+    def update(self, positions, now=None):
+        """
+        Blend one (N, 2) position snapshot into the grid. Cells hold the
+        time-weighted mean device count per cell: each snapshot is weighted
+        by the time since the previous one, so the result is the same at any
+        broadcast rate. With no half-life the grid is the latest snapshot
+        """
+        if now is None:
+            now = self.clock()
+        if self.time is None or not self.half_life:
+            weight = 1.0
+        else:
+            weight = 1.0 - 0.5 ** (max(now - self.time, 0.0) / self.half_life)
+        self.time = now
+
+        positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+        self.devices = len(positions)
+
+        x0, y0, _, _ = self.bounds
+        col = np.floor((positions[:, 0] - x0) / self.cell_size).astype(np.int64)
+        row = np.floor((positions[:, 1] - y0) / self.cell_size).astype(np.int64)
+        inside = (col >= 0) & (col < self.width) & (row >= 0) & (row < self.height)
+
+        counts = np.bincount(row[inside] * self.width + col[inside],
+                             minlength=self.width * self.height)
+        self.grid += weight * (counts.reshape(self.height, self.width) - self.grid)
+
+    def to_event(self):
+        """
+        Compact 'density_update' payload: row-major uint8 cells (row 0 is y_min)
+        plus the scale that maps a cell byte back to density
+        """
+        density = smooth(self.grid, self.sigma)
+        peak = float(density.max(initial=0.0))
+        scale = peak / 255.0 if peak > 0 else 0.0
+        if scale:
+            cells = np.round(density / scale).astype(np.uint8)
+        else:
+            cells = np.zeros(density.shape, dtype=np.uint8)
+
+        return {
+            'bounds': list(self.bounds),
+            'cellSize': self.cell_size,
+            'width': self.width,
+            'height': self.height,
+            'scale': scale,
+            'devices': self.devices,
+            'cells': cells.tobytes()
+        }
@@ -0,0 +1,264 @@
+"""
+Shared struct-of-arrays device table
+Every MAC is interned to an integer slot once; per-node measurements live in
+contiguous NumPy columns indexed by [slot, node]
+Randomized MACs come and go, so slots are reclaimed by a last-seen TTL and,
+at the hard device limit, least recently seen first; memory stays flat no
+matter how many MACs an event sees
+"""
+
+import time
+
+import numpy as np
+
+
+# One bit per node in the heard mask
+MAX_NODES = 64
+
+# Number of set bits for every byte value, for popcounting the heard mask
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+# Seconds between TTL sweeps; a sweep touches every slot
+SWEEP_INTERVAL = 5.0
+
+
+def _search(sorted_values, sorted_slots, values):
+    """Slot for each value in a sorted index, -1 where absent"""
+    if not len(sorted_values):
+        return np.full(len(values), -1, dtype=np.int64)
+    pos = np.minimum(np.searchsorted(sorted_values, values), len(sorted_values) - 1)
+    return np.where(sorted_values[pos] == values, sorted_slots[pos], -1)
+
+
+class DeviceTable:
+    """
+    max_devices caps the slots (None = unbounded) and ttl drops slots no node
+    has heard for that many seconds (None = never). With link_ids, a new MAC
+    whose firmware id hash matches a known slot takes that slot over, so a
+    phone rotating its MAC keeps its slot and its track key
+    """
+
+    def __init__(self, n_nodes, capacity=1024, clock=time.monotonic, max_devices=None,
+                 ttl=None, link_ids=False):
+        if n_nodes > MAX_NODES:
+            raise ValueError(f"DeviceTable supports at most {MAX_NODES} nodes")
+        self.n_nodes = n_nodes
+        self.clock = clock
+        self.max_devices = max_devices
+        self.ttl = ttl
+        self.link_ids = link_ids
+        self.size = 0
+        self.last_sweep = None
+
+        # Running totals for /metrics
+        self.evicted = {'ttl': 0, 'capacity': 0}
+        self.rejected = 0   # new MACs dropped because one scan alone overflowed the limit
+        self.linked = 0     # new MACs that took over a slot through their id hash
+
+        # Sorted MAC / key / id -> slot indexes, searched with np.searchsorted
+        self._sorted_macs = self._sorted_keys = np.zeros(0, dtype=np.uint64)
+        self._sorted_ids = np.zeros(0, dtype=np.uint32)
+        self._sorted_slots = self._sorted_key_slots = self._sorted_id_slots = np.zeros(
+            0, dtype=np.int64)
+
+        if max_devices:
+            capacity = min(capacity, max_devices)
+        self._allocate(capacity)
+
+    def _allocate(self, capacity):
+        self.capacity = capacity
+        self.macs = np.zeros(capacity, dtype=np.uint64)
+        self.keys = np.zeros(capacity, dtype=np.uint64)    # first MAC of the slot, for tracking
+        self.ids = np.zeros(capacity, dtype=np.uint32)
+        self.distance = np.full((capacity, self.n_nodes), np.nan, dtype=np.float32)
+        self.rssi = np.zeros((capacity, self.n_nodes), dtype=np.int16)
+        self.last_seen = np.zeros((capacity, self.n_nodes), dtype=np.float64)
+        self.heard = np.zeros(capacity, dtype=np.uint64)
+
+    def _columns(self):
+        return (self.macs, self.keys, self.ids, self.distance, self.rssi, self.last_seen,
+                self.heard)
+
+    def _grow(self, needed):
+        capacity = self.capacity
+        while capacity < needed:
+            capacity *= 2
+        if self.max_devices:
+            capacity = min(capacity, self.max_devices)
+        old = self._columns()
+        self._allocate(capacity)
+        n = self.size
+        for new, previous in zip(self._columns(), old):
+            new[:n] = previous[:n]
+
+    def lookup(self, macs):
+        """Slots for the given MACs, -1 where a MAC is not in the table"""
+        return _search(self._sorted_macs, self._sorted_slots, np.asarray(macs, dtype=np.uint64))
+
+    def lookup_keys(self, keys):
+        """Slots for the given track keys (see `keys`), -1 where gone"""
+        if not self.link_ids:
+            return self.lookup(keys)
+        return _search(self._sorted_keys, self._sorted_key_slots,
+                       np.asarray(keys, dtype=np.uint64))
+
+    def intern(self, macs, ids=None):
+        """
+        Slots for the given MACs, allocating new slots for unseen ones
+        At the device limit the least recently seen slots make room; MACs that
+        still do not fit get -1
+        """
+        macs = np.asarray(macs, dtype=np.uint64)
+        slots = self.lookup(macs)
+        missing = slots < 0
+        if missing.any():
+            new_macs, first, inverse = np.unique(macs[missing], return_index=True,
+                                                 return_inverse=True)
+            new_ids = None if ids is None else np.asarray(ids, dtype=np.uint32)[missing][first]
+            new_slots = np.full(len(new_macs), -1, dtype=np.int64)
+
+            if self.link_ids and new_ids is not None:
+                linked = self._link(new_macs, new_ids, slots[~missing])
+                new_slots[linked >= 0] = linked[linked >= 0]
+
+            fresh = np.flatnonzero(new_slots < 0)
+            if len(fresh):
+                if self._make_room(len(fresh), np.concatenate([slots[~missing], new_slots])):
+                    # Compacting moved the slots found above
+                    slots = self.lookup(macs)
+                    new_slots = np.where(new_slots >= 0, self.lookup(new_macs), -1)
+
+                start = self.size
+                room = (self.max_devices - start) if self.max_devices else len(fresh)
+                if room < len(fresh):
+                    self.rejected += len(fresh) - room
+                    fresh = fresh[:room]
+                if start + len(fresh) > self.capacity:
+                    self._grow(start + len(fresh))
+                allocated = np.arange(start, start + len(fresh))
+                self.macs[allocated] = new_macs[fresh]
+                self.keys[allocated] = new_macs[fresh]
+                if new_ids is not None:
+                    self.ids[allocated] = new_ids[fresh]
+                self.size = start + len(fresh)
+                new_slots[fresh] = allocated
+
+            slots[missing] = new_slots[inverse]
+            self._reindex()
+        return slots
+
+    def _link(self, new_macs, new_ids, current):
+        """
+        Existing slot for each new MAC whose id hash is already known, -1 if
+        none. The slot is only taken over when its own MAC is absent from this
+        scan (two phones whose ids collide are both in it) and at most once
+        per scan
+        """
+        slots = _search(self._sorted_ids, self._sorted_id_slots, new_ids)
+        slots[new_ids == 0] = -1
+        slots[np.isin(slots, current)] = -1
+        _, first = np.unique(slots, return_index=True)
+        keep = np.zeros(len(slots), dtype=bool)
+        keep[first] = True
+        slots[~keep] = -1
+
+        linked = slots >= 0
+        self.macs[slots[linked]] = new_macs[linked]
+        self.linked += int(linked.sum())
+        return slots
+
+    def _make_room(self, needed, protect):
+        """
+        Evict the least recently seen slots, sparing `protect`, until `needed`
+        new ones fit; returns True if slots moved
+        """
+        if not self.max_devices:
+            return False
+        excess = self.size + needed - self.max_devices
+        if excess <= 0:
+            return False
+        seen = self.last_seen[:self.size].max(axis=1, initial=0)
+        protect = np.unique(protect[protect >= 0])
+        seen[protect] = np.inf
+        excess = min(excess, self.size - len(protect))
+        if excess <= 0:
+            return False
+        oldest = np.argpartition(seen, excess - 1)[:excess]
+        keep = np.ones(self.size, dtype=bool)
+        keep[oldest] = False
+        self.evicted['capacity'] += self._compact(keep)
+        return True
+
+    def _reindex(self):
+        n = self.size
+        order = np.argsort(self.macs[:n], kind='stable')
+        self._sorted_macs = self.macs[:n][order]
+        self._sorted_slots = order
+        if self.link_ids:
+            order = np.argsort(self.keys[:n], kind='stable')
+            self._sorted_keys = self.keys[:n][order]
+            self._sorted_key_slots = order
+            order = np.argsort(self.ids[:n], kind='stable')
+            self._sorted_ids = self.ids[:n][order]
+            self._sorted_id_slots = order
+
+    def update(self, node, scan, now=None):
+        """Replace node's column with a SCAN_DTYPE array"""
+        if now is None:
+            now = self.clock()
+        if self.ttl is not None and (self.last_sweep is None
+                                     or now - self.last_sweep >= SWEEP_INTERVAL):
+            self.last_sweep = now
+            self.evicted['ttl'] += self.prune(self.ttl, now)
+
+        slots = self.intern(scan['mac'], scan['id'])
+        fits = slots >= 0
+        if not fits.all():
+            scan = scan[fits]
+            slots = slots[fits]
+        bit = np.uint64(1 << node)
+
+        n = self.size
+        self.heard[:n] &= ~bit
+        self.distance[:n, node] = np.nan
+
+        self.heard[slots] |= bit
+        self.distance[slots, node] = scan['distance']
+        self.rssi[slots, node] = scan['rssi']
+        self.last_seen[slots, node] = now
+        self.ids[slots] = scan['id']
+        return slots
+
+    def heard_count(self):
+        """Number of nodes whose latest scan contains each slot"""
+        heard = self.heard[:self.size]
+        return _POPCOUNT[heard.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+    def seen_by(self, k):
+        """Slots heard by at least k nodes"""
+        return np.flatnonzero(self.heard_count() >= k)
+
+    def prune(self, max_age, now=None):
+        """Drop slots no node has heard for max_age seconds; returns the count dropped"""
+        if now is None:
+            now = self.clock()
+        keep = self.last_seen[:self.size].max(axis=1, initial=0) >= now - max_age
+        return self._compact(keep)
+
+    def _compact(self, keep):
+        """Move the kept slots to the front; returns the count dropped"""
+        n = self.size
+        dropped = n - int(keep.sum())
+        if not dropped:
+            return 0
+
+        kept = np.flatnonzero(keep)
+        m = len(kept)
+        for column in self._columns():
+            column[:m] = column[kept]
+        self.distance[m:n] = np.nan
+        self.heard[m:n] = 0
+        self.last_seen[m:n] = 0
+        self.size = m
+        self._reindex()
+        return dropped
@@ -10,6 +10,8 @@ const SOCKET_URL = 'http://localhost:5001';
 function App() {
   const [devices, setDevices] = useState(detectedDevices);
   const [nodes, setNodes] = useState(esp32Nodes);
+  const [density, setDensity] = useState(null);
+  const [zones, setZones] = useState([]);
   const [connectionStatus, setConnectionStatus] = useState('disconnected');
   const [isConnected, setIsConnected] = useState(false);
   const appRef = useRef(null);
@@ -30,16 +32,24 @@ function App() {
 
     window.crowdMapSocket = socket;
 
+    // Delta stream state: devices by id and the last applied sequence number
+    const deviceMap = new Map();
+    let lastSeq = null;
+
     socket.on('connect', () => {
       console.log('✅ Connected to CrowdMap backend!');
       setConnectionStatus('connected');
       setIsConnected(true);
+      lastSeq = null;
+      socket.emit('subscribe', { protocol: 'delta' });
     });
 
     socket.on('disconnect', () => {
       console.log('❌ Disconnected from backend');
       setConnectionStatus('disconnected');
       setIsConnected(false);
+      setDensity(null);
+      setZones([]);
     });
 
     socket.on('connect_error', (error) => {
@@ -60,6 +70,41 @@ function App() {
       }
     });
 
+    socket.on('density_update', (grid) => {
+      setDensity(grid);
+    });
+
+    socket.on('zone_update', (update) => {
+      setZones(update.zones);
+    });
+
+    socket.on('map_delta', (frame) => {
+      if (frame.keyframe) {
+        deviceMap.clear();
+        frame.devices.forEach(device => deviceMap.set(device.id, device));
+      } else if (lastSeq === null || (frame.since ?? frame.seq - 1) !== lastSeq) {
+        // Missed a frame - ask for full state and drop deltas until it arrives.
+        // Throttled clients get merged deltas whose base is `since`, not seq - 1
+        if (lastSeq !== null) {
+          console.log(`⚠️ Delta gap (${lastSeq} -> ${frame.seq}), requesting keyframe`);
+          socket.emit('request_keyframe');
+          lastSeq = null;
+        }
+        return;
+      } else {
+        frame.added.forEach(device => deviceMap.set(device.id, device));
+        frame.moved.forEach(([id, x, y]) => {
+          const device = deviceMap.get(id);
+          if (device) deviceMap.set(id, { ...device, position: [x, y] });
+        });
+        frame.removed.forEach(id => deviceMap.delete(id));
+      }
+
+      lastSeq = frame.seq;
+      setNodes(frame.nodes);
+      setDevices(Array.from(deviceMap.values()));
+    });
+
     return () => {
       socket.disconnect();
     };
@@ -304,6 +349,7 @@ function App() {
           <HeatMap
             devices={devices}
             nodes={nodes}
+            density={density}
             onNodePositionChanged={handleNodePositionChanged}
           />
 
@@ -346,7 +392,7 @@ function App() {
           background: 'linear-gradient(135deg, #0f172a 0%, #1e293b 100%)',
           borderLeft: '1px solid rgba(255, 255, 255, 0.1)'
         }}>
-          <StatsPanel devices={devices} nodes={nodes} />
+          <StatsPanel devices={devices} nodes={nodes} zones={zones} />
         </div>
       </section>
     </div>
@@ -3,7 +3,25 @@ import L from 'leaflet';
 import 'leaflet.heat';
 import './HeatMap.css';
 
-const HeatMap = ({ devices, nodes, onNodePositionChanged }) => {
+// Turn a backend 'density_update' grid into leaflet.heat points [lat, lng, intensity]
+const densityToHeatPoints = (density) => {
+  const cells = new Uint8Array(density.cells);
+  const [x0, y0] = density.bounds;
+  const size = density.cellSize;
+  const points = [];
+
+  for (let row = 0; row < density.height; row++) {
+    for (let col = 0; col < density.width; col++) {
+      const value = cells[row * density.width + col];
+      if (value > 0) {
+        points.push([y0 + (row + 0.5) * size, x0 + (col + 0.5) * size, value / 255]);
+      }
+    }
+  }
+  return points;
+};
+
+const HeatMap = ({ devices, nodes, density, onNodePositionChanged }) => {
   const mapRef = useRef(null);
   const heatLayerRef = useRef(null);
   const mapInstanceRef = useRef(null);
@@ -139,14 +157,16 @@ const HeatMap = ({ devices, nodes, onNodePositionChanged }) => {
       mapInstanceRef.current.removeLayer(heatLayerRef.current);
     }
 
-    if (devices.length === 0) return;
+    // Prefer the server-side density grid; fall back to raw device points
+    const heatData = density
+      ? densityToHeatPoints(density)
+      : devices.map(device => [
+          device.position[1], // lat (y)
+          device.position[0], // lng (x)
+          1.0 // max intensity
+        ]);
 
-    // Create heat map data points [lat, lng, intensity]
-    const heatData = devices.map(device => [
-      device.position[1], // lat (y)
-      device.position[0], // lng (x)
-      1.0 // max intensity
-    ]);
+    if (heatData.length === 0) return;
 
     // Check if L.heatLayer exists
     if (!L.heatLayer) {
@@ -169,7 +189,7 @@ const HeatMap = ({ devices, nodes, onNodePositionChanged }) => {
         1.0: '#ff6b9d'                    // Bright pink
       }
     }).addTo(mapInstanceRef.current);
-  }, [devices]);
+  }, [devices, density]);
 
   return (
     <div className="heatmap-container">
@@ -1,7 +1,7 @@
 import { useEffect, useState } from 'react';
 import './StatsPanel.css';
 
-const StatsPanel = ({ devices, nodes }) => {
+const StatsPanel = ({ devices, nodes, zones = [] }) => {
   const totalDevices = devices.length;
   const activeNodes = nodes.filter(n => n.status === 'online').length;
 
@@ -56,6 +56,28 @@ const StatsPanel = ({ devices, nodes }) => {
           ))}
         </div>
       </div>
+
+      {zones.length > 0 && (
+        <div className="nodes-section">
+          <h2 className="section-title">ZONES</h2>
+          <div className="nodes-list">
+            {zones.map(zone => (
+              <div key={zone.id} className="node-card">
+                <div className="node-info">
+                  <div className="node-name">{zone.name}</div>
+                  <div className="node-id">{zone.id}</div>
+                </div>
+                <div className="node-stats">
+                  <div className="node-stat">
+                    <span className="node-stat-label">DEVICES</span>
+                    <span className="node-stat-value">{zone.count}</span>
+                  </div>
+                </div>
+              </div>
+            ))}
+          </div>
+        </div>
+      )}
     </div>
   );
 };
@@ -0,0 +1,121 @@
+"""
+Time-aligned measurement fusion
+Each receiver keeps a ring of recent scans; fusion resamples every node to
+the same time window so one stale node cannot drag positions around
+"""
+
+import warnings
+
+import numpy as np
+
+
+class ScanRing:
+    """Fixed-size ring buffer of timestamped SCAN_DTYPE arrays"""
+
+    def __init__(self, capacity=16):
+        self.capacity = capacity
+        self.times = np.full(capacity, -np.inf)
+        self.scans = [None] * capacity
+        self.head = 0
+
+    def push(self, scan, now):
+        self.scans[self.head] = scan
+        self.times[self.head] = now
+        self.head = (self.head + 1) % self.capacity
+
+    def since(self, start):
+        """Scans stamped at or after start, oldest first"""
+        order = np.roll(np.arange(self.capacity), -self.head)
+        return [self.scans[i] for i in order[self.times[order] >= start]]
+
+    def frozen(self):
+        """Immutable copy of the ring, for publishing to other threads"""
+        order = np.roll(np.arange(self.capacity), -self.head)
+        return ScanHistory(self.times[order], tuple(self.scans[i] for i in order))
+
+
+class ScanHistory:
+    """Read-only ScanRing contents, oldest first; what receiver snapshots carry"""
+
+    __slots__ = ('times', 'scans')
+
+    def __init__(self, times, scans):
+        times.flags.writeable = False
+        self.times = times
+        self.scans = scans
+
+    def since(self, start):
+        """Scans stamped at or after start, oldest first"""
+        return [self.scans[i] for i in np.flatnonzero(self.times >= start)]
+
+
+def fuse_window(table, rings, window, now):
+    """
+    Median distance per (slot, node) over scans from the last `window` seconds
+    Returns a (table.size, M) float array with NaN where a node has no sample
+    """
+    fused = np.full((table.size, len(rings)), np.nan)
+    start = now - window
+
+    for k, ring in enumerate(rings):
+        scans = ring.since(start)
+        if not scans:
+            continue
+
+        sizes = [len(scan) for scan in scans]
+        merged = np.concatenate(scans)
+        samples = np.repeat(np.arange(len(scans)), sizes)
+
+        slots = table.lookup(merged['mac'])
+        known = slots >= 0
+        slots = slots[known]
+        if not len(slots):
+            continue
+
+        # One row per device that appears in the window, one column per scan
+        rows, row_of = np.unique(slots, return_inverse=True)
+        cube = np.full((len(rows), len(scans)), np.nan)
+        cube[row_of, samples[known]] = merged['distance'][known]
+
+        # Rows whose only samples are unknown distances stay NaN
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            fused[rows, k] = np.nanmedian(cube, axis=1)
+
+    return fused
+
+
+def latest_samples(table, rings, window, now):
+    """
+    Most recent distance per (slot, node) from scans of the last `window`
+    seconds (0 = the whole ring), and the time of the scan it came from
+    Returns two (table.size, M) arrays, NaN where a node has no sample
+    """
+    distances = np.full((table.size, len(rings)), np.nan)
+    stamps = np.full((table.size, len(rings)), np.nan)
+    start = now - window if window else -np.inf
+
+    for k, ring in enumerate(rings):
+        # Oldest first, so a newer sample overwrites an older one
+        for t, scan in zip(ring.times, ring.scans):
+            if scan is None or t < start:
+                continue
+            slots = table.lookup(scan['mac'])
+            known = slots >= 0
+            distances[slots[known], k] = scan['distance'][known]
+            stamps[slots[known], k] = t
+    return distances, stamps
+
+
+def measurements(table, rings, window, min_nodes, now):
+    """
+    Slots heard by at least min_nodes nodes and their (N, M) distance rows
+    window=0 uses each node's latest scan as-is
+    """
+    if window:
+        distances = fuse_window(table, rings, window, now)
+        slots = np.flatnonzero(np.isfinite(distances).sum(axis=1) >= min_nodes)
+        return slots, distances[slots]
+
+    slots = table.seen_by(min_nodes)
+    return slots, table.distance[slots].astype(float)
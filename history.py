@@ -0,0 +1,355 @@
+"""
+On-disk occupancy history
+Every broadcast frame is appended as one row of device count, zone counts and
+density grid, and rolled up into 1 s, 1 min and 15 min buckets as it arrives.
+Each level is a series of segments; a segment is a directory of preallocated,
+memory-mapped .npy columns, so appends write in place and queries slice the
+columns without parsing anything. Retention drops whole segments.
+"""
+
+import json
+import os
+import shutil
+import threading
+
+import numpy as np
+
+
+# name, bucket seconds (0 = every frame), rows per segment, retention seconds
+LEVELS = [
+    ('tick', 0, 4096, 15 * 60),
+    ('1s', 1, 3600, 6 * 3600),
+    ('1m', 60, 1440, 30 * 86400),
+    ('15m', 900, 2880, 365 * 86400),
+]
+
+# Rows a query returns at most when it does not ask for a step
+MAX_POINTS = 2000
+
+
+def column_specs(zones, grid_shape):
+    """name -> (dtype, per-row shape)"""
+    return {
+        'time': ('<f8', ()),          # bucket start, epoch seconds; 0 = unused row
+        'ticks': ('<u4', ()),         # frames folded into the row
+        'devices_mean': ('<f4', ()),
+        'devices_max': ('<f4', ()),
+        'zones_mean': ('<f4', (zones,)),
+        'zones_max': ('<f4', (zones,)),
+        'density': ('<f2', tuple(grid_shape)),
+    }
+
+
+class Segment:
+    """Fixed-capacity columns for one stretch of time at one level"""
+
+    def __init__(self, path, columns, meta):
+        self.path = path
+        self.columns = columns
+        self.meta = meta
+        self.zone_ids = meta['zones']
+        self.grid_shape = tuple(meta['grid'])
+        self.capacity = len(columns['time'])
+        # Rows are written before the count moves, so readers only see whole rows
+        self.count = int(np.count_nonzero(columns['time']))
+
+    @classmethod
+    def create(cls, path, capacity, zone_ids, grid_shape):
+        os.makedirs(path)
+        meta = {'zones': list(zone_ids), 'grid': list(grid_shape), 'capacity': capacity}
+        columns = {
+            name: np.lib.format.open_memmap(os.path.join(path, name + '.npy'), mode='w+',
+                                            dtype=dtype, shape=(capacity,) + shape)
+            for name, (dtype, shape) in column_specs(len(zone_ids), grid_shape).items()
+        }
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+        return cls(path, columns, meta)
+
+    @classmethod
+    def open(cls, path):
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        columns = {
+            name: np.load(os.path.join(path, name + '.npy'), mmap_mode='r+')
+            for name in column_specs(len(meta['zones']), meta['grid'])
+        }
+        return cls(path, columns, meta)
+
+    @property
+    def full(self):
+        return self.count >= self.capacity
+
+    @property
+    def start(self):
+        return float(self.columns['time'][0]) if self.count else None
+
+    @property
+    def end(self):
+        return float(self.columns['time'][self.count - 1]) if self.count else None
+
+    def append(self, row):
+        i = self.count
+        for name, value in row.items():
+            self.columns[name][i] = value
+        self.count = i + 1
+
+    def flush(self):
+        for column in self.columns.values():
+            column.flush()
+
+    def rows(self, start, end):
+        """Slice of every column with start <= time < end"""
+        times = self.columns['time'][:self.count]
+        lo, hi = np.searchsorted(times, [start, end])
+        return {name: column[lo:hi] for name, column in self.columns.items()}
+
+
+class Level:
+    def __init__(self, root, name, bucket, capacity, retention):
+        self.path = os.path.join(root, name)
+        self.name = name
+        self.bucket = bucket
+        self.capacity = capacity
+        self.retention = retention
+        self.lock = threading.Lock()    # guards the segment list, not appends
+
+        os.makedirs(self.path, exist_ok=True)
+        self.segments = []
+        for entry in os.listdir(self.path):
+            try:
+                self.segments.append(Segment.open(os.path.join(self.path, entry)))
+            except (OSError, ValueError, KeyError):
+                print(f"⚠️ Skipping unreadable history segment {entry}")
+        self.segments.sort(key=lambda s: (s.count == 0, s.start or 0.0))
+
+        # Rollup accumulator for the bucket being filled
+        self.pending = None
+
+    def append(self, row):
+        segment = self.segments[-1] if self.segments else None
+        if (segment is None or segment.full or segment.zone_ids != row['zone_ids']
+                or segment.grid_shape != row['density'].shape):
+            segment = self._new_segment(row)
+        segment.append({name: value for name, value in row.items() if name != 'zone_ids'})
+
+    def _new_segment(self, row):
+        path = os.path.join(self.path, str(int(row['time'] * 1000)))
+        while os.path.exists(path):
+            path += '+'
+        segment = Segment.create(path, self.capacity, row['zone_ids'], row['density'].shape)
+        with self.lock:
+            if self.segments:
+                self.segments[-1].flush()
+            self.segments.append(segment)
+        self.expire(row['time'])
+        return segment
+
+    def expire(self, now):
+        """Delete segments that ended before the retention window"""
+        with self.lock:
+            old = [s for s in self.segments[:-1] if s.end is None or s.end < now - self.retention]
+            self.segments = [s for s in self.segments if s not in old]
+        for segment in old:
+            shutil.rmtree(segment.path, ignore_errors=True)
+
+    def roll(self, t, devices, zone_ids, zones, grid):
+        """Fold one frame into the current bucket, writing the previous bucket when t leaves it"""
+        start = np.floor(t / self.bucket) * self.bucket
+        pending = self.pending
+        if pending is not None and (pending['time'] != start or pending['zone_ids'] != zone_ids
+                                    or pending['grid'].shape != grid.shape):
+            self.flush_pending()
+            pending = None
+        if pending is None:
+            self.pending = {
+                'time': start, 'ticks': 0, 'zone_ids': zone_ids,
+                'devices_sum': 0.0, 'devices_max': 0.0,
+                'zones_sum': np.zeros(len(zones)), 'zones_max': np.zeros(len(zones)),
+                'grid': np.zeros(grid.shape),
+            }
+            pending = self.pending
+        pending['ticks'] += 1
+        pending['devices_sum'] += devices
+        pending['devices_max'] = max(pending['devices_max'], devices)
+        pending['zones_sum'] += zones
+        np.maximum(pending['zones_max'], zones, out=pending['zones_max'])
+        pending['grid'] += grid
+
+    def flush_pending(self):
+        pending, self.pending = self.pending, None
+        if pending is None:
+            return
+        n = pending['ticks']
+        self.append({
+            'time': pending['time'],
+            'ticks': n,
+            'devices_mean': pending['devices_sum'] / n,
+            'devices_max': pending['devices_max'],
+            'zones_mean': pending['zones_sum'] / n,
+            'zones_max': pending['zones_max'],
+            'density': pending['grid'] / n,
+            'zone_ids': pending['zone_ids'],
+        })
+
+    @property
+    def start(self):
+        with self.lock:
+            starts = [s.start for s in self.segments if s.count]
+        return min(starts) if starts else None
+
+    def first(self, start, end):
+        """Time of the earliest row with start <= time < end, or None"""
+        with self.lock:
+            segments = [s for s in self.segments
+                        if s.count and s.start < end and s.end >= start]
+        for segment in segments:
+            times = segment.columns['time'][:segment.count]
+            i = np.searchsorted(times, start)
+            if i < len(times) and times[i] < end:
+                return float(times[i])
+        return None
+
+    def query(self, start, end):
+        with self.lock:
+            segments = [s for s in self.segments
+                        if s.count and s.start < end and s.end >= start]
+        return [(segment.zone_ids, segment.rows(start, end)) for segment in segments]
+
+
+class HistoryStore:
+    def __init__(self, root, levels=LEVELS):
+        self.root = root
+        self.levels = [Level(root, *level) for level in levels]
+        self.frames = 0
+
+    def append(self, t, devices, zone_ids, zones, grid):
+        """
+        Record one frame: epoch seconds, device count, zone ids and their
+        counts, and the (H, W) density grid
+        """
+        zone_ids = list(zone_ids)
+        zones = np.asarray(zones, dtype=float)
+        grid = np.asarray(grid, dtype=float)
+        for level in self.levels:
+            if level.bucket:
+                level.roll(t, devices, zone_ids, zones, grid)
+            else:
+                level.append({
+                    'time': t, 'ticks': 1, 'devices_mean': devices, 'devices_max': devices,
+                    'zones_mean': zones, 'zones_max': zones, 'density': grid,
+                    'zone_ids': zone_ids,
+                })
+        self.frames += 1
+
+    def choose_level(self, start, end, step=None, max_points=MAX_POINTS):
+        """
+        Level to answer [start, end) from. The preferred level is the one
+        whose bucket is closest to `step` without exceeding it, or without a
+        step the finest one returning at most max_points rows. It is used if
+        it has rows in the range, unless a coarser level's rows start more
+        than one of its buckets earlier (the finer level aged them out). A
+        level with no rows in the range falls through to the next coarser
+        one; with a step and nothing that coarse yet, to finer ones
+        """
+        candidates = self.levels
+        finer = []
+        if step:
+            fine_enough = [level for level in self.levels if level.bucket <= step]
+            candidates = fine_enough[-1:] or self.levels[:1]
+            candidates += [level for level in self.levels if level.bucket > step]
+            finer = fine_enough[-2::-1]
+        else:
+            span = max(end - start, 0.0)
+            candidates = [level for level in self.levels
+                          if level.bucket and span / level.bucket <= max_points] or self.levels[-1:]
+
+        best, best_first = None, None
+        for level in candidates:
+            first = level.first(start, end)
+            if first is not None and (best is None or first < best_first - level.bucket):
+                best, best_first = level, first
+        if best is None:
+            best = next((level for level in finer if level.first(start, end) is not None), None)
+        return best or candidates[0]
+
+    def query(self, start, end, step=None, max_points=MAX_POINTS, zone=None, density=False):
+        """Time range as JSON-ready columns at the chosen resolution"""
+        level = self.choose_level(start, end, step, max_points)
+        parts = level.query(start, end)
+
+        zone_ids = []
+        for ids, _ in parts:
+            zone_ids.extend(z for z in ids if z not in zone_ids)
+        if zone is not None:
+            zone_ids = [z for z in zone_ids if z == zone]
+
+        times, ticks, devices_mean, devices_max = [], [], [], []
+        zones = {z: {'mean': [], 'max': []} for z in zone_ids}
+        grid_sum = None
+        grid_max = None
+        grid_rows = 0
+
+        for ids, rows in parts:
+            n = len(rows['time'])
+            if not n:
+                continue
+            times.append(rows['time'])
+            ticks.append(rows['ticks'])
+            devices_mean.append(rows['devices_mean'])
+            devices_max.append(rows['devices_max'])
+            for z in zone_ids:
+                if z in ids:
+                    k = ids.index(z)
+                    zones[z]['mean'].append(rows['zones_mean'][:, k])
+                    zones[z]['max'].append(rows['zones_max'][:, k])
+                else:
+                    zones[z]['mean'].append(np.full(n, np.nan))
+                    zones[z]['max'].append(np.full(n, np.nan))
+            if density:
+                # float16 on disk; widen once, reductions on it are slow
+                grid = rows['density'].astype(np.float32)
+                if grid_sum is None or grid_sum.shape != grid.shape[1:]:
+                    grid_sum = np.zeros(grid.shape[1:])
+                    grid_max = np.zeros(grid.shape[1:])
+                    grid_rows = 0
+                grid_sum += grid.sum(axis=0)
+                np.maximum(grid_max, grid.max(axis=0), out=grid_max)
+                grid_rows += n
+
+        def join(chunks, digits=2):
+            if not chunks:
+                return []
+            values = np.round(np.concatenate(chunks).astype(float), digits)
+            missing = np.isnan(values)
+            if missing.any():
+                # Zones that did not exist yet read as null
+                values = values.astype(object)
+                values[missing] = None
+            return values.tolist()
+
+        result = {
+            'resolution': level.name,
+            'step': level.bucket,
+            'start': start,
+            'end': end,
+            'time': join(times, 3),
+            'ticks': join(ticks, 0),
+            'devices': {'mean': join(devices_mean), 'max': join(devices_max)},
+            'zones': {z: {'mean': join(c['mean']), 'max': join(c['max'])}
+                      for z, c in zones.items()},
+        }
+        if density and grid_rows:
+            result['density'] = {
+                'height': grid_sum.shape[0],
+                'width': grid_sum.shape[1],
+                'mean': np.round(grid_sum / grid_rows, 3).ravel().tolist(),
+                'max': np.round(grid_max, 3).ravel().tolist(),
+            }
+        return result
+
+    def close(self):
+        for level in self.levels:
+            level.flush_pending()
+            for segment in level.segments:
+                segment.flush()
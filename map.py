@@ -1,175 +1,176 @@
+import argparse
 import asyncio
-import json
-import re
-from bleak import BleakClient, BleakScanner
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
 import matplotlib.pyplot as plt
-from matplotlib.animation import FuncAnimation
+from matplotlib.animation import FFMpegWriter, FuncAnimation, PillowWriter
 import numpy as np
+from density import FLOOR_BOUNDS
+from device_table import DeviceTable
+from fusion import measurements
+from nodes import NodeRegistry
+from connection import ConnectionManager
+from receiver import ESP32Receiver
+from simulator import CrowdSimulator
+from triangulation import Multilateration
 
 
-# UUIDs - must match ESP32
-SERVICE_UUID = "12345678-1234-1234-1234-1234567890ab"
-CHAR_UUID = "87654321-4321-4321-4321-abcdefabcdef"
+# ESP32 nodes to connect to (you can adjust positions based on your actual setup)
+# Forming a triangle for better triangulation
+ESP32_NODES = [
+    {'id': 'ESP1', 'device': 'ESP32_Crowd_Node_1', 'position': [20, 90]},    # Bottom left
+    {'id': 'ESP2', 'device': 'ESP32_Crowd_Node_2', 'position': [100, 80]},   # Bottom right
+    {'id': 'ESP3', 'device': 'ESP32_Crowd_Node_3', 'position': [30, 10]},    # Top
+]
 
+# Seconds of scans fused (median per node) before multilateration; 0 = latest scan only
+FUSION_WINDOW = 6.0
 
-# ESP32 devices to connect to
-ESP32_DEVICES = [
-    "ESP32_Crowd_Node_1",
-    "ESP32_Crowd_Node_2",
-    "ESP32_Crowd_Node_3"
-]
+# Per-MAC table slots are reclaimed after DEVICE_TTL seconds unheard, or least
+# recently seen first once DEVICE_LIMIT MACs are held
+DEVICE_LIMIT = 20000
+DEVICE_TTL = 120.0
 
+# Marker colours, cycled when there are more nodes than entries
+NODE_COLORS = ['blue', 'green', 'purple', 'orange', 'brown', 'teal', 'magenta', 'olive']
 
-class ESP32Receiver:
-    def __init__(self, name):
-        self.name = name
-        self.address = None
-        self.client = None
-        self.chunk_buffer = {}
-        self.total_chunks = 0
-        self.latest_data = {}
-        self.receiving = False
-        self.first_data_received = False  # NEW: Track first data
-       
-    def notification_handler(self, sender, data):
-        """Handle chunked JSON data"""
-        try:
-            raw_str = data.decode('utf-8')
-           
-            if not raw_str:
-                return
-           
-            # Mark that we've received data
-            if not self.first_data_received:
-                self.first_data_received = True
-                print(f"🎉 [{self.name}] First data received!")
-           
-            # Check if this is chunked data: [1/3]data
-            chunk_match = re.match(r'\[(\d+)/(\d+)\](.*)', raw_str, re.DOTALL)
-           
-            if chunk_match:
-                chunk_num = int(chunk_match.group(1))
-                total_chunks = int(chunk_match.group(2))
-                chunk_data = chunk_match.group(3)
-               
-                # New session
-                if chunk_num == 1:
-                    self.chunk_buffer = {}
-                    self.total_chunks = total_chunks
-                    self.receiving = True
-                    print(f"📦 [{self.name}] Receiving {total_chunks} chunks...")
-               
-                # Store chunk
-                self.chunk_buffer[chunk_num] = chunk_data
-               
-                # Progress indicator for large transfers
-                if chunk_num % 10 == 0 or chunk_num == total_chunks:
-                    print(f"  [{self.name}] Progress: {chunk_num}/{total_chunks} chunks")
-               
-                # Check if we have all chunks
-                if len(self.chunk_buffer) == total_chunks:
-                    print(f"  [{self.name}] Reassembling {total_chunks} chunks...")
-                   
-                    # Reassemble
-                    full_data = ''.join([self.chunk_buffer[i] for i in sorted(self.chunk_buffer.keys())])
-                   
-                    # Parse and store
-                    try:
-                        json_data = json.loads(full_data)
-                        self.process_data(json_data)
-                        print(f"✓ [{self.name}] Complete: {len(self.latest_data)} devices\n")
-                    except json.JSONDecodeError as e:
-                        print(f"⚠ [{self.name}] JSON Error: {e}")
-                        print(f"  Data length: {len(full_data)} bytes")
-                   
-                    # Clear buffer
-                    self.chunk_buffer = {}
-                    self.receiving = False
-            else:
-                # Not chunked, process directly
-                json_data = json.loads(raw_str)
-                self.process_data(json_data)
-           
-        except Exception as e:
-            print(f"⚠ [{self.name}] Error: {e}")
+# Seconds between snapshots computed on the BLE thread
+SNAPSHOT_INTERVAL = 0.5
+
+# Frames per second the viewer (or headless capture) renders at
+RENDER_FPS = 10.0
+
+# Everything the viewer draws; built on the BLE thread, never modified afterwards
+Snapshot = namedtuple('Snapshot', ['version', 'time', 'positions', 'info'])
+
+
+class SnapshotSource:
+    """Multilaterate the crowd and publish the result for the renderer"""
+    
+    def __init__(self, receivers, registry, table, clock=time.monotonic):
+        # receivers[k] is the link for registry node k and writes table column k
+        self.receivers = receivers
+        self.registry = registry
+        self.table = table
+        self.clock = clock
+       
+        # Node geometry is fixed for the viewer, so cache it once
+        self.solver = Multilateration(registry.positions())
+        self.latest = Snapshot(0, clock(), np.empty((0, 2)), "Status: Waiting...")
+   
+    def refresh(self):
+        """Build a new snapshot; must run on the thread that owns the receivers"""
+        now = self.clock()
+        snapshots = [receiver.snapshot for receiver in self.receivers]
+        slots, distances = measurements(
+            self.table, [snapshot.history for snapshot in snapshots],
+            FUSION_WINDOW, self.solver.min_nodes, now)
+        heard_enough = len(slots)
+        all_started = all(receiver.first_data_received for receiver in self.receivers)
+       
+        lines = [f"Status: {'Receiving' if all_started else 'Waiting...'}"]
+        lines.extend(f"{node.name} Devices: {len(snapshot.scan)} ({receiver.status})"
+                     for node, receiver, snapshot in zip(self.registry, self.receivers, snapshots))
+        lines.append(f"Devices (>={self.solver.min_nodes} nodes): {heard_enough}")
+       
+        positions = np.empty((0, 2))
+        if not heard_enough:
+            lines.append("No common devices yet" if all_started else "Waiting for first scan...")
+        else:
+            # Multilaterate every device in one batch
+            solved = self.solver.solve(distances)
+            positions = solved.data[~solved.mask.any(axis=1)]
+            lines.append(f"Triangulated: {len(positions)}" if len(positions)
+                         else "No valid triangulations")
+       
+        # A single reference swap, so the renderer never sees a half-built snapshot
+        self.latest = Snapshot(self.latest.version + 1, now, positions, "\n".join(lines))
+        return self.latest
+
+
+class LinkThread(threading.Thread):
+    """
+    Runs the Bleak (or simulator) event loop away from the GUI, refreshing the
+    snapshot every `interval` seconds between notifications
+    """
+    
+    def __init__(self, receivers, registry, source, simulate=None, sim_speed=1.0,
+                 interval=SNAPSHOT_INTERVAL):
+        super().__init__(name='ble', daemon=True)
+        self.receivers = receivers
+        self.registry = registry
+        self.source = source
+        self.simulate = simulate
+        self.sim_speed = sim_speed
+        self.interval = interval
+       
+        self.ready = threading.Event()    # set once the links are up (or failed)
+        self.connected = False
+        self.loop = None
+        self.stopping = None
    
-    def process_data(self, json_data):
-        """Store device data indexed by MAC"""
-        self.latest_data = {}
-        for device in json_data.get('devices', []):
-            mac = device['mac']
-            self.latest_data[mac] = {
-                'distance': device['distance'],
-                'rssi': device['rssi'],
-                'id': device['id']
-            }
+    def run(self):
+        asyncio.run(self.main())
    
-    async def find_and_connect(self):
-        """Find and connect to ESP32"""
-        print(f"🔍 Scanning for '{self.name}'...")
-        devices = await BleakScanner.discover(timeout=10.0)
-       
-        # Find device
-        for device in devices:
-            if device.name == self.name:
-                self.address = device.address
-                print(f"✓ Found: {self.name} ({self.address})")
-                break
-       
-        if not self.address:
-            print(f"✗ {self.name} not found")
-            return False
+    async def main(self):
+        self.loop = asyncio.get_running_loop()
+        self.stopping = asyncio.Event()
+        manager = None
        
-        # Connect
         try:
-            print(f"🔗 Connecting to {self.name}...")
-            self.client = BleakClient(self.address, timeout=20.0)
-            await self.client.connect()
-           
-            if self.client.is_connected:
-                print(f"✓ {self.name} connected!")
-               
-                # CRITICAL: Wait before subscribing
-                await asyncio.sleep(0.5)
-               
-                # Subscribe to notifications
-                print(f"📡 [{self.name}] Subscribing to notifications...")
-                await self.client.start_notify(CHAR_UUID, self.notification_handler)
-                print(f"✓ [{self.name}] Subscribed!")
-               
-                # Wait a bit for ESP32 to register subscription
-                await asyncio.sleep(1.0)
-               
-                return True
-        except Exception as e:
-            print(f"✗ {self.name} connection failed: {e}")
-            import traceback
-            traceback.print_exc()
-            return False
+            if self.simulate:
+                # Synthetic crowd instead of real ESP32s
+                simulator = CrowdSimulator(self.registry, self.simulate, speed=self.sim_speed)
+                simulator.attach(self.receivers)
+                simulator.start()
+                self.connected = True
+            else:
+                # Connect to devices; dropped links are reconnected in the background
+                manager, self.connected = await connect_all(self.receivers)
+        finally:
+            self.ready.set()
        
-        return False
+        try:
+            while self.connected and not self.stopping.is_set():
+                try:
+                    self.source.refresh()
+                except Exception as e:
+                    print(f"Error building snapshot: {e}")
+                try:
+                    await asyncio.wait_for(self.stopping.wait(), self.interval)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            print("Disconnecting devices...")
+            if manager:
+                await manager.stop()
+            for receiver in self.receivers:
+                await receiver.disconnect()
+            print("✓ Disconnected")
    
-    async def disconnect(self):
-        """Disconnect from ESP32"""
-        if self.client and self.client.is_connected:
+    def stop(self):
+        """Ask the event loop to disconnect and wait for it; callable from any thread"""
+        loop = self.loop
+        if loop is not None and not loop.is_closed():
             try:
-                await self.client.stop_notify(CHAR_UUID)
-                await self.client.disconnect()
-            except:
-                pass
+                loop.call_soon_threadsafe(self.stopping.set)
+            except RuntimeError:
+                pass    # loop closed in the meantime
+        self.join(timeout=10)
 
 
 class TriangulationPlotter:
-    def __init__(self, receiver1, receiver2, receiver3):
-        self.receiver1 = receiver1
-        self.receiver2 = receiver2
-        self.receiver3 = receiver3
-       
-        # ESP32 positions (you can adjust these based on your actual setup)
-        # Forming a triangle for better triangulation
-        self.esp1_pos = np.array([20, 90])      # Bottom left
-        self.esp2_pos = np.array([100, 80])     # Bottom right
-        self.esp3_pos = np.array([30, 10])   # Top (equilateral triangle)
+    """
+    Persistent artists redrawn with blitting: only the device scatter and the
+    info box change between frames, the axes and node markers are drawn once
+    """
+    
+    def __init__(self, registry, receivers):
+        self.registry = registry
+        self.drawn = None    # version of the snapshot on screen
        
         # Setup plot
         self.fig, self.ax = plt.subplots(figsize=(12, 10))
@@ -179,194 +180,161 @@ class TriangulationPlotter:
         self.ax.grid(True, alpha=0.3)
         self.ax.set_aspect('equal')
        
-        # Set axis limits
-        self.ax.set_xlim(-2, 12)
-        self.ax.set_ylim(-2, 11)
+        # Floor plan plus a small margin
+        x_min, y_min, x_max, y_max = FLOOR_BOUNDS
+        margin = 0.05 * max(x_max - x_min, y_max - y_min)
+        self.ax.set_xlim(x_min - margin, x_max + margin)
+        self.ax.set_ylim(y_min - margin, y_max + margin)
        
-        # Scatter plot for devices
-        self.scatter = self.ax.scatter([], [], c='red', s=100, alpha=0.6,
-                                      edgecolors='black', label='Devices')
+        # Scatter plot for devices; animated artists are left out of the cached background
+        self.scatter = self.ax.scatter(np.empty(0), np.empty(0), c='red', s=100, alpha=0.6,
+                                       edgecolors='black', label='Devices', animated=True)
        
         # Info text
         self.info_text = self.ax.text(
             0.02, 0.98, '', transform=self.ax.transAxes,
             verticalalignment='top', fontsize=10,
-            bbox=dict(boxstyle='round', facecolor='wheat', alpha=0.8)
+            bbox=dict(boxstyle='round', facecolor='wheat', alpha=0.8),
+            animated=True
         )
+        self.artists = [self.scatter, self.info_text]
        
         # ESP32 markers
-        self.ax.scatter([self.esp1_pos[0]], [self.esp1_pos[1]], c='blue', s=300,
-                       marker='s', edgecolors='black', linewidths=2,
-                       label=receiver1.name, zorder=10)
-        self.ax.text(self.esp1_pos[0]+0.3, self.esp1_pos[1]+0.3, 'ESP1',
-                    fontsize=9, fontweight='bold', color='blue')
-       
-        self.ax.scatter([self.esp2_pos[0]], [self.esp2_pos[1]], c='green', s=300,
-                       marker='s', edgecolors='black', linewidths=2,
-                       label=receiver2.name, zorder=10)
-        self.ax.text(self.esp2_pos[0]+0.3, self.esp2_pos[1]+0.3, 'ESP2',
-                    fontsize=9, fontweight='bold', color='green')
-       
-        self.ax.scatter([self.esp3_pos[0]], [self.esp3_pos[1]], c='purple', s=300,
-                       marker='s', edgecolors='black', linewidths=2,
-                       label=receiver3.name, zorder=10)
-        self.ax.text(self.esp3_pos[0]+0.3, self.esp3_pos[1]+0.3, 'ESP3',
-                    fontsize=9, fontweight='bold', color='purple')
+        for k, (node, receiver) in enumerate(zip(registry, receivers)):
+            color = NODE_COLORS[k % len(NODE_COLORS)]
+            self.ax.scatter([node.position[0]], [node.position[1]], c=color, s=300,
+                           marker='s', edgecolors='black', linewidths=2,
+                           label=receiver.name, zorder=10)
+            self.ax.text(node.position[0] + margin / 4, node.position[1] + margin / 4, node.name,
+                        fontsize=9, fontweight='bold', color=color)
        
         self.ax.legend(loc='upper right')
    
-    def triangulate(self, d1, d2, d3):
+    def update_plot(self, snapshot):
+        """Point the persistent artists at a snapshot; a no-op if it is already shown"""
+        if snapshot.version != self.drawn:
+            self.scatter.set_offsets(snapshot.positions)
+            self.info_text.set_text(snapshot.info)
+            self.drawn = snapshot.version
+        return self.artists
+   
+    def show(self, source, fps=RENDER_FPS):
+        """Interactive window; FuncAnimation blits on the GUI timer, never touching BLE"""
+        self.animation = FuncAnimation(self.fig, lambda frame: self.update_plot(source.latest),
+                                       interval=1000.0 / fps, blit=True,
+                                       cache_frame_data=False)
+        plt.show()
+   
+    def capture(self, source, path, fps=RENDER_FPS, frames=0, dpi=100):
         """
-        Triangulate position using three distance measurements
-        Returns (x, y) position or None if triangulation fails
+        Headless capture: a directory gets numbered PNGs, a .mp4 or .gif path a video
+        Renders `frames` frames (0 = until interrupted) at `fps` in real time
         """
-        # Using trilateration algorithm
-        # https://en.wikipedia.org/wiki/True_range_multilateration
-       
-        p1 = self.esp1_pos
-        p2 = self.esp2_pos
-        p3 = self.esp3_pos
-       
-        # Vector from p1 to p2
-        ex = (p2 - p1) / np.linalg.norm(p2 - p1)
-       
-        # Signed magnitude of the x component
-        i = np.dot(ex, p3 - p1)
-       
-        # The y component
-        ey = (p3 - p1 - i * ex) / np.linalg.norm(p3 - p1 - i * ex)
-       
-        # The z component (perpendicular to both)
-        ez = np.cross(ex, ey)
-       
-        # Distance between p1 and p2
-        d = np.linalg.norm(p2 - p1)
-       
-        # Distance of p3 along ex
-        j = np.dot(ey, p3 - p1)
-       
-        # Coordinates in the new coordinate system
-        x = (d1**2 - d2**2 + d**2) / (2 * d)
-        y = (d1**2 - d3**2 + i**2 + j**2) / (2 * j) - (i / j) * x
-       
-        # Convert back to original coordinate system
-        position = p1 + x * ex + y * ey
-       
-        # Basic sanity check
-        if np.isnan(position).any() or np.isinf(position).any():
-            return None
-       
-        return position
-   
-    def update_plot(self, frame):
-        """Update the scatter plot with triangulated positions"""
-        # Find common devices across all three ESP32s
-        macs1 = set(self.receiver1.latest_data.keys())
-        macs2 = set(self.receiver2.latest_data.keys())
-        macs3 = set(self.receiver3.latest_data.keys())
-        common_macs = macs1.intersection(macs2).intersection(macs3)
-       
-        # Update info text
-        data_status = "Waiting..." if not (self.receiver1.first_data_received and
-                                           self.receiver2.first_data_received and
-                                           self.receiver3.first_data_received) else "Receiving"
-        info = f"Status: {data_status}\n"
-        info += f"ESP1 Devices: {len(macs1)}\n"
-        info += f"ESP2 Devices: {len(macs2)}\n"
-        info += f"ESP3 Devices: {len(macs3)}\n"
-        info += f"Common Devices: {len(common_macs)}\n"
-       
-        if not common_macs:
-            if not (self.receiver1.first_data_received and
-                   self.receiver2.first_data_received and
-                   self.receiver3.first_data_received):
-                info += "Waiting for first scan..."
-            else:
-                info += "No common devices yet"
-            self.info_text.set_text(info)
-            return [self.scatter, self.info_text]
-       
-        # Triangulate positions
-        positions = []
-       
-        for mac in common_macs:
-            d1 = self.receiver1.latest_data[mac]['distance']
-            d2 = self.receiver2.latest_data[mac]['distance']
-            d3 = self.receiver3.latest_data[mac]['distance']
-           
-            pos = self.triangulate(d1, d2, d3)
-            if pos is not None:
-                positions.append(pos)
-       
-        if positions:
-            positions = np.array(positions)
-            self.scatter.set_offsets(positions)
-            info += f"Triangulated: {len(positions)}"
+        ext = os.path.splitext(path)[1].lower()
+        if ext == '.gif':
+            writer = PillowWriter(fps=fps)
+        elif ext in ('.mp4', '.mkv', '.avi', '.mov'):
+            if not FFMpegWriter.isAvailable():
+                raise RuntimeError("ffmpeg not found; install it or capture PNG frames instead")
+            writer = FFMpegWriter(fps=fps)
         else:
-            info += "No valid triangulations"
+            writer = None
+            os.makedirs(path, exist_ok=True)
        
-        self.info_text.set_text(info)
+        # Persistent artists are excluded from savefig while animated
+        for artist in self.artists:
+            artist.set_animated(False)
        
-        return [self.scatter, self.info_text]
+        def frame_loop(save):
+            count = 0
+            next_frame = time.monotonic()
+            try:
+                while not frames or count < frames:
+                    self.update_plot(source.latest)
+                    save(count)
+                    count += 1
+                    next_frame += 1.0 / fps
+                    time.sleep(max(0.0, next_frame - time.monotonic()))
+            except KeyboardInterrupt:
+                print("\n\n🛑 Stopping...")
+            return count
+       
+        if writer is None:
+            count = frame_loop(lambda i: self.fig.savefig(
+                os.path.join(path, f'frame_{i:06d}.png'), dpi=dpi))
+        else:
+            with writer.saving(self.fig, path, dpi):
+                count = frame_loop(lambda i: writer.grab_frame())
+        print(f"💾 Wrote {count} frames to {path}")
 
 
-async def connect_all(receivers):
-    """Connect to all ESP32s"""
+async def connect_all(receivers, timeout=5.0):
+    """Supervise every ESP32 link; returns the manager once all are up or timeout passes"""
     print("Connecting to all ESP32 devices...\n")
-    connection_tasks = [receiver.find_and_connect() for receiver in receivers]
-    results = await asyncio.gather(*connection_tasks)
+    manager = ConnectionManager(receivers)
+    manager.start()
+    connected_count = await manager.wait_connected(timeout)
+    print(f"\n✓ Connected to {connected_count}/{len(receivers)} devices\n")
    
-    connected_count = sum(results)
-    print(f"\n✓ Connected to {connected_count}/{len(ESP32_DEVICES)} devices\n")
-   
-    return connected_count > 0
+    return manager, connected_count > 0
 
 
-async def main():
+def main(simulate=None, sim_speed=1.0, headless=None, fps=RENDER_FPS, frames=0):
     print("="*70)
     print("Triple ESP32 Triangulation Map")
     print("="*70 + "\n")
    
+    if headless:
+        plt.switch_backend('Agg')
+   
     # Create receiver objects
-    receiver1 = ESP32Receiver(ESP32_DEVICES[0])
-    receiver2 = ESP32Receiver(ESP32_DEVICES[1])
-    receiver3 = ESP32Receiver(ESP32_DEVICES[2])
+    registry = NodeRegistry.from_config(ESP32_NODES)
+    table = DeviceTable(len(registry), max_devices=DEVICE_LIMIT, ttl=DEVICE_TTL)
+    receivers = [ESP32Receiver(node.device_name, table, k) for k, node in enumerate(registry)]
+    source = SnapshotSource(receivers, registry, table)
    
-    # Connect to devices
-    if not await connect_all([receiver1, receiver2, receiver3]):
+    # BLE (or the simulator) gets its own event loop; the GUI only reads snapshots
+    link = LinkThread(receivers, registry, source, simulate, sim_speed)
+    link.start()
+    link.ready.wait()
+    if not link.connected:
         print("❌ No devices connected. Exiting.")
+        link.stop()
         return
    
-    print("⏳ Waiting for ESP32s to start scanning (3-5 seconds)...")
-    await asyncio.sleep(5)  # Give ESP32s time to start their first scan
-   
     print("🎨 Launching visualization...")
    
     # Create plotter
-    plotter = TriangulationPlotter(receiver1, receiver2, receiver3)
+    plotter = TriangulationPlotter(registry, receivers)
    
-    # Setup non-blocking plot
-    plt.ion()
-    plt.show(block=False)
-   
-    # Keep updating
     try:
-        while plt.fignum_exists(plotter.fig.number):
-            plotter.update_plot(None)
-            plt.pause(1.0)
-            await asyncio.sleep(0.01)
+        if headless:
+            plotter.capture(source, headless, fps, frames)
+        else:
+            plotter.show(source, fps)
     except KeyboardInterrupt:
         print("\n\n🛑 Stopping...")
     finally:
-        print("Disconnecting devices...")
-        await receiver1.disconnect()
-        await receiver2.disconnect()
-        await receiver3.disconnect()
-        print("✓ Disconnected")
+        link.stop()
         plt.close('all')
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Triple ESP32 Triangulation Map")
+    parser.add_argument('--simulate', type=int, metavar='DEVICES',
+                        help="Run without ESP32s: simulate a crowd of DEVICES phones")
+    parser.add_argument('--sim-speed', type=float, default=1.0,
+                        help="Simulated seconds per real second (0 = as fast as possible)")
+    parser.add_argument('--headless', metavar='PATH',
+                        help="No window: write PNG frames to the directory PATH, "
+                             "or a video if PATH ends in .mp4 or .gif")
+    parser.add_argument('--fps', type=float, default=RENDER_FPS,
+                        help="Frames rendered per second")
+    parser.add_argument('--frames', type=int, default=0,
+                        help="Stop a headless capture after this many frames (0 = until Ctrl+C)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+   
     try:
         import matplotlib
         import numpy
@@ -377,4 +345,4 @@ if __name__ == "__main__":
         print("  pip install bleak numpy matplotlib")
         exit(1)
    
-    asyncio.run(main())
+    main(args.simulate, args.sim_speed, args.headless, args.fps, args.frames)
@@ -3,286 +3,380 @@ WebSocket Server Integration for CrowdMap
 Sends real-time triangulation data to the React frontend
 """
 
+import argparse
 import asyncio
-import json
-import re
-from bleak import BleakClient, BleakScanner
+import logging
+import threading
+import time
+from collections import namedtuple
 import numpy as np
-from flask import Flask
+from flask import Flask, Response, request
 from flask_socketio import SocketIO
 from flask_cors import CORS
+from capture import CaptureLog, CaptureRecorder, Replayer
+from connection import ConnectionManager
+from delta import DeltaEncoder
+from density import DensityGrid
+from device_table import DeviceTable
+from fusion import latest_samples
+from history import MAX_POINTS as HISTORY_MAX_POINTS, HistoryStore
+import metrics
+import tracing
+from nodes import NodeRegistry
+from outbox import FrameDispatcher, transport_backlog
+from receiver import ESP32Receiver
+from scan_format import format_id
+from scheduler import BroadcastScheduler
+from sharding import ShardPool
+from simulator import CrowdSimulator, check_crowd_size
+from tracking import KalmanTracker
+from triangulation import LOCATORS
+from zones import ZoneMap, zones_from_config
+
+
+# ESP32 nodes to connect to - positions match frontend coordinates.
+# Override with --nodes path/to/nodes.json (same list-of-dicts format).
+ESP32_NODES = [
+    {'id': 'ESP32-A', 'name': 'Node 1', 'device': 'ESP32_Crowd_Node_1', 'position': [10, 10]},
+    {'id': 'ESP32-B', 'name': 'Node 2', 'device': 'ESP32_Crowd_Node_2', 'position': [90, 10]},
+    {'id': 'ESP32-C', 'name': 'Node 3', 'device': 'ESP32_Crowd_Node_3', 'position': [50, 80]},
+]
 
-
-# UUIDs - must match ESP32
-SERVICE_UUID = "12345678-1234-1234-1234-1234567890ab"
-CHAR_UUID = "87654321-4321-4321-4321-abcdefabcdef"
-
-# ESP32 devices to connect to
-ESP32_DEVICES = [
-    "ESP32_Crowd_Node_1",
-    "ESP32_Crowd_Node_2",
-    "ESP32_Crowd_Node_3"
+# Zones counted in every 'zone_update': polygons in the same floor-plan metres
+# as the nodes. Override with --zones path/to/zones.json (same format) or
+# edit at runtime with the 'set_zones' event
+ZONES = [
+    {'id': 'entrance', 'name': 'Entrance', 'polygon': [[0, 0], [20, 0], [20, 15], [0, 15]]},
+    {'id': 'stage', 'name': 'Stage', 'polygon': [[40, 70], [80, 70], [80, 100], [40, 100]]},
+    {'id': 'bar', 'name': 'Bar', 'polygon': [[95, 30], [120, 30], [120, 60], [95, 60]]},
 ]
 
+# Metres per cell of the rasterized zone mask
+ZONE_CELL_SIZE = 0.5
+
+# Seconds startup waits for the ESP32 links before broadcasting; nodes that
+# come up later are picked up by the reconnect supervisor
+CONNECT_WAIT = 5.0
+
+# Seconds a node's range to a device stays usable for positioning; the
+# tracker smooths over time, so each range is fused once. 0 = whole ring
+FUSION_WINDOW = 6.0
+
+# Phones rotate randomized MACs, so per-MAC slots are reclaimed: after
+# DEVICE_TTL seconds unheard, or least recently seen first once DEVICE_LIMIT
+# MACs are held. LINK_IDS lets a new MAC with a known firmware id hash take
+# over the old MAC's slot, keeping its track across the rotation
+DEVICE_LIMIT = 20000
+DEVICE_TTL = 120.0
+LINK_IDS = False
+
+# Localization engine: 'multilateration' (least squares) or 'radiomap'
+# (nearest cell of a precomputed floor grid, needs scipy)
+LOCATOR = 'multilateration'
+
+# Delta stream: a full keyframe every N frames, and moves smaller than the
+# threshold (metres) are not sent
+KEYFRAME_INTERVAL = 30
+MOVE_THRESHOLD = 0.5
+
+# Density grid sent as 'density_update': cell size in metres, Gaussian blur
+# in cells (0 = off) and the half-life of the time average in seconds
+# (0 = latest snapshot only)
+GRID_CELL_SIZE = 2.0
+GRID_SIGMA = 1.0
+GRID_HALF_LIFE = 10.0
+
+# Broadcasts follow completed scans and node moves, at most one per
+# BROADCAST_MIN_INTERVAL seconds; with no events the map is still rebuilt every
+# BROADCAST_IDLE_INTERVAL seconds so silent devices age out
+BROADCAST_MIN_INTERVAL = 0.25
+BROADCAST_IDLE_INTERVAL = 10.0
+
+# Every client has its own outbox holding only the newest frame per event.
+# Frames go out at most CLIENT_MAX_FPS times a second per client (a client can
+# ask for less) and wait while more than CLIENT_MAX_BACKLOG packets are still
+# queued on its transport, so one slow viewer never delays the others
+CLIENT_MAX_FPS = 10.0
+CLIENT_MAX_BACKLOG = 4
+
+# Where span traces are written when tracing stops (--trace or the 'trace' event)
+TRACE_FILE = 'trace.json'
+
+
+# Everything one frame is built from, captured at a single instant: each
+# receiver's published snapshot, link health and the solver (whose positions
+# are the node geometry). Built by reference reads only, so it never blocks
+# ingestion, and a node moved mid-build cannot split a frame
+FrameSnapshot = namedtuple('FrameSnapshot', ['time', 'receivers', 'links', 'solver'])
+
 
 # Flask app for WebSocket server
 app = Flask(__name__)
 CORS(app)
-socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading')
-
-
-class ESP32Receiver:
-    def __init__(self, name):
-        self.name = name
-        self.address = None
-        self.client = None
-        self.chunk_buffer = {}
-        self.total_chunks = 0
-        self.latest_data = {}
-        self.receiving = False
-        self.first_data_received = False
-
-    def notification_handler(self, sender, data):
-        """Handle chunked JSON data"""
-        try:
-            raw_str = data.decode('utf-8')
-
-            if not raw_str:
-                return
-
-            if not self.first_data_received:
-                self.first_data_received = True
-                print(f"🎉 [{self.name}] First data received!")
-
-            # Check if this is chunked data: [1/3]data
-            chunk_match = re.match(r'\[(\d+)/(\d+)\](.*)', raw_str, re.DOTALL)
-
-            if chunk_match:
-                chunk_num = int(chunk_match.group(1))
-                total_chunks = int(chunk_match.group(2))
-                chunk_data = chunk_match.group(3)
-
-                if chunk_num == 1:
-                    self.chunk_buffer = {}
-                    self.total_chunks = total_chunks
-                    self.receiving = True
-                    print(f"📦 [{self.name}] Receiving {total_chunks} chunks...")
-
-                self.chunk_buffer[chunk_num] = chunk_data
-
-                if chunk_num % 10 == 0 or chunk_num == total_chunks:
-                    print(f"  [{self.name}] Progress: {chunk_num}/{total_chunks} chunks")
-
-                if len(self.chunk_buffer) == total_chunks:
-                    print(f"  [{self.name}] Reassembling {total_chunks} chunks...")
-
-                    full_data = ''.join([self.chunk_buffer[i] for i in sorted(self.chunk_buffer.keys())])
-
-                    try:
-                        json_data = json.loads(full_data)
-                        self.process_data(json_data)
-                        print(f"✓ [{self.name}] Complete: {len(self.latest_data)} devices\n")
-                    except json.JSONDecodeError as e:
-                        print(f"⚠ [{self.name}] JSON Error: {e}")
-
-                    self.chunk_buffer = {}
-                    self.receiving = False
-            else:
-                # Not chunked, process directly
-                json_data = json.loads(raw_str)
-                self.process_data(json_data)
-
-        except Exception as e:
-            print(f"⚠ [{self.name}] Error: {e}")
-
-    def process_data(self, json_data):
-        """Store device data indexed by MAC"""
-        self.latest_data = {}
-        for device in json_data.get('devices', []):
-            mac = device['mac']
-            self.latest_data[mac] = {
-                'distance': device['distance'],
-                'rssi': device['rssi'],
-                'id': device['id']
-            }
-
-    async def find_and_connect(self):
-        """Find and connect to ESP32"""
-        print(f"🔍 Scanning for '{self.name}'...")
-        devices = await BleakScanner.discover(timeout=10.0)
-
-        for device in devices:
-            if device.name == self.name:
-                self.address = device.address
-                print(f"✓ Found: {self.name} ({self.address})")
-                break
-
-        if not self.address:
-            print(f"✗ {self.name} not found")
-            return False
-
-        try:
-            print(f"🔗 Connecting to {self.name}...")
-            self.client = BleakClient(self.address, timeout=20.0)
-            await self.client.connect()
-
-            if self.client.is_connected:
-                print(f"✓ {self.name} connected!")
-                await asyncio.sleep(0.5)
-
-                print(f"📡 [{self.name}] Subscribing to notifications...")
-                await self.client.start_notify(CHAR_UUID, self.notification_handler)
-                print(f"✓ [{self.name}] Subscribed!")
-                await asyncio.sleep(1.0)
-
-                return True
-        except Exception as e:
-            print(f"✗ {self.name} connection failed: {e}")
-            return False
-
-        return False
-
-    async def disconnect(self):
-        """Disconnect from ESP32"""
-        if self.client and self.client.is_connected:
-            try:
-                await self.client.stop_notify(CHAR_UUID)
-                await self.client.disconnect()
-            except:
-                pass
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading',
+                    json=metrics.MeasuredJSON)
 
 
 class TriangulationEngine:
-    def __init__(self, receiver1, receiver2, receiver3):
-        self.receiver1 = receiver1
-        self.receiver2 = receiver2
-        self.receiver3 = receiver3
-
-        # ESP32 positions - matching frontend coordinates
-        self.esp1_pos = np.array([10, 10])
-        self.esp2_pos = np.array([90, 10])
-        self.esp3_pos = np.array([50, 80])
-
-    def get_node_positions(self):
+    def __init__(self, receivers, registry, table, fusion_window=FUSION_WINDOW,
+                 clock=time.monotonic, wall_clock=time.time, locator=LOCATOR):
+        # receivers[k] is the link for registry node k and writes table column k
+        self.receivers = receivers
+        self.registry = registry
+        self.table = table
+        self.fusion_window = fusion_window
+
+        # Replays swap both clocks for the recorded timeline
+        self.clock = clock
+        self.wall_clock = wall_clock
+
+        # Cached multilateration geometry, rebuilt only when a node moves.
+        # Replaced, never modified, so frames in flight keep a consistent one
+        self.locator = LOCATORS[locator]
+        self.solver = self.locator(registry.positions())
+        self.geometry_lock = threading.Lock()   # serializes node moves only
+
+        # Smooths raw fixes into per-device tracks between broadcasts
+        self.tracker = KalmanTracker(clock=clock)
+
+        # (N, 2) positions of the devices in the last frame
+        self.positions = np.zeros((0, 2))
+
+    def set_node_position(self, node_id, position):
+        """Move a node and rebuild the cached geometry"""
+        with self.geometry_lock:
+            if not self.registry.set_position(node_id, position):
+                return False
+            self.solver = self.locator(self.registry.positions())
+        return True
+
+    def capture(self):
+        """A FrameSnapshot of the current state"""
+        return FrameSnapshot(
+            self.clock(),
+            tuple(receiver.snapshot for receiver in self.receivers),
+            tuple((receiver.status, receiver.reconnects) for receiver in self.receivers),
+            self.solver)
+
+    def get_node_positions(self, frame=None):
         """Get ESP32 node positions for frontend"""
-        return [
-            {
-                'id': 'ESP32-A',
-                'name': 'Node 1',
-                'position': [float(self.esp1_pos[0]), float(self.esp1_pos[1])],
-                'status': 'online' if self.receiver1.client and self.receiver1.client.is_connected else 'offline',
-                'rssiAvg': -65,
-                'devicesDetected': len(self.receiver1.latest_data)
-            },
-            {
-                'id': 'ESP32-B',
-                'name': 'Node 2',
-                'position': [float(self.esp2_pos[0]), float(self.esp2_pos[1])],
-                'status': 'online' if self.receiver2.client and self.receiver2.client.is_connected else 'offline',
-                'rssiAvg': -58,
-                'devicesDetected': len(self.receiver2.latest_data)
-            },
-            {
-                'id': 'ESP32-C',
-                'name': 'Node 3',
-                'position': [float(self.esp3_pos[0]), float(self.esp3_pos[1])],
-                'status': 'online' if self.receiver3.client and self.receiver3.client.is_connected else 'offline',
-                'rssiAvg': -62,
-                'devicesDetected': len(self.receiver3.latest_data)
-            }
-        ]
-
-    def triangulate(self, d1, d2, d3):
-        """Triangulate position using three distance measurements"""
-        p1 = self.esp1_pos
-        p2 = self.esp2_pos
-        p3 = self.esp3_pos
-
-        try:
-            ex = (p2 - p1) / np.linalg.norm(p2 - p1)
-            i = np.dot(ex, p3 - p1)
-            ey = (p3 - p1 - i * ex) / np.linalg.norm(p3 - p1 - i * ex)
-            d = np.linalg.norm(p2 - p1)
-            j = np.dot(ey, p3 - p1)
-
-            x = (d1**2 - d2**2 + d**2) / (2 * d)
-            y = (d1**2 - d3**2 + i**2 + j**2) / (2 * j) - (i / j) * x
-
-            position = p1 + x * ex + y * ey
-
-            if np.isnan(position).any() or np.isinf(position).any():
-                return None
-
-            return position
-        except:
-            return None
-
-    def get_triangulated_devices(self):
-        """Get triangulated device positions for frontend"""
-        macs1 = set(self.receiver1.latest_data.keys())
-        macs2 = set(self.receiver2.latest_data.keys())
-        macs3 = set(self.receiver3.latest_data.keys())
-        common_macs = macs1.intersection(macs2).intersection(macs3)
+        frame = frame or self.capture()
+        nodes = []
+        for node, snapshot, (status, reconnects), position in zip(
+                self.registry, frame.receivers, frame.links, frame.solver.positions.tolist()):
+            scan = snapshot.scan
+            nodes.append({
+                'id': node.id,
+                'name': node.name,
+                'position': position,
+                'status': status,
+                'reconnects': reconnects,
+                'rssiAvg': round(float(scan['rssi'].mean())) if len(scan) else 0,
+                'devicesDetected': len(scan)
+            })
+        return nodes
+
+    def get_triangulated_devices(self, frame=None):
+        """Get tracked device positions for frontend"""
+        with tracing.span('get_triangulated_devices'):
+            return self._triangulated_devices(frame or self.capture())
+
+    def _triangulated_devices(self, frame):
+        # The table is only written from the ingest loop, which also builds frames
+        table = self.table
+        tracker = self.tracker
+        node_ids = [node.id for node in self.registry]
+        now = frame.time
+        start = time.perf_counter()
+
+        # The tracker does the smoothing over time, so it gets each node's
+        # most recent range within the fusion window rather than a median
+        # that would feed it the same samples tick after tick
+        distances, stamps = latest_samples(
+            table, [snapshot.history for snapshot in frame.receivers],
+            self.fusion_window, now)
+        heard = np.isfinite(distances)
+        slots = np.flatnonzero(heard.sum(axis=1) >= frame.solver.min_nodes)
+
+        positions = frame.solver.solve(distances[slots])
+        valid = ~positions.mask.any(axis=1)
+        # A fix counts for the share of its ranges scanned since the last
+        # tick; with none new the track is only predicted
+        rows = slots[valid]
+        since = -np.inf if tracker.time is None else tracker.time
+        new = heard[rows] & (stamps[rows] > since)
+        weights = new.sum(axis=1) / heard[rows].sum(axis=1)
+        tracker.step(table.keys[rows], positions.data[valid], now, weights)
+
+        solved = int(valid.sum())
+        metrics.TRIANGULATION_SECONDS.observe(time.perf_counter() - start)
+        metrics.TRIANGULATION_FAILURES.inc(len(valid) - solved)
+        metrics.TRIANGULATED_DEVICES.set(solved)
+
+        tracks = tracker.confirmed()
+        slots = table.lookup_keys(tracker.keys[tracks])
+        known = slots >= 0
+        tracks = tracks[known]
+        slots = slots[known]
+        self.positions = tracker.x[tracks, :2]
+
+        # Tracker times are monotonic; the frontend wants epoch milliseconds
+        epoch_offset = self.wall_clock() - now
 
         devices = []
-        device_id = 0
-
-        for mac in common_macs:
-            d1 = self.receiver1.latest_data[mac]['distance']
-            d2 = self.receiver2.latest_data[mac]['distance']
-            d3 = self.receiver3.latest_data[mac]['distance']
-
-            pos = self.triangulate(d1, d2, d3)
-            if pos is not None:
-                # Get average RSSI
-                rssi_avg = (
-                    self.receiver1.latest_data[mac]['rssi'] +
-                    self.receiver2.latest_data[mac]['rssi'] +
-                    self.receiver3.latest_data[mac]['rssi']
-                ) / 3
-
-                devices.append({
-                    'id': f'device-{device_id}',
-                    'hashedId': self.receiver1.latest_data[mac]['id'][:8],
-                    'position': [float(pos[0]), float(pos[1])],
-                    'lastSeen': 0,
-                    'rssi': {
-                        'ESP32-A': self.receiver1.latest_data[mac]['rssi'],
-                        'ESP32-B': self.receiver2.latest_data[mac]['rssi'],
-                        'ESP32-C': self.receiver3.latest_data[mac]['rssi']
-                    }
-                })
-                device_id += 1
+        for track_id, state, seen, rssi_row, heard, hashed in zip(
+                tracker.track_ids[tracks].tolist(),
+                tracker.x[tracks].tolist(), tracker.last_seen[tracks].tolist(),
+                table.rssi[slots].tolist(), table.heard[slots].tolist(),
+                table.ids[slots].tolist()):
+            devices.append({
+                'id': f'device-{track_id}',
+                'hashedId': format_id(hashed),
+                'position': state[:2],
+                'velocity': state[2:],
+                'lastSeen': int((seen + epoch_offset) * 1000),
+                'rssi': {node_id: r for k, (node_id, r) in enumerate(zip(node_ids, rssi_row)) if heard >> k & 1}
+            })
 
         return devices
 
 
 # Global instances
-receiver1 = None
-receiver2 = None
-receiver3 = None
+registry = NodeRegistry.from_config(ESP32_NODES)
+receivers = []
 triangulation = None
+delta_encoder = DeltaEncoder(KEYFRAME_INTERVAL, MOVE_THRESHOLD)
+density_grid = DensityGrid(cell_size=GRID_CELL_SIZE, sigma=GRID_SIGMA, half_life=GRID_HALF_LIFE)
+zone_map = ZoneMap.from_config(ZONES, cell_size=ZONE_CELL_SIZE)
+simulator = None  # CrowdSimulator when started with --simulate
+recorder = None   # CaptureRecorder when started with --record
+replayer = None   # Replayer when started with --replay
+connection_manager = None
+history = None    # HistoryStore when started with --history
+shard_pool = None  # ShardPool when started with --shards / --adapters
+scheduler = BroadcastScheduler(BROADCAST_MIN_INTERVAL, BROADCAST_IDLE_INTERVAL)
+latest_frames = None  # (map_update, density_update, zone_update) last broadcast, for new clients
+dispatcher = FrameDispatcher(CLIENT_MAX_FPS, CLIENT_MAX_BACKLOG)
+
+
+def client_connected(sid):
+    print('🌐 Frontend connected!')
+    dispatcher.add(sid)
+    dispatcher.send(sid, 'connection_status', {'status': 'connected'})
+    dispatcher.send(sid, 'zone_config', zone_map.to_config())
+    if latest_frames:
+        # Frames are only sent on change, so catch this client up now
+        full, density, zones = latest_frames
+        dispatcher.send(sid, 'map_update', full)
+        dispatcher.send(sid, 'density_update', density)
+        dispatcher.send(sid, 'zone_update', zones)
+
+
+def client_disconnected(sid):
+    outbox = dispatcher.remove(sid)
+    if outbox:
+        print(f'🌐 Frontend disconnected (sent {outbox.sent}, dropped {outbox.dropped})')
+
+
+def client_subscribed(sid, data):
+    """
+    Switch a client between full 'map_update' frames and the 'map_delta'
+    stream ({'protocol': 'full' | 'delta'}), optionally capping its rate
+    ({'maxFps': n})
+    """
+    data = data or {}
+    protocol = data.get('protocol')
+    if protocol not in ('full', 'delta'):
+        protocol = None
+    dispatcher.subscribe(sid, protocol, data.get('maxFps'))
+
+    if protocol == 'delta':
+        dispatcher.send(sid, 'map_delta', delta_encoder.keyframe())
+    elif protocol == 'full' and latest_frames:
+        dispatcher.send(sid, 'map_update', latest_frames[0])
+
+
+def client_trace(sid, data):
+    """
+    Switch span tracing on or off at runtime ({'enabled': bool}); switching it
+    off writes TRACE_FILE. Replies with 'trace_status'
+    """
+    enabled = bool((data or {}).get('enabled'))
+    tracer = tracing.TRACER
+    status = {'enabled': enabled, 'file': TRACE_FILE}
+    if enabled and not tracer.enabled:
+        tracer.start()
+        print(f"⏺ Tracing on (ring buffer of {tracer.events.maxlen} spans)")
+    elif not enabled and tracer.enabled:
+        tracer.stop()
+        status['spans'] = tracer.dump(TRACE_FILE)
+        print(f"⏹ Wrote {status['spans']} spans to {TRACE_FILE}")
+    dispatcher.send(sid, 'trace_status', status)
+
+
+def set_zones(data):
+    """
+    Replace the zone definitions ({'zones': [{id, name, polygon}, ...]});
+    re-rasterizes the mask and pushes the new config and counts to every client
+    """
+    try:
+        zone_map.set_zones(zones_from_config((data or {}).get('zones', [])))
+    except (KeyError, TypeError, ValueError) as e:
+        print(f"⚠️ Rejected zone update: {e}")
+        return False
+
+    print(f"🗺 {len(zone_map)} zones (version {zone_map.version})")
+    dispatcher.publish('zone_config', zone_map.to_config())
+    if triangulation:
+        # Device positions have not changed, so no map frame would carry new counts
+        dispatcher.publish('zone_update', zone_map.to_event(triangulation.positions))
+    return True
 
 
 @socketio.on('connect')
 def handle_connect():
-    print('🌐 Frontend connected!')
-    socketio.emit('connection_status', {'status': 'connected'})
+    client_connected(request.sid)
 
 
 @socketio.on('disconnect')
 def handle_disconnect():
-    print('🌐 Frontend disconnected')
+    client_disconnected(request.sid)
+
+
+@socketio.on('subscribe')
+def handle_subscribe(data):
+    client_subscribed(request.sid, data)
+
+
+@socketio.on('trace')
+def handle_trace(data):
+    client_trace(request.sid, data)
+
+
+@socketio.on('set_zones')
+def handle_set_zones(data):
+    set_zones(data)
+
+
+@socketio.on('request_keyframe')
+def handle_request_keyframe(data=None):
+    """Resend full state to a delta client that detected a sequence gap"""
+    dispatcher.send(request.sid, 'map_delta', delta_encoder.keyframe())
 
 
 @socketio.on('node_position_update')
 def handle_node_position_update(data):
     """Handle node position updates from frontend when user drags nodes"""
-    global triangulation
+    if update_node_position(data):
+        # Drags arrive in bursts; the scheduler coalesces them into one broadcast
+        scheduler.mark_dirty('node')
 
+
+def update_node_position(data):
+    """Apply a dragged node position; returns True if the engine changed"""
     if not triangulation:
         print('⚠️ Triangulation engine not initialized yet')
-        return
+        return False
 
     node_id = data.get('nodeId')
     node_name = data.get('nodeName')
@@ -290,77 +384,284 @@ def handle_node_position_update(data):
 
     print(f"📍 Received position update: {node_name} -> [{new_position[0]:.2f}, {new_position[1]:.2f}]")
 
-    # Update the corresponding node position
-    if node_id == 'ESP32-A':
-        triangulation.esp1_pos = np.array(new_position)
-        print(f"✅ Updated Node 1 position")
-    elif node_id == 'ESP32-B':
-        triangulation.esp2_pos = np.array(new_position)
-        print(f"✅ Updated Node 2 position")
-    elif node_id == 'ESP32-C':
-        triangulation.esp3_pos = np.array(new_position)
-        print(f"✅ Updated Node 3 position")
-    else:
+    # Update the corresponding node position (rebuilds the cached geometry)
+    if not triangulation.set_node_position(node_id, new_position):
         print(f"⚠️ Unknown node ID: {node_id}")
-        return
+        return False
 
-    print(f"🔄 Device positions will be recalculated with new node position on next update")
+    print(f"✅ Updated {node_name} position")
+    return True
 
-    # Immediately broadcast updated data
-    broadcast_data()
 
+def build_frames():
+    """
+    Compute the 'map_update', 'map_delta', 'density_update' and 'zone_update'
+    payloads. Returns None when nothing visible changed since the last frame
+    """
+    global latest_frames
 
-def broadcast_data():
-    """Broadcast triangulation data to all connected clients"""
-    if triangulation:
-        data = {
-            'nodes': triangulation.get_node_positions(),
-            'devices': triangulation.get_triangulated_devices()
-        }
-        socketio.emit('map_update', data)
+    frame = triangulation.capture()
+    nodes = triangulation.get_node_positions(frame)
+    devices = triangulation.get_triangulated_devices(frame)
+    with tracing.span('density'):
+        density_grid.update(triangulation.positions)
+    with tracing.span('delta_encode'):
+        delta = delta_encoder.encode(nodes, devices)
+    if delta is None:
+        return None
 
+    full = {'nodes': nodes, 'devices': devices}
+    with tracing.span('density_event'):
+        density = density_grid.to_event()
+    with tracing.span('zones'):
+        zones = zone_map.to_event(triangulation.positions)
+    latest_frames = (full, density, zones)
+    return full, delta, density, zones
 
 
+def broadcast_data():
+    """Queue triangulation data for every connected client"""
+    with tracing.span('build_frames'):
+        frames = build_frames() if triangulation else None
+    if frames:
+        full, delta, density, zones = frames
+        dispatcher.publish('map_update', full, 'full')
+        dispatcher.publish('map_delta', delta, 'delta')
+        dispatcher.publish('density_update', density)
+        dispatcher.publish('zone_update', zones)
+        if history:
+            with tracing.span('history'):
+                history.append(triangulation.wall_clock(), len(full['devices']),
+                               [zone['id'] for zone in zones['zones']],
+                               [zone['count'] for zone in zones['zones']],
+                               density_grid.grid)
+
+
+def record_emit(sid, event, payload, start):
+    """Metrics for one emit; the packet size comes from the JSON encoder, so nothing is serialized twice"""
+    seconds = time.perf_counter() - start
+    size = metrics.MeasuredJSON.last_size() + metrics.binary_size(payload)
+    metrics.EMIT_SECONDS.labels(event).observe(seconds)
+    metrics.PAYLOAD_BYTES.labels(event).observe(size)
+    dispatcher.record_emit(sid, size, seconds)
+
+
+def collect_metrics():
+    """Counters the pipeline already keeps, read at scrape time"""
+    outcomes = ('completed', 'expired', 'abandoned', 'duplicates', 'rejected')
+    yield ('crowdmap_reassembly_total', 'counter',
+           'Chunk reassembly outcomes (expired = timed out, abandoned = chunks lost)',
+           [({'node': r.name, 'outcome': outcome}, getattr(r.reassembler, outcome))
+            for r in receivers for outcome in outcomes])
+    yield ('crowdmap_node_up', 'gauge', 'Node link status (1 for the current status)',
+           [({'node': r.name, 'status': status}, int(r.status == status))
+            for r in receivers for status in ('online', 'stale', 'reconnecting', 'offline')])
+    yield ('crowdmap_node_reconnects_total', 'counter', 'Reconnects per node',
+           [({'node': r.name}, r.reconnects) for r in receivers])
+
+    table = triangulation.table if triangulation else None
+    if table is not None:
+        yield ('crowdmap_device_entries', 'gauge', 'MACs held in the device table',
+               [({}, table.size)])
+        yield ('crowdmap_device_capacity', 'gauge', 'Device table slots allocated',
+               [({}, table.capacity)])
+        yield ('crowdmap_device_evictions_total', 'counter',
+               'Device table slots reclaimed (ttl = unheard too long, capacity = limit reached)',
+               [({'reason': reason}, n) for reason, n in table.evicted.items()])
+        yield ('crowdmap_device_rejected_total', 'counter',
+               'New MACs dropped because one scan held more than the device limit',
+               [({}, table.rejected)])
+        yield ('crowdmap_device_links_total', 'counter',
+               'New MACs linked to an earlier slot through their firmware id hash',
+               [({}, table.linked)])
+
+    if shard_pool:
+        shards = shard_pool.stats()
+        yield ('crowdmap_ingest_workers', 'gauge', 'Ingest worker processes alive',
+               [({}, shards['workers'])])
+        yield ('crowdmap_ingest_worker_restarts_total', 'counter', 'Ingest workers restarted',
+               [({}, shards['restarts'])])
+        yield ('crowdmap_ingest_dropped_scans_total', 'counter',
+               'Scans overwritten in a shared ring before the aggregator read them',
+               [({'node': node}, n) for node, n in shards['dropped'].items()])
+        yield ('crowdmap_ingest_truncated_scans_total', 'counter',
+               'Scans larger than a ring slot, cut down to the strongest devices',
+               [({'node': node}, n) for node, n in shards['truncated'].items()])
+
+    yield ('crowdmap_scheduler_events_total', 'counter', 'Events that requested a broadcast',
+           [({}, scheduler.events)])
+    yield ('crowdmap_broadcasts_total', 'counter', 'Frames built and published',
+           [({}, scheduler.broadcasts)])
+
+    stats = dispatcher.stats()
+    clients = stats['clients']
+    yield ('crowdmap_clients', 'gauge', 'Connected frontend clients', [({}, len(clients))])
+    yield ('crowdmap_frames_sent_total', 'counter', 'Frames sent to clients',
+           [({}, stats['sent'])])
+    yield ('crowdmap_frames_dropped_total', 'counter', 'Frames replaced by a newer one before sending',
+           [({}, stats['dropped'])])
+    yield ('crowdmap_client_bytes_total', 'counter', 'Encoded bytes sent per client',
+           [({'sid': sid}, c['bytes']) for sid, c in clients.items()])
+    yield ('crowdmap_client_emit_seconds_total', 'counter', 'Time spent emitting per client',
+           [({'sid': sid}, c['emitSeconds']) for sid, c in clients.items()])
+    yield ('crowdmap_client_stalls_total', 'counter', 'Sends held back by a full transport queue',
+           [({'sid': sid}, c['stalls']) for sid, c in clients.items()])
+
+
+metrics.REGISTRY.add_collector(collect_metrics)
+
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus scrape target"""
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
+
+def history_query(params):
+    """
+    Answer a history request; params are the query string
+    (start, end: epoch seconds, or last: seconds before now; step: largest
+    bucket wanted in seconds; points: row budget; zone; density=1)
+    HistoryStore.choose_level picks the resolution
+    Returns (HTTP status, JSON body)
+    """
+    if history is None:
+        return 404, {'error': 'history is off; start the server with --history DIR'}
+    try:
+        end = float(params.get('end') or time.time())
+        start = float(params['start']) if params.get('start') else end - float(params.get('last', 3600))
+        step = float(params['step']) if params.get('step') else None
+        points = int(params.get('points', 0)) or None
+    except ValueError as e:
+        return 400, {'error': str(e)}
+    if end <= start:
+        return 400, {'error': 'end must be after start'}
+
+    with tracing.span('history_query'):
+        return 200, history.query(start, end, step=step, max_points=points or HISTORY_MAX_POINTS,
+                                  zone=params.get('zone'),
+                                  density=params.get('density') in ('1', 'true'))
+
+
+@app.route('/history')
+def history_endpoint():
+    """Occupancy over a time range; see history_query"""
+    status, body = history_query(request.args)
+    return body, status
+
+
+def dispatch_loop():
+    """Threading mode: drain the client outboxes through Flask-SocketIO"""
+    wakeup = threading.Event()
+    dispatcher.notify = wakeup.set
+    dispatcher.backlog = lambda sid: transport_backlog(socketio.server, sid)
+
+    while True:
+        wakeup.clear()
+        batch, wait = dispatcher.take()
+        for sid, event, payload in batch:
+            start = time.perf_counter()
+            with tracing.span('socketio.emit', {'event': event}):
+                socketio.emit(event, payload, to=sid)
+            record_emit(sid, event, payload, start)
+        wakeup.wait(wait)
+
+
+async def connect_all(receivers, timeout=CONNECT_WAIT):
+    """Supervise every ESP32 link; returns once all are up or timeout passes"""
+    global connection_manager
 
-async def connect_all(receivers):
-    """Connect to all ESP32s"""
     print("Connecting to all ESP32 devices...\n")
-    connection_tasks = [receiver.find_and_connect() for receiver in receivers]
-    results = await asyncio.gather(*connection_tasks)
-
-    connected_count = sum(results)
-    print(f"\n✓ Connected to {connected_count}/{len(ESP32_DEVICES)} devices\n")
+    connection_manager = ConnectionManager(receivers)
+    connection_manager.start()
+    connected_count = await connection_manager.wait_connected(timeout)
+    print(f"\n✓ Connected to {connected_count}/{len(receivers)} devices\n")
 
     return connected_count > 0
 
 
-async def esp32_loop():
-    """Main ESP32 connection and data loop"""
-    global receiver1, receiver2, receiver3, triangulation
+async def shutdown():
+    """Stop reconnecting, disconnect every ESP32 and close the capture log"""
+    if connection_manager:
+        await connection_manager.stop()
+    if shard_pool:
+        await shard_pool.stop()
+    for receiver in receivers:
+        await receiver.disconnect()
+    if recorder:
+        recorder.close()
+    if history:
+        history.close()
+    if tracing.TRACER.enabled:
+        tracing.TRACER.stop()
+        print(f"⏹ Wrote {tracing.TRACER.dump(TRACE_FILE)} spans to {TRACE_FILE}")
+
+
+async def start_engine():
+    """Connect to the ESP32s and build the triangulation engine"""
+    global receivers, triangulation
 
     print("\n" + "="*70)
     print("Connecting to ESP32 devices...")
     print("="*70 + "\n")
 
-    receiver1 = ESP32Receiver(ESP32_DEVICES[0])
-    receiver2 = ESP32Receiver(ESP32_DEVICES[1])
-    receiver3 = ESP32Receiver(ESP32_DEVICES[2])
-
-    if not await connect_all([receiver1, receiver2, receiver3]):
-        print("❌ No ESP32s connected. Server will still run but show no data.")
+    # A replay runs everything on the recorded timeline
+    clock = replayer.clock if replayer else time.monotonic
+    wall_clock = replayer.clock.time if replayer else time.time
+    density_grid.clock = clock
+
+    table = DeviceTable(len(registry), clock=clock, max_devices=DEVICE_LIMIT, ttl=DEVICE_TTL,
+                        link_ids=LINK_IDS)
+    receivers = [ESP32Receiver(node.device_name, table, k, clock=clock)
+                 for k, node in enumerate(registry)]
+    for receiver in receivers:
+        receiver.on_scan = scheduler.mark_dirty
+
+    if recorder:
+        recorder.attach(receivers)
+
+    if replayer:
+        replayer.attach(receivers)
+        connected = True
+    elif shard_pool:
+        # Workers do the BLE work (or simulate); this process only reads their rings
+        shard_pool.attach(receivers)
+        shard_pool.start()
+        online = await shard_pool.wait_connected(CONNECT_WAIT)
+        print(f"\n✓ {online}/{len(receivers)} nodes online across "
+              f"{shard_pool.shards} ingest workers\n")
+        connected = online > 0
+    elif simulator:
+        simulator.attach(receivers)
+        simulator.start()
+        connected = True
     else:
-        print("⏳ Waiting for ESP32s to start scanning (3-5 seconds)...")
-        await asyncio.sleep(5)
+        try:
+            connected = await connect_all(receivers)
+        except Exception as e:
+            print(f"✗ Bluetooth error: {e}")
+            connected = False
 
-    triangulation = TriangulationEngine(receiver1, receiver2, receiver3)
+    if not connected:
+        print("❌ No ESP32s connected yet. Server will still run and keep trying.")
+
+    triangulation = TriangulationEngine(receivers, registry, table, FUSION_WINDOW,
+                                        clock=clock, wall_clock=wall_clock, locator=LOCATOR)
 
     print("📡 Broadcasting data to frontend...\n")
 
+
+async def esp32_loop():
+    """Main ESP32 connection and data loop (threading mode)"""
+    await start_engine()
+
     # Broadcast loop
     try:
-        while True:
-            broadcast_data()
-            await asyncio.sleep(2)  # Update every 2 seconds
+        if replayer:
+            # Frames follow the recorded timeline so replays are repeatable
+            await replayer.run(broadcast_data)
+            print("🏁 Replay finished")
+        await scheduler.run(broadcast_data)
     except Exception as e:
         print(f"Error in broadcast loop: {e}")
 
@@ -371,7 +672,206 @@ def start_background_loop(loop):
     loop.run_until_complete(esp32_loop())
 
 
+def run_threading_server(port):
+    """Flask-SocketIO server with the BLE loop on a background thread"""
+    # Start ESP32 loop in background
+    loop = asyncio.new_event_loop()
+    esp32_thread = threading.Thread(target=start_background_loop, args=(loop,), daemon=True)
+    esp32_thread.start()
+
+    # Per-client sends happen off the broadcast path
+    threading.Thread(target=dispatch_loop, daemon=True).start()
+
+    # Give ESP32s time to connect before starting server
+    time.sleep(2)
+
+    # Run Flask-SocketIO server (blocking)
+    try:
+        socketio.run(app, host='0.0.0.0', port=port, debug=False, use_reloader=False, allow_unsafe_werkzeug=True)
+    except KeyboardInterrupt:
+        print("\n\n🛑 Stopping...")
+    finally:
+        # The BLE loop is still running on its own thread
+        asyncio.run_coroutine_threadsafe(shutdown(), loop).result(timeout=10)
+        print("✓ Disconnected")
+
+
+def create_async_server():
+    """
+    python-socketio AsyncServer on an aiohttp app
+    Socket handlers, broadcasts and BLE notifications all run on one event loop
+    """
+    import socketio as python_socketio
+    from aiohttp import web
+
+    sio = python_socketio.AsyncServer(async_mode='aiohttp', cors_allowed_origins='*',
+                                      json=metrics.MeasuredJSON)
+    web_app = web.Application()
+    sio.attach(web_app)
+
+    async def on_metrics(http_request):
+        return web.Response(body=metrics.REGISTRY.render().encode(),
+                            headers={'Content-Type': metrics.CONTENT_TYPE})
+
+    async def on_history(http_request):
+        status, body = history_query(http_request.query)
+        return web.json_response(body, status=status)
+
+    # Same routes as the Flask app
+    web_app.router.add_get('/metrics', on_metrics)
+    web_app.router.add_get('/history', on_history)
+
+    async def dispatch():
+        """Drain the client outboxes; emits only queue packets per client"""
+        loop = asyncio.get_running_loop()
+        wakeup = asyncio.Event()
+        dispatcher.notify = lambda: loop.call_soon_threadsafe(wakeup.set)
+        dispatcher.backlog = lambda sid: transport_backlog(sio, sid)
+
+        while True:
+            wakeup.clear()
+            batch, wait = dispatcher.take()
+            for sid, event, payload in batch:
+                start = time.perf_counter()
+                with tracing.span('socketio.emit', {'event': event}):
+                    await sio.emit(event, payload, to=sid)
+                record_emit(sid, event, payload, start)
+            try:
+                await asyncio.wait_for(wakeup.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+
+    @sio.on('connect')
+    async def on_connect(sid, environ):
+        client_connected(sid)
+
+    @sio.on('disconnect')
+    async def on_disconnect(sid):
+        client_disconnected(sid)
+
+    @sio.on('subscribe')
+    async def on_subscribe(sid, data):
+        client_subscribed(sid, data)
+
+    @sio.on('trace')
+    async def on_trace(sid, data):
+        client_trace(sid, data)
+
+    @sio.on('set_zones')
+    async def on_set_zones(sid, data):
+        set_zones(data)
+
+    @sio.on('request_keyframe')
+    async def on_request_keyframe(sid, data=None):
+        dispatcher.send(sid, 'map_delta', delta_encoder.keyframe())
+
+    @sio.on('node_position_update')
+    async def on_node_position_update(sid, data):
+        if update_node_position(data):
+            scheduler.mark_dirty('node')
+
+    return sio, web_app, dispatch
+
+
+def run_async_server(port):
+    """Serve Socket.IO and drive the ESP32s from a single asyncio event loop"""
+    from aiohttp import web
+
+    sio, web_app, dispatch = create_async_server()
+
+    async def main():
+        runner = web.AppRunner(web_app)
+        await runner.setup()
+        await web.TCPSite(runner, '0.0.0.0', port).start()
+
+        dispatch_task = asyncio.ensure_future(dispatch())
+        try:
+            # Clients can connect while the ESP32s are still being found
+            await start_engine()
+            if replayer:
+                await replayer.run(broadcast_data)
+                print("🏁 Replay finished")
+            await scheduler.run(broadcast_data)
+        finally:
+            dispatch_task.cancel()
+            await shutdown()
+            await runner.cleanup()
+            print("✓ Disconnected")
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        print("\n\n🛑 Stopping...")
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CrowdMap WebSocket Server")
+    parser.add_argument('--nodes', help="JSON file with the ESP32 node registry")
+    parser.add_argument('--zones', help="JSON file with the zone polygons")
+    parser.add_argument('--simulate', type=int, metavar='DEVICES',
+                        help="Run without ESP32s: simulate a crowd of DEVICES phones")
+    parser.add_argument('--sim-speed', type=float, default=1.0,
+                        help="Simulated seconds per real second (0 = as fast as possible)")
+    parser.add_argument('--sim-format', choices=['binary', 'json'], default='binary',
+                        help="Payload format the simulated nodes send")
+    parser.add_argument('--sim-seed', type=int, default=0, help="Simulator random seed")
+    parser.add_argument('--sim-mac-rotation', type=float, default=0.0, metavar='SECONDS',
+                        help="Mean seconds between simulated MAC rotations (0 = never)")
+    parser.add_argument('--shards', type=int, metavar='N',
+                        help="Ingest in N worker processes (nodes split round-robin); "
+                             "this process only fuses, triangulates and broadcasts")
+    parser.add_argument('--adapters', metavar='HCI,...',
+                        help="Comma-separated BLE adapters, one ingest worker each "
+                             "(e.g. hci0,hci1); implies --shards")
+    parser.add_argument('--history', metavar='DIR',
+                        help="Keep an on-disk occupancy history in DIR, queried at /history")
+    parser.add_argument('--record', metavar='LOG',
+                        help="Record every raw notification to a capture log")
+    parser.add_argument('--replay', metavar='LOG',
+                        help="Replay a capture log instead of connecting to ESP32s")
+    parser.add_argument('--replay-speed', type=float, default=1.0,
+                        help="Recorded seconds per real second (0 = as fast as possible)")
+    parser.add_argument('--server', choices=['async', 'threading'], default='async',
+                        help="async: one event loop (aiohttp); threading: Flask-SocketIO fallback")
+    parser.add_argument('--min-interval', type=float, default=BROADCAST_MIN_INTERVAL,
+                        help="Minimum seconds between broadcasts; events in between are coalesced")
+    parser.add_argument('--idle-interval', type=float, default=BROADCAST_IDLE_INTERVAL,
+                        help="Rebuild the map this often even without new scans")
+    parser.add_argument('--client-max-fps', type=float, default=CLIENT_MAX_FPS,
+                        help="Most frames per second sent to any one client (0 = no cap)")
+    parser.add_argument('--client-max-backlog', type=int, default=CLIENT_MAX_BACKLOG,
+                        help="Packets queued on a client's connection before its sends pause")
+    parser.add_argument('--trace', nargs='?', const=TRACE_FILE, metavar='FILE',
+                        help="Trace pipeline spans from startup; written to FILE "
+                             f"(default {TRACE_FILE}) on exit or when a client turns tracing off")
+    parser.add_argument('--trace-capacity', type=int, default=tracing.TRACE_CAPACITY,
+                        help="Spans kept in the trace ring buffer")
+    parser.add_argument('--log-level', default='info',
+                        choices=['debug', 'info', 'warning', 'error'],
+                        help="debug prints every completed scan")
+    parser.add_argument('--fusion-window', type=float, default=FUSION_WINDOW,
+                        help="Seconds a node's range to a device stays usable (0 = its whole scan ring)")
+    parser.add_argument('--max-devices', type=int, default=DEVICE_LIMIT,
+                        help="Most MACs held at once; the least recently seen make room")
+    parser.add_argument('--device-ttl', type=float, default=DEVICE_TTL,
+                        help="Seconds a MAC can go unheard before its slot is reclaimed")
+    parser.add_argument('--link-ids', action='store_true',
+                        help="Follow phones across MAC rotations by their firmware id hash")
+    parser.add_argument('--locator', choices=sorted(LOCATORS), default=LOCATOR,
+                        help="multilateration: least squares; radiomap: KD-tree lookup in a "
+                             "precomputed floor grid, always inside the floor bounds")
+    parser.add_argument('--keyframe-interval', type=int, default=KEYFRAME_INTERVAL,
+                        help="Frames between full keyframes on the delta stream")
+    parser.add_argument('--move-threshold', type=float, default=MOVE_THRESHOLD,
+                        help="Metres a device must move before a delta reports it")
+    parser.add_argument('--grid-cell', type=float, default=GRID_CELL_SIZE,
+                        help="Density grid cell size in metres")
+    parser.add_argument('--grid-sigma', type=float, default=GRID_SIGMA,
+                        help="Density grid Gaussian blur in cells (0 = off)")
+    parser.add_argument('--grid-half-life', type=float, default=GRID_HALF_LIFE,
+                        help="Seconds for old density counts to decay by half (0 = latest snapshot only)")
+    args = parser.parse_args()
+
     try:
         # Check dependencies
         import flask
@@ -383,36 +883,92 @@ if __name__ == "__main__":
         print("  pip install flask flask-socketio flask-cors python-socketio bleak numpy")
         exit(1)
 
+    logging.basicConfig(level=args.log_level.upper(), format='%(message)s')
+
     print("="*70)
     print("CrowdMap WebSocket Server")
     print("="*70)
 
+    FUSION_WINDOW = args.fusion_window
+    DEVICE_LIMIT = args.max_devices
+    DEVICE_TTL = args.device_ttl
+    LINK_IDS = args.link_ids
+    LOCATOR = args.locator
+    if LOCATOR == 'radiomap':
+        try:
+            import scipy
+        except ImportError:
+            print("⚠️ scipy not installed, falling back to multilateration")
+            LOCATOR = 'multilateration'
+    delta_encoder.keyframe_interval = args.keyframe_interval
+    scheduler.min_interval = args.min_interval
+    dispatcher.max_fps = args.client_max_fps or None
+    dispatcher.max_backlog = args.client_max_backlog
+    scheduler.idle_interval = args.idle_interval
+    delta_encoder.move_threshold = args.move_threshold
+    density_grid = DensityGrid(cell_size=args.grid_cell, sigma=args.grid_sigma,
+                               half_life=args.grid_half_life)
+
+    tracing.TRACER.set_capacity(args.trace_capacity)
+    if args.trace:
+        TRACE_FILE = args.trace
+        tracing.TRACER.start()
+        print(f"⏺ Tracing spans to {TRACE_FILE}")
+
+    if args.nodes:
+        registry = NodeRegistry.from_file(args.nodes)
+        print(f"📍 Loaded {len(registry)} nodes from {args.nodes}")
+
+    if args.zones:
+        zone_map = ZoneMap.from_file(args.zones, cell_size=ZONE_CELL_SIZE)
+        print(f"🗺 Loaded {len(zone_map)} zones from {args.zones}")
+
+    if args.simulate:
+        try:
+            check_crowd_size(args.simulate, args.sim_format)
+        except ValueError as e:
+            parser.error(str(e))
+
+    adapters = args.adapters.split(',') if args.adapters else []
+    if args.shards or adapters:
+        if args.record or args.replay:
+            parser.error("--record and --replay need single-process ingestion")
+        # Each worker simulates the same seeded crowd and delivers its own nodes
+        simulate = None
+        if args.simulate:
+            simulate = {'nodes': [node.to_dict() for node in registry],
+                        'n_devices': args.simulate, 'seed': args.sim_seed,
+                        'payload_format': args.sim_format, 'speed': args.sim_speed,
+                        'mac_rotation': args.sim_mac_rotation}
+        shard_pool = ShardPool(registry, args.shards, adapters, simulate)
+    elif args.simulate:
+        simulator = CrowdSimulator(registry, args.simulate, seed=args.sim_seed,
+                                   payload_format=args.sim_format, speed=args.sim_speed,
+                                   mac_rotation=args.sim_mac_rotation)
+
+    if args.history:
+        history = HistoryStore(args.history)
+        print(f"🗄 Recording occupancy history to {args.history}")
+
+    if args.replay:
+        replayer = Replayer(CaptureLog(args.replay), speed=args.replay_speed)
+    if args.record:
+        recorder = CaptureRecorder(args.record, [node.device_name for node in registry])
+
     # Use port 5001 to avoid conflicts
     PORT = 5001
 
-    print(f"\n🚀 Starting WebSocket server on port {PORT}...")
+    print(f"\n🚀 Starting WebSocket server on port {PORT} ({args.server} mode)...")
     print(f"📱 Frontend should connect to: http://localhost:{PORT}\n")
 
-    # Start ESP32 loop in background
-    import threading
-    loop = asyncio.new_event_loop()
-    esp32_thread = threading.Thread(target=start_background_loop, args=(loop,), daemon=True)
-    esp32_thread.start()
-
-    # Give ESP32s time to connect before starting server
-    import time
-    time.sleep(2)
+    if args.server == 'async':
+        try:
+            import aiohttp
+        except ImportError:
+            print("⚠️ aiohttp not installed, falling back to threading mode")
+            args.server = 'threading'
 
-    # Run Flask-SocketIO server (blocking)
-    try:
-        socketio.run(app, host='0.0.0.0', port=PORT, debug=False, use_reloader=False, allow_unsafe_werkzeug=True)
-    except KeyboardInterrupt:
-        print("\n\n🛑 Stopping...")
-    finally:
-        if receiver1:
-            loop.run_until_complete(receiver1.disconnect())
-        if receiver2:
-            loop.run_until_complete(receiver2.disconnect())
-        if receiver3:
-            loop.run_until_complete(receiver3.disconnect())
-        print("✓ Disconnected")
+    if args.server == 'async':
+        run_async_server(PORT)
+    else:
+        run_threading_server(PORT)
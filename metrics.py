@@ -0,0 +1,241 @@
+"""
+Pipeline instrumentation in the Prometheus text format
+Hot paths update labelled counters and histograms directly; values that other
+objects already count (reassembler, dispatcher, scheduler) are read by
+collectors only when /metrics is scraped
+"""
+
+import bisect
+import json
+import threading
+
+import tracing
+
+
+# Seconds, 50 µs to 5 s
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# Devices per scan
+COUNT_BUCKETS = (0, 1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 50000)
+
+# Bytes per packet
+BYTE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{escape(v)}"' for k, v in labels.items()) + '}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0.0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def samples(self, name, labels):
+        return [(name, labels, self.value)]
+
+
+class Gauge(Counter):
+    def set(self, value):
+        self.value = value
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)    # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        k = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[k] += 1
+            self.sum += value
+            self.count += 1
+
+    def samples(self, name, labels):
+        with self.lock:
+            counts = list(self.counts)
+            total, count = self.sum, self.count
+        samples = []
+        cumulative = 0
+        for bound, n in zip(self.buckets + (float('inf'),), counts):
+            cumulative += n
+            samples.append((name + '_bucket', {**labels, 'le': format_value(bound)}, cumulative))
+        samples.append((name + '_sum', labels, total))
+        samples.append((name + '_count', labels, count))
+        return samples
+
+
+class Family:
+    """One metric name; each distinct label tuple gets its own child"""
+
+    def __init__(self, name, kind, help, labelnames=(), factory=Counter):
+        self.name = name
+        self.kind = kind
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.factory = factory
+        self.children = {}
+        self.lock = threading.Lock()
+
+    def labels(self, *values):
+        """Child for these label values; hot paths should look it up once and keep it"""
+        values = tuple(str(v) for v in values)
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(values, self.factory())
+        return child
+
+    # An unlabelled family acts as its own single child
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def remove(self, *values):
+        with self.lock:
+            self.children.pop(tuple(str(v) for v in values), None)
+
+    def render(self):
+        with self.lock:
+            children = list(self.children.items())
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        for values, child in children:
+            for name, labels, value in child.samples(self.name, dict(zip(self.labelnames, values))):
+                lines.append(f'{name}{format_labels(labels)} {format_value(value)}')
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.families = []
+        self.collectors = []
+
+    def counter(self, name, help, labelnames=()):
+        return self._add(Family(name, 'counter', help, labelnames, Counter))
+
+    def gauge(self, name, help, labelnames=()):
+        return self._add(Family(name, 'gauge', help, labelnames, Gauge))
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._add(Family(name, 'histogram', help, labelnames,
+                                lambda: Histogram(tuple(buckets))))
+
+    def _add(self, family):
+        self.families.append(family)
+        return family
+
+    def add_collector(self, collect):
+        """
+        collect() is called on every scrape and yields (name, kind, help, samples)
+        where samples is a list of (labels dict, value)
+        """
+        self.collectors.append(collect)
+
+    def render(self):
+        lines = []
+        for family in self.families:
+            lines.extend(family.render())
+        for collect in self.collectors:
+            try:
+                for name, kind, help, samples in collect():
+                    lines.append(f'# HELP {name} {help}')
+                    lines.append(f'# TYPE {name} {kind}')
+                    lines.extend(f'{name}{format_labels(labels)} {format_value(value)}'
+                                 for labels, value in samples)
+            except Exception as e:
+                lines.append(f'# collector error: {escape(e)}')
+        return '\n'.join(lines) + '\n'
+
+
+class MeasuredJSON:
+    """
+    Drop-in json module for Socket.IO packets that remembers, per thread, the
+    size of the last document it encoded, so emits can be measured without
+    serializing twice
+    """
+
+    local = threading.local()
+
+    @staticmethod
+    def dumps(*args, **kwargs):
+        with tracing.span('serialize'):
+            text = json.dumps(*args, **kwargs)
+        MeasuredJSON.local.size = len(text)
+        return text
+
+    @staticmethod
+    def loads(*args, **kwargs):
+        return json.loads(*args, **kwargs)
+
+    @staticmethod
+    def last_size():
+        return getattr(MeasuredJSON.local, 'size', 0)
+
+
+def binary_size(payload):
+    """Bytes sent as binary attachments alongside the JSON of a payload"""
+    if not isinstance(payload, dict):
+        return 0
+    return sum(len(v) for v in payload.values() if isinstance(v, (bytes, bytearray)))
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+REGISTRY = MetricsRegistry()
+
+# Ingest
+NOTIFICATIONS = REGISTRY.counter(
+    'crowdmap_notifications_total', 'BLE notifications received', ['node'])
+NOTIFICATION_BYTES = REGISTRY.counter(
+    'crowdmap_notification_bytes_total', 'Bytes received in BLE notifications', ['node'])
+REASSEMBLY_SECONDS = REGISTRY.histogram(
+    'crowdmap_reassembly_seconds', 'First to last chunk of a scan', ['node'])
+DECODE_SECONDS = REGISTRY.histogram(
+    'crowdmap_decode_seconds', 'Time to decode a complete scan payload', ['node', 'format'])
+DECODE_ERRORS = REGISTRY.counter(
+    'crowdmap_decode_errors_total', 'Scan payloads that failed to decode', ['node'])
+SCAN_DEVICES = REGISTRY.histogram(
+    'crowdmap_scan_devices', 'Devices reported per scan', ['node'], COUNT_BUCKETS)
+
+# Triangulation
+TRIANGULATION_SECONDS = REGISTRY.histogram(
+    'crowdmap_triangulation_seconds', 'Fusion, multilateration and tracking per frame')
+TRIANGULATION_FAILURES = REGISTRY.counter(
+    'crowdmap_triangulation_failures_total', 'Devices heard by enough nodes that did not solve')
+TRIANGULATED_DEVICES = REGISTRY.gauge(
+    'crowdmap_triangulated_devices', 'Devices solved in the latest frame')
+
+# Broadcast
+PAYLOAD_BYTES = REGISTRY.histogram(
+    'crowdmap_payload_bytes', 'Encoded size of each packet sent to a client', ['event'],
+    BYTE_BUCKETS)
+EMIT_SECONDS = REGISTRY.histogram(
+    'crowdmap_emit_seconds', 'Time spent in each emit to a client', ['event'])
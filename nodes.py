@@ -0,0 +1,73 @@
+"""
+ESP32 node registry for CrowdMap
+Describes which BLE nodes exist and where they sit on the floor plan
+"""
+
+import json
+
+import numpy as np
+
+
+class Node:
+    def __init__(self, node_id, name, device_name, position):
+        self.id = node_id
+        self.name = name
+        self.device_name = device_name
+        self.position = np.array(position, dtype=float)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'device': self.device_name,
+            'position': [float(self.position[0]), float(self.position[1])]
+        }
+
+
+class NodeRegistry:
+    """Ordered set of nodes; index order matches the receiver list"""
+
+    def __init__(self, nodes):
+        self.nodes = list(nodes)
+        self._index = {node.id: i for i, node in enumerate(self.nodes)}
+        if len(self._index) != len(self.nodes):
+            raise ValueError("Duplicate node id in registry")
+
+    @classmethod
+    def from_config(cls, config):
+        """Build a registry from a list of {id, name, device, position} dicts"""
+        return cls(
+            Node(entry['id'], entry.get('name', entry['id']), entry['device'], entry['position'])
+            for entry in config
+        )
+
+    @classmethod
+    def from_file(cls, path):
+        """Load a registry from a JSON file holding a list of node dicts"""
+        with open(path) as f:
+            return cls.from_config(json.load(f))
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __iter__(self):
+        return iter(self.nodes)
+
+    def index_of(self, node_id):
+        return self._index.get(node_id)
+
+    def get(self, node_id):
+        i = self._index.get(node_id)
+        return None if i is None else self.nodes[i]
+
+    def positions(self):
+        """(M, 2) array of node positions in registry order"""
+        return np.array([node.position for node in self.nodes], dtype=float).reshape(-1, 2)
+
+    def set_position(self, node_id, position):
+        """Move a node; returns False for unknown ids"""
+        node = self.get(node_id)
+        if node is None:
+            return False
+        node.position = np.array(position, dtype=float)
+        return True
@@ -0,0 +1,222 @@
+"""
+Per-client outbound frame queues
+Each client holds at most one pending frame per event and newer frames
+replace older ones (deltas are merged), so a slow viewer skips frames
+instead of building a backlog; a per-client frame rate cap and the
+transport's own queue depth decide when the pending frames go out
+"""
+
+import threading
+import time
+
+
+def merge_deltas(older, newer):
+    """
+    Fold two consecutive 'map_delta' frames into one that takes a client from
+    older's base straight to newer's state; 'since' records that base
+    Frames are shared between clients, so neither input is modified
+    """
+    if newer['keyframe']:
+        return newer
+
+    if older['keyframe']:
+        devices = {device['id']: device for device in older['devices']}
+        for device in newer['added']:
+            devices[device['id']] = device
+        for device_id, x, y in newer['moved']:
+            if device_id in devices:
+                devices[device_id] = {**devices[device_id], 'position': [x, y]}
+        for device_id in newer['removed']:
+            devices.pop(device_id, None)
+        return {'seq': newer['seq'], 'keyframe': True, 'nodes': newer['nodes'],
+                'devices': list(devices.values())}
+
+    added = {device['id']: device for device in older['added']}
+    moved = {move[0]: move for move in older['moved']}
+    removed = list(older['removed'])
+
+    for device in newer['added']:
+        added[device['id']] = device
+    for move in newer['moved']:
+        device_id, x, y = move
+        if device_id in added:
+            added[device_id] = {**added[device_id], 'position': [x, y]}
+        else:
+            moved[device_id] = move
+    for device_id in newer['removed']:
+        moved.pop(device_id, None)
+        # Ids are never reused, and one the client never saw needs no removal
+        if added.pop(device_id, None) is None:
+            removed.append(device_id)
+
+    return {
+        'seq': newer['seq'],
+        'since': older.get('since', older['seq'] - 1),
+        'keyframe': False,
+        'nodes': newer['nodes'],
+        'added': list(added.values()),
+        'moved': list(moved.values()),
+        'removed': removed
+    }
+
+
+def transport_backlog(server, sid, namespace='/'):
+    """Packets engine.io has queued for a client but not yet written to its socket"""
+    try:
+        eio_sid = server.manager.eio_sid_from_sid(sid, namespace)
+        return server.eio.sockets[eio_sid].queue.qsize()
+    except (AttributeError, KeyError, TypeError):
+        return 0
+
+
+class ClientOutbox:
+    def __init__(self, sid, protocol='full', max_fps=None):
+        self.sid = sid
+        self.protocol = protocol    # 'full' or 'delta'
+        self.max_fps = max_fps
+        self.pending = {}           # event -> newest payload
+        self.last_send = float('-inf')
+
+        # Counters
+        self.sent = 0
+        self.dropped = 0
+        self.stalls = 0             # times a send waited on a full transport queue
+        self.bytes = 0              # encoded bytes handed to the transport
+        self.emit_seconds = 0.0     # time spent inside emit calls
+
+    def put(self, event, payload):
+        previous = self.pending.get(event)
+        if previous is not None:
+            self.dropped += 1
+            if event == 'map_delta':
+                # Deltas cannot simply be skipped; fold them together instead
+                payload = merge_deltas(previous, payload)
+        self.pending[event] = payload
+
+    def stats(self):
+        return {
+            'protocol': self.protocol,
+            'maxFps': self.max_fps,
+            'pending': len(self.pending),
+            'sent': self.sent,
+            'dropped': self.dropped,
+            'stalls': self.stalls,
+            'bytes': self.bytes,
+            'emitSeconds': self.emit_seconds,
+        }
+
+
+class FrameDispatcher:
+    """
+    Fan frames out to every client's outbox; a server-specific pump calls
+    take() and emits what it returns
+    """
+
+    def __init__(self, max_fps=10.0, max_backlog=4, clock=time.monotonic):
+        self.max_fps = max_fps            # default per-client cap, None = unlimited
+        self.max_backlog = max_backlog    # transport packets allowed in flight per client
+        self.clock = clock
+        self.outboxes = {}
+        self.lock = threading.Lock()
+
+        # Set by the pump: wake it up, and read a client's transport queue depth
+        self.notify = None
+        self.backlog = lambda sid: 0
+
+        # Totals, including clients that have left
+        self.sent = 0
+        self.dropped = 0
+
+    def add(self, sid):
+        with self.lock:
+            self.outboxes[sid] = ClientOutbox(sid, max_fps=self.max_fps)
+
+    def remove(self, sid):
+        with self.lock:
+            return self.outboxes.pop(sid, None)
+
+    def subscribe(self, sid, protocol=None, max_fps=None):
+        """Change a client's stream and/or lower its frame rate"""
+        with self.lock:
+            outbox = self.outboxes.get(sid)
+            if outbox is None:
+                return
+            if protocol is not None:
+                outbox.protocol = protocol
+                outbox.pending.pop('map_update' if protocol == 'delta' else 'map_delta', None)
+            if max_fps:
+                outbox.max_fps = min(max_fps, self.max_fps) if self.max_fps else max_fps
+
+    def send(self, sid, event, payload):
+        """Queue a frame for one client"""
+        with self.lock:
+            outbox = self.outboxes.get(sid)
+            if outbox is not None:
+                self._put(outbox, event, payload)
+        self._wake()
+
+    def publish(self, event, payload, protocol=None):
+        """Queue a frame for every client on `protocol` (None = all clients)"""
+        with self.lock:
+            for outbox in self.outboxes.values():
+                if protocol is None or outbox.protocol == protocol:
+                    self._put(outbox, event, payload)
+        self._wake()
+
+    def _put(self, outbox, event, payload):
+        dropped = outbox.dropped
+        outbox.put(event, payload)
+        self.dropped += outbox.dropped - dropped
+
+    def _wake(self):
+        if self.notify is not None:
+            self.notify()
+
+    def take(self):
+        """
+        Frames that may go out now as (sid, event, payload), plus the seconds
+        until another client becomes sendable (None if nothing is waiting)
+        """
+        now = self.clock()
+        batch = []
+        wait = None
+
+        with self.lock:
+            outboxes = [outbox for outbox in self.outboxes.values() if outbox.pending]
+
+        for outbox in outboxes:
+            due = outbox.last_send + (1.0 / outbox.max_fps if outbox.max_fps else 0.0)
+            if now < due:
+                wait = due - now if wait is None else min(wait, due - now)
+                continue
+            if self.backlog(outbox.sid) > self.max_backlog:
+                # Slow link: keep only the newest frames until it drains
+                outbox.stalls += 1
+                wait = 0.05 if wait is None else min(wait, 0.05)
+                continue
+
+            with self.lock:
+                pending, outbox.pending = outbox.pending, {}
+                outbox.last_send = now
+                outbox.sent += len(pending)
+                self.sent += len(pending)
+
+            batch.extend((outbox.sid, event, payload) for event, payload in pending.items())
+
+        return batch, wait
+
+    def record_emit(self, sid, size, seconds):
+        """Account one emit the pump made to a client"""
+        with self.lock:
+            outbox = self.outboxes.get(sid)
+            if outbox is not None:
+                outbox.bytes += size
+                outbox.emit_seconds += seconds
+
+    def stats(self):
+        with self.lock:
+            return {
+                'clients': {sid: outbox.stats() for sid, outbox in self.outboxes.items()},
+                'sent': self.sent,
+                'dropped': self.dropped,
+            }
@@ -0,0 +1,323 @@
+"""
+BLE receiver for CrowdMap ESP32 nodes
+Shared by map.py and map_websocket.py
+"""
+
+import json
+import logging
+import time
+from array import array
+from collections import namedtuple
+
+import metrics
+import tracing
+from fusion import ScanRing
+from scan_format import decode_binary_scan, empty_scan, is_binary_scan, scan_from_json
+
+
+# UUIDs - must match ESP32
+SERVICE_UUID = "12345678-1234-1234-1234-1234567890ab"
+CHAR_UUID = "87654321-4321-4321-4321-abcdefabcdef"
+
+# Largest ATT value a notification can carry
+MAX_CHUNK_SIZE = 512
+
+# Longest header we accept: "[9999/9999]"
+MAX_HEADER_SIZE = 11
+
+# An online node that has sent nothing for this long is reported as stale
+STALE_AFTER = 10.0
+
+# What other threads read of a receiver: never modified once published, and
+# replaced as a whole (one reference swap) after every completed scan
+ReceiverSnapshot = namedtuple('ReceiverSnapshot', ['version', 'time', 'scan', 'history'])
+
+# Per-scan messages are DEBUG so the hot path stays quiet at the default level
+log = logging.getLogger('crowdmap.receiver')
+
+
+def parse_chunk_header(data):
+    """
+    Parse a b'[i/n]' prefix straight from the notification bytes
+    Returns (index, total, header_length) or None if there is no header
+    """
+    if data[:1] != b'[':
+        return None
+
+    end = data.find(b']', 1, MAX_HEADER_SIZE)
+    if end < 0:
+        return None
+    slash = data.find(b'/', 1, end)
+    if slash < 0:
+        return None
+
+    try:
+        index = int(data[1:slash])
+        total = int(data[slash + 1:end])
+    except ValueError:
+        return None
+
+    if total < 1 or not 1 <= index <= total:
+        return None
+    return index, total, end + 1
+
+
+class ChunkReassembler:
+    """
+    Reassemble '[i/n]payload' notifications into a single buffer
+    Chunks land in fixed slots of a reused bytearray, so they may arrive out
+    of order. A chunk whose slot already holds the same bytes is a duplicate;
+    one whose slot holds different bytes, or a new chunk count, starts the
+    next scan and abandons the incomplete one, since the firmware never
+    resends chunks. A scan that loses only chunks the next scan repeats
+    byte for byte cannot be told apart from a late chunk.
+    A session that stalls longer than `timeout` seconds is dropped.
+    """
+
+    def __init__(self, slot_size=MAX_CHUNK_SIZE, timeout=2.0, clock=time.monotonic):
+        self.slot_size = slot_size
+        self.timeout = timeout
+        self.clock = clock
+
+        self.buffer = bytearray()
+        self.view = memoryview(self.buffer)
+        self.lengths = array('i')
+        self.total = 0
+        self.received = 0
+        self.started = 0.0
+        self.last_update = 0.0
+
+        # Counters
+        self.completed = 0
+        self.duplicates = 0
+        self.expired = 0
+        self.abandoned = 0
+        self.rejected = 0
+
+    @property
+    def receiving(self):
+        return self.total > 0
+
+    def _start(self, total, now):
+        needed = total * self.slot_size
+        if len(self.buffer) < needed:
+            # A bytearray cannot be resized while a view is exported
+            self.view.release()
+            self.buffer = bytearray(needed)
+            self.view = memoryview(self.buffer)
+        if len(self.lengths) < total:
+            self.lengths = array('i', [-1]) * total
+        else:
+            self.lengths[:total] = array('i', [-1]) * total
+        self.total = total
+        self.received = 0
+        self.started = now
+
+    def _reset(self):
+        self.total = 0
+        self.received = 0
+
+    def expire_stale(self, now=None):
+        """Drop the in-flight session if it has stalled past the timeout"""
+        if now is None:
+            now = self.clock()
+        if self.total and now - self.last_update > self.timeout:
+            self.expired += 1
+            self._reset()
+            return True
+        return False
+
+    def feed(self, data, header=None):
+        """
+        Add one notification
+        Returns the complete payload as bytes once every chunk is in, else None
+        """
+        now = self.clock()
+        self.expire_stale(now)
+
+        if header is None:
+            header = parse_chunk_header(data)
+        if header is None:
+            self.rejected += 1
+            return None
+        index, total, offset = header
+
+        payload = memoryview(data)[offset:]
+        size = len(payload)
+        if size > self.slot_size:
+            self.rejected += 1
+            return None
+
+        if total != self.total:
+            # A different chunk count means a new scan; the old one is lost
+            if self.total:
+                self.abandoned += 1
+            self._start(total, now)
+
+        slot = index - 1
+        start = slot * self.slot_size
+        previous = self.lengths[slot]
+        if previous >= 0:
+            if previous == size and self.view[start:start + size] == payload:
+                self.duplicates += 1
+                self.last_update = now
+                return None
+            # The next scan has begun; the previous one lost a chunk
+            self.abandoned += 1
+            self._start(total, now)
+
+        self.view[start:start + size] = payload
+        self.lengths[slot] = size
+        self.received += 1
+        self.last_update = now
+
+        if self.received < self.total:
+            return None
+
+        slot_size = self.slot_size
+        lengths = self.lengths
+        full_data = b''.join(
+            self.view[k * slot_size:k * slot_size + lengths[k]] for k in range(self.total)
+        )
+        self.completed += 1
+        self._reset()
+        return full_data
+
+
+class ESP32Receiver:
+    def __init__(self, name, device_table=None, node_index=None, history=16,
+                 clock=time.monotonic):
+        self.name = name
+        # Shared DeviceTable column this node writes into, if any
+        self.device_table = device_table
+        self.node_index = node_index
+        self.address = None
+        self.client = None
+        self.clock = clock
+        self.reassembler = ChunkReassembler(clock=clock)
+        # The ring is private to the ingest path; readers get frozen copies
+        self.ring = ScanRing(history)
+        self.snapshot = ReceiverSnapshot(0, None, empty_scan(), self.ring.frozen())
+        self.first_data_received = False
+        # Called with every raw notification when a capture is being recorded
+        self.recorder = None
+        # Called after every completed scan, e.g. to schedule a broadcast
+        self.on_scan = None
+
+        # Link health, kept up to date by ConnectionManager or a stand-in backend
+        self.link_state = 'offline'
+        self.last_data = None
+        self.reconnects = 0
+
+        # Metric children are looked up once, not per notification
+        self.notifications = metrics.NOTIFICATIONS.labels(name)
+        self.notification_bytes = metrics.NOTIFICATION_BYTES.labels(name)
+        self.reassembly_seconds = metrics.REASSEMBLY_SECONDS.labels(name)
+        self.decode_seconds = {fmt: metrics.DECODE_SECONDS.labels(name, fmt)
+                               for fmt in ('binary', 'json')}
+        self.decode_errors = metrics.DECODE_ERRORS.labels(name)
+        self.scan_devices = metrics.SCAN_DEVICES.labels(name)
+        self.trace_args = {'node': name}
+
+    @property
+    def receiving(self):
+        return self.reassembler.receiving
+
+    @property
+    def latest_scan(self):
+        return self.snapshot.scan
+
+    @property
+    def history(self):
+        return self.snapshot.history
+
+    @property
+    def status(self):
+        """'online', 'stale' (linked but silent), 'reconnecting' or 'offline'"""
+        if (self.link_state == 'online' and self.last_data is not None
+                and self.clock() - self.last_data > STALE_AFTER):
+            return 'stale'
+        return self.link_state
+
+    def notification_handler(self, sender, data):
+        """Handle chunked scan data (binary or JSON)"""
+        with tracing.span('notification_handler', self.trace_args):
+            try:
+                if not data:
+                    return
+                self.last_data = self.clock()
+                self.notifications.inc()
+                self.notification_bytes.inc(len(data))
+
+                if self.recorder is not None:
+                    self.recorder(data)
+
+                if not self.first_data_received:
+                    self.first_data_received = True
+                    log.info("🎉 [%s] First data received!", self.name)
+
+                # Check if this is chunked data: [1/3]data
+                header = parse_chunk_header(data)
+
+                if header is not None:
+                    with tracing.span('reassembly', self.trace_args):
+                        full_data = self.reassembler.feed(data, header)
+                    if full_data is None:
+                        return
+                    self.reassembly_seconds.observe(self.last_data - self.reassembler.started)
+
+                    try:
+                        self.process_payload(full_data)
+                        log.debug("✓ [%s] Complete: %d devices (%d chunks)",
+                                  self.name, len(self.latest_scan), header[1])
+                    except (json.JSONDecodeError, ValueError) as e:
+                        self.decode_errors.inc()
+                        log.warning("⚠ [%s] Decode Error: %s (%d bytes)", self.name, e, len(full_data))
+                else:
+                    # Not chunked, process directly
+                    self.process_payload(data)
+
+            except Exception as e:
+                log.warning("⚠ [%s] Error: %s", self.name, e)
+
+    def process_payload(self, payload):
+        """Decode a complete scan, detecting the format from its first byte"""
+        start = time.perf_counter()
+        if is_binary_scan(payload):
+            with tracing.span('decode_binary', self.trace_args):
+                scan = decode_binary_scan(payload)
+            self.decode_seconds['binary'].observe(time.perf_counter() - start)
+        else:
+            with tracing.span('process_data', self.trace_args):
+                scan = scan_from_json(json.loads(payload))
+            self.decode_seconds['json'].observe(time.perf_counter() - start)
+        self.process_scan(scan)
+
+    def process_data(self, json_data):
+        """Store a JSON scan document"""
+        with tracing.span('process_data', self.trace_args):
+            scan = scan_from_json(json_data)
+        self.process_scan(scan)
+
+    def process_scan(self, scan):
+        """Store a decoded SCAN_DTYPE array as the latest scan"""
+        now = self.clock()
+        # Published scans are shared with other threads, so lock them read-only
+        scan.flags.writeable = False
+        self.scan_devices.observe(len(scan))
+        self.ring.push(scan, now)
+        self.snapshot = ReceiverSnapshot(self.snapshot.version + 1, now, scan, self.ring.frozen())
+        if self.device_table is not None:
+            with tracing.span('device_table.update', self.trace_args):
+                self.device_table.update(self.node_index, scan, now)
+        if self.on_scan is not None:
+            self.on_scan()
+
+    async def disconnect(self):
+        """Disconnect from ESP32"""
+        if self.client and self.client.is_connected:
+            try:
+                await self.client.stop_notify(CHAR_UUID)
+                await self.client.disconnect()
+            except:
+                pass
@@ -0,0 +1,114 @@
+"""
+Scan payload formats sent by the ESP32 nodes
+Both the packed binary format and the JSON fallback decode to SCAN_DTYPE
+"""
+
+import struct
+import zlib
+
+import numpy as np
+
+
+# First byte of a binary scan. JSON payloads always start with '{'.
+BINARY_MAGIC = 0xC5
+BINARY_VERSION = 1
+
+# magic (u8), version (u8), record count (u16 LE)
+HEADER = struct.Struct('<BBH')
+
+# 13 bytes per device on the wire, versus ~90 for the JSON object
+RECORD_DTYPE = np.dtype([
+    ('mac', 'u1', (6,)),     # MAC address, most significant byte first
+    ('distance', '<u2'),     # centimetres, 0xFFFF = unknown
+    ('rssi', 'i1'),          # dBm
+    ('id', '<u4'),           # firmware device id hash
+])
+
+NO_DISTANCE = 0xFFFF
+
+# Host-side representation of one scan, one row per device
+SCAN_DTYPE = np.dtype([
+    ('mac', '<u8'),          # 48-bit MAC as an integer
+    ('distance', '<f4'),     # metres, NaN = unknown
+    ('rssi', '<i2'),
+    ('id', '<u4'),
+])
+
+
+def empty_scan():
+    return np.zeros(0, dtype=SCAN_DTYPE)
+
+
+def is_binary_scan(data):
+    return len(data) >= HEADER.size and data[0] == BINARY_MAGIC
+
+
+def mac_to_int(mac):
+    """'AA:BB:CC:DD:EE:FF' -> 0xAABBCCDDEEFF"""
+    return int(mac.replace(':', '').replace('-', ''), 16)
+
+
+def id_hash(device_id):
+    """
+    Reduce a firmware id string to the 32-bit hash the binary format carries
+    Hex ids keep their first 8 digits so hashedId stays the same in both formats
+    """
+    try:
+        return int(device_id[:8], 16)
+    except ValueError:
+        return zlib.crc32(device_id.encode())
+
+
+def format_id(value):
+    """Render an id hash the way the frontend shows hashedId"""
+    return f'{int(value):08x}'
+
+
+def decode_binary_scan(data):
+    """Decode a whole binary scan into a SCAN_DTYPE array"""
+    magic, version, count = HEADER.unpack_from(data)
+    if magic != BINARY_MAGIC:
+        raise ValueError(f"Bad magic byte 0x{magic:02x}")
+    if version != BINARY_VERSION:
+        raise ValueError(f"Unsupported scan format version {version}")
+    if len(data) < HEADER.size + count * RECORD_DTYPE.itemsize:
+        raise ValueError(f"Truncated scan: {count} records, {len(data)} bytes")
+
+    records = np.frombuffer(data, dtype=RECORD_DTYPE, count=count, offset=HEADER.size)
+
+    scan = np.empty(count, dtype=SCAN_DTYPE)
+    padded = np.zeros((count, 8), dtype=np.uint8)
+    padded[:, 2:] = records['mac']
+    scan['mac'] = padded.view('>u8').ravel()
+
+    distance = records['distance']
+    scan['distance'] = np.where(distance == NO_DISTANCE, np.nan, distance / 100.0)
+    scan['rssi'] = records['rssi']
+    scan['id'] = records['id']
+    return scan
+
+
+def encode_binary_scan(scan):
+    """Pack a SCAN_DTYPE array into the binary wire format"""
+    count = len(scan)
+    records = np.zeros(count, dtype=RECORD_DTYPE)
+
+    macs = np.asarray(scan['mac'], dtype='>u8').view(np.uint8).reshape(count, 8)
+    records['mac'] = macs[:, 2:]
+
+    distance = np.asarray(scan['distance'], dtype=float)
+    cm = np.clip(np.round(np.nan_to_num(distance, nan=0.0) * 100), 0, NO_DISTANCE - 1)
+    records['distance'] = np.where(np.isfinite(distance), cm, NO_DISTANCE)
+    records['rssi'] = np.clip(scan['rssi'], -128, 127)
+    records['id'] = scan['id']
+
+    return HEADER.pack(BINARY_MAGIC, BINARY_VERSION, count) + records.tobytes()
+
+
+def scan_from_json(json_data):
+    """Convert the JSON scan document into a SCAN_DTYPE array"""
+    devices = json_data.get('devices', [])
+    return np.array([
+        (mac_to_int(device['mac']), device['distance'], device['rssi'], id_hash(device['id']))
+        for device in devices
+    ], dtype=SCAN_DTYPE).reshape(-1)
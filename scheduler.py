@@ -0,0 +1,80 @@
+"""
+Event-driven broadcast scheduling
+Completed scans and node moves mark the map dirty; frames are rebuilt at
+most once per min_interval, so a burst of events costs one broadcast
+"""
+
+import asyncio
+import inspect
+import threading
+
+
+class BroadcastScheduler:
+    def __init__(self, min_interval=0.25, idle_interval=10.0):
+        self.min_interval = min_interval
+        # Rebuild this often even without events so silent devices age out;
+        # None waits for events only
+        self.idle_interval = idle_interval
+
+        self.loop = None
+        self.event = None
+        self.lock = threading.Lock()
+        self.reasons = set()
+        self.last_reasons = set()   # what triggered the latest broadcast
+
+        # Counters
+        self.events = 0
+        self.broadcasts = 0
+        self.idle_refreshes = 0
+
+    def mark_dirty(self, reason='scan'):
+        """Request a broadcast; safe to call from any thread"""
+        with self.lock:
+            self.events += 1
+            self.reasons.add(reason)
+            # run() publishes the loop and event together under the lock
+            loop, event = self.loop, self.event
+        if loop is None:
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            event.set()
+        else:
+            loop.call_soon_threadsafe(event.set)
+
+    async def run(self, broadcast):
+        """Call broadcast() (plain or coroutine) whenever the map is dirty"""
+        event = asyncio.Event()
+        with self.lock:
+            # Reasons marked before the loop was published would be lost
+            if self.reasons:
+                event.set()
+            self.loop, self.event = asyncio.get_running_loop(), event
+        last = float('-inf')
+
+        while True:
+            try:
+                await asyncio.wait_for(self.event.wait(), self.idle_interval)
+            except asyncio.TimeoutError:
+                self.idle_refreshes += 1
+
+            # Everything that arrives before the next slot joins this broadcast
+            delay = last + self.min_interval - self.loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            self.event.clear()
+            with self.lock:
+                self.last_reasons, self.reasons = self.reasons or {'idle'}, set()
+            last = self.loop.time()
+
+            try:
+                result = broadcast()
+                if inspect.isawaitable(result):
+                    await result
+                self.broadcasts += 1
+            except Exception as e:
+                print(f"Error in broadcast: {e}")
@@ -0,0 +1,361 @@
+"""
+Multi-process ingestion for CrowdMap
+Nodes are split across worker processes, each with its own BLE adapter, event
+loop and GIL. Workers reassemble and decode notifications as usual and write
+every decoded scan into a per-node shared-memory ring; the aggregator (the
+server process) polls the rings and feeds the scans into its own receivers,
+so fusion, triangulation and broadcasting see the same ESP32Receiver state as
+when everything runs in one process
+"""
+
+import asyncio
+import functools
+import logging
+import multiprocessing
+import signal
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from receiver import ESP32Receiver
+from scan_format import SCAN_DTYPE
+
+
+# Scans buffered per node; the aggregator polls far faster than nodes scan
+RING_SLOTS = 8
+
+# Devices one ring slot holds (18 bytes each); larger scans keep the strongest
+SLOT_DEVICES = 8192
+
+# Seconds between aggregator polls of the rings
+POLL_INTERVAL = 0.01
+
+# Seconds between link status updates, and before a dead worker is restarted
+STATUS_INTERVAL = 0.2
+RESTART_DELAY = 2.0
+
+LINK_STATES = ('offline', 'online', 'reconnecting')
+
+# Ring header: written by the worker, read by the aggregator. Counters are
+# running totals the aggregator mirrors into its own receivers and metrics
+HEADER_DTYPE = np.dtype([
+    ('seq', '<i8'),               # scans written so far
+    ('state', '<i8'),             # index into LINK_STATES
+    ('reconnects', '<i8'),
+    ('last_data', '<f8'),         # time.monotonic() of the last notification, NaN = never
+    ('notifications', '<i8'),
+    ('notification_bytes', '<i8'),
+    ('decode_errors', '<i8'),
+    ('completed', '<i8'),
+    ('expired', '<i8'),
+    ('abandoned', '<i8'),
+    ('duplicates', '<i8'),
+    ('rejected', '<i8'),
+    ('truncated', '<i8'),         # scans cut down to SLOT_DEVICES
+])
+
+# Reassembly outcomes copied onto the aggregator's receivers
+OUTCOMES = ('completed', 'expired', 'abandoned', 'duplicates', 'rejected')
+
+
+class SharedScanRing:
+    """
+    One node's scans in shared memory: a single writer (the worker that owns
+    the node) and a single reader (the aggregator)
+    Layout: header | slot seq (slots) | slot count (slots) | scans (slots, devices)
+    A slot's seq is -1 while it is written and the scan number once complete,
+    so the reader can tell a torn or overwritten read from a good one
+    """
+
+    def __init__(self, shm, slots, devices):
+        self.shm = shm
+        self.name = shm.name
+        self.slots = slots
+        self.devices = devices
+
+        buf = shm.buf
+        offset = HEADER_DTYPE.itemsize
+        self.header = np.ndarray((), dtype=HEADER_DTYPE, buffer=buf)
+        self.slot_seq = np.ndarray(slots, dtype='<i8', buffer=buf, offset=offset)
+        offset += 8 * slots
+        self.slot_count = np.ndarray(slots, dtype='<i8', buffer=buf, offset=offset)
+        offset += 8 * slots
+        self.data = np.ndarray((slots, devices), dtype=SCAN_DTYPE, buffer=buf, offset=offset)
+
+        # Reader side
+        self.read_seq = int(self.header['seq'])
+        self.dropped = 0
+
+    @staticmethod
+    def nbytes(slots, devices):
+        return HEADER_DTYPE.itemsize + 16 * slots + slots * devices * SCAN_DTYPE.itemsize
+
+    @classmethod
+    def create(cls, slots=RING_SLOTS, devices=SLOT_DEVICES):
+        shm = shared_memory.SharedMemory(create=True, size=cls.nbytes(slots, devices))
+        # New shared memory is zero-filled
+        ring = cls(shm, slots, devices)
+        ring.header['last_data'] = np.nan
+        return ring
+
+    @classmethod
+    def attach(cls, name, slots=RING_SLOTS, devices=SLOT_DEVICES):
+        return cls(shared_memory.SharedMemory(name=name), slots, devices)
+
+    def write(self, scan):
+        """Publish one SCAN_DTYPE array (worker side)"""
+        if len(scan) > self.devices:
+            keep = np.argpartition(-scan['rssi'].astype(np.int32), self.devices - 1)
+            scan = scan[np.sort(keep[:self.devices])]
+            self.header['truncated'] += 1
+        seq = int(self.header['seq']) + 1
+        k = seq % self.slots
+        self.slot_seq[k] = -1
+        self.data[k, :len(scan)] = scan
+        self.slot_count[k] = len(scan)
+        self.slot_seq[k] = seq
+        self.header['seq'] = seq
+
+    def read(self):
+        """Scans written since the last read, oldest first (aggregator side)"""
+        latest = int(self.header['seq'])
+        if latest == self.read_seq:
+            return []
+        first = max(self.read_seq + 1, latest - self.slots + 1)
+        self.dropped += first - self.read_seq - 1
+
+        scans = []
+        for seq in range(first, latest + 1):
+            k = seq % self.slots
+            count = int(self.slot_count[k])
+            scan = self.data[k, :count].copy()
+            # The writer lapped us mid-copy; the newer scan turns up later
+            if self.slot_seq[k] != seq or count > self.devices:
+                self.dropped += 1
+                continue
+            scans.append(scan)
+        self.read_seq = latest
+        return scans
+
+    def publish_status(self, receiver):
+        """Copy a worker receiver's link state and counters into the header"""
+        header = self.header
+        # The aggregator derives 'stale' from last_data itself
+        header['state'] = LINK_STATES.index(receiver.link_state)
+        header['reconnects'] = receiver.reconnects
+        header['last_data'] = np.nan if receiver.last_data is None else receiver.last_data
+        header['notifications'] = receiver.notifications.value
+        header['notification_bytes'] = receiver.notification_bytes.value
+        header['decode_errors'] = receiver.decode_errors.value
+        for outcome in OUTCOMES:
+            header[outcome] = getattr(receiver.reassembler, outcome)
+
+    def close(self):
+        # Views into the buffer have to go before the mapping can be closed
+        self.header = self.slot_seq = self.slot_count = self.data = None
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()
+
+
+def worker_main(shard, adapter, nodes, ring_names, slots, devices, simulate, log_level, stop):
+    """
+    Worker process entry point
+    nodes is [(registry index, device name)]; simulate is None or the
+    CrowdSimulator arguments plus 'nodes' (the full registry config)
+    """
+    # Ctrl-C reaches the whole process group; the aggregator decides when workers stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logging.basicConfig(level=log_level, format='%(message)s')
+    asyncio.run(_worker(shard, adapter, nodes, ring_names, slots, devices, simulate, stop))
+
+
+async def _worker(shard, adapter, nodes, ring_names, slots, devices, simulate, stop):
+    rings = [SharedScanRing.attach(name, slots, devices) for name in ring_names]
+    receivers = [ESP32Receiver(name) for _, name in nodes]
+    for receiver, ring in zip(receivers, rings):
+        receiver.on_scan = functools.partial(_publish_scan, receiver, ring)
+
+    manager = None
+    simulator = None
+    if simulate is not None:
+        from nodes import NodeRegistry
+        from simulator import CrowdSimulator
+        simulate = dict(simulate)
+        registry = NodeRegistry.from_config(simulate.pop('nodes'))
+        simulator = CrowdSimulator(registry, **simulate)
+        # Every worker runs the whole crowd and delivers only its own nodes
+        local = [None] * len(registry)
+        for (index, _), receiver in zip(nodes, receivers):
+            local[index] = receiver
+        simulator.attach(local)
+        simulator.start()
+    else:
+        from connection import ConnectionManager
+        manager = ConnectionManager(receivers, adapter=adapter)
+        manager.start()
+
+    print(f"🧵 Ingest worker {shard} ({adapter or 'default adapter'}): "
+          f"{', '.join(name for _, name in nodes)}")
+    try:
+        while not stop.is_set():
+            for receiver, ring in zip(receivers, rings):
+                ring.publish_status(receiver)
+            await asyncio.sleep(STATUS_INTERVAL)
+    finally:
+        if manager:
+            await manager.stop()
+        if simulator:
+            simulator.task.cancel()
+        for receiver, ring in zip(receivers, rings):
+            receiver.link_state = 'offline'
+            ring.publish_status(receiver)
+            ring.close()
+
+
+def _publish_scan(receiver, ring):
+    ring.write(receiver.latest_scan)
+
+
+class ShardPool:
+    """
+    Aggregator side: spawns the workers, owns the rings, and feeds every scan
+    into the server's receivers as if it had been decoded in this process
+    """
+
+    def __init__(self, registry, shards=None, adapters=None, simulate=None,
+                 slots=RING_SLOTS, devices=SLOT_DEVICES):
+        self.adapters = list(adapters or [])
+        self.shards = shards or max(1, len(self.adapters))
+        self.simulate = simulate
+        self.slots = slots
+        self.devices = devices
+        self.node_names = [node.device_name for node in registry]
+
+        # Round-robin: node k is ingested by worker k % shards
+        self.assignment = [[k for k in range(len(self.node_names)) if k % self.shards == shard]
+                           for shard in range(self.shards)]
+        self.context = multiprocessing.get_context('spawn')
+        self.stop_event = self.context.Event()
+        self.rings = []
+        self.processes = [None] * self.shards
+        self.died = [None] * self.shards
+        self.restarts = 0
+        self.receivers = []
+        self.counters = []
+        self.task = None
+
+    def adapter_for(self, shard):
+        return self.adapters[shard % len(self.adapters)] if self.adapters else None
+
+    def attach(self, receivers):
+        """receivers[k] receives node k's scans; its link status follows the worker's"""
+        self.receivers = list(receivers)
+
+    def start(self):
+        self.rings = [SharedScanRing.create(self.slots, self.devices) for _ in self.node_names]
+        self.counters = [dict.fromkeys(('notifications', 'notification_bytes', 'decode_errors'), 0)
+                         for _ in self.node_names]
+        if self.simulate is not None and self.simulate.get('speed', 1.0):
+            # Every simulated worker, restarted ones included, keeps its crowd
+            # on this clock, so all copies stay identical
+            self.simulate = dict(self.simulate, epoch=time.monotonic())
+        for shard in range(self.shards):
+            if self.assignment[shard]:
+                self._spawn(shard)
+        self.task = asyncio.ensure_future(self.run())
+
+    def _spawn(self, shard):
+        nodes = [(k, self.node_names[k]) for k in self.assignment[shard]]
+        process = self.context.Process(
+            target=worker_main, name=f'crowdmap-ingest-{shard}', daemon=True,
+            args=(shard, self.adapter_for(shard), nodes,
+                  [self.rings[k].name for k in self.assignment[shard]],
+                  self.slots, self.devices, self.simulate,
+                  logging.getLogger().getEffectiveLevel(), self.stop_event))
+        process.start()
+        self.processes[shard] = process
+        self.died[shard] = None
+
+    async def run(self):
+        """Poll every ring; mirror link status and restart dead workers now and then"""
+        next_status = 0.0
+        while True:
+            for receiver, ring in zip(self.receivers, self.rings):
+                for scan in ring.read():
+                    receiver.process_scan(scan)
+            now = time.monotonic()
+            if now >= next_status:
+                next_status = now + STATUS_INTERVAL
+                self.mirror_status()
+                self.supervise(now)
+            await asyncio.sleep(POLL_INTERVAL)
+
+    def mirror_status(self):
+        for receiver, ring, last in zip(self.receivers, self.rings, self.counters):
+            header = ring.header
+            receiver.link_state = LINK_STATES[int(header['state'])]
+            receiver.reconnects = int(header['reconnects'])
+            last_data = float(header['last_data'])
+            receiver.last_data = None if np.isnan(last_data) else last_data
+            for name in last:
+                value = int(header[name])
+                # A restarted worker counts from zero again
+                getattr(receiver, name).inc(value - last[name] if value >= last[name] else value)
+                last[name] = value
+            for outcome in OUTCOMES:
+                setattr(receiver.reassembler, outcome, int(header[outcome]))
+
+    def supervise(self, now):
+        for shard, process in enumerate(self.processes):
+            if process is None or process.is_alive() or self.stop_event.is_set():
+                continue
+            if self.died[shard] is None:
+                self.died[shard] = now
+                print(f"⚠️ Ingest worker {shard} exited ({process.exitcode}), "
+                      f"restarting in {RESTART_DELAY:.0f}s")
+                for k in self.assignment[shard]:
+                    self.rings[k].header['state'] = LINK_STATES.index('offline')
+            elif now - self.died[shard] >= RESTART_DELAY:
+                self.restarts += 1
+                self._spawn(shard)
+
+    async def wait_connected(self, timeout):
+        """Wait until every node is online or timeout passes; returns the count online"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while loop.time() < deadline:
+            self.mirror_status()
+            if all(r.link_state == 'online' for r in self.receivers):
+                break
+            await asyncio.sleep(0.05)
+        return sum(r.link_state == 'online' for r in self.receivers)
+
+    def stats(self):
+        return {
+            'workers': sum(p is not None and p.is_alive() for p in self.processes),
+            'restarts': self.restarts,
+            'dropped': {name: ring.dropped for name, ring in zip(self.node_names, self.rings)},
+            'truncated': {name: int(ring.header['truncated'])
+                          for name, ring in zip(self.node_names, self.rings)},
+        }
+
+    async def stop(self):
+        self.stop_event.set()
+        if self.task:
+            self.task.cancel()
+        loop = asyncio.get_running_loop()
+        for process in self.processes:
+            if process is None:
+                continue
+            await loop.run_in_executor(None, process.join, 5.0)
+            if process.is_alive():
+                process.terminate()
+        for receiver in self.receivers:
+            receiver.link_state = 'offline'
+        for ring in self.rings:
+            ring.close()
+            ring.unlink()
+        self.rings = []
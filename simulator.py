@@ -0,0 +1,284 @@
+"""
+Synthetic crowd simulator
+Stands in for BleakScanner/BleakClient: a moving crowd is scanned by every
+node and the scans are pushed as real '[i/n]' chunked notifications into
+ESP32Receiver.notification_handler
+"""
+
+import asyncio
+import json
+import time
+import traceback
+
+import numpy as np
+
+from density import FLOOR_BOUNDS
+from scan_format import SCAN_DTYPE, encode_binary_scan
+
+
+# Log-distance path-loss model used by the firmware to turn RSSI into metres
+TX_POWER = -59.0          # RSSI at 1 m
+PATH_LOSS_EXPONENT = 2.2
+RSSI_NOISE = 3.0          # dB
+SENSITIVITY = -100.0      # weaker advertisements are not heard
+
+# The receiver accepts headers up to "[9999/9999]"
+MAX_CHUNKS = 9999
+
+
+def chunk_payload(payload, chunk_size=180):
+    """Split a payload into '[i/n]' notifications carrying chunk_size bytes each"""
+    total = max(1, -(-len(payload) // chunk_size))
+    if total > MAX_CHUNKS:
+        raise ValueError(f"{len(payload)} byte payload needs {total} chunks (max {MAX_CHUNKS})")
+    return [
+        b'[%d/%d]' % (i + 1, total) + payload[i * chunk_size:(i + 1) * chunk_size]
+        for i in range(total)
+    ]
+
+
+def encode_scan(scan, payload_format='binary'):
+    """A SCAN_DTYPE array as the firmware sends it: 'binary' or 'json'"""
+    if payload_format == 'json':
+        return json.dumps({'devices': [
+            {
+                'mac': ':'.join(f'{mac:012X}'[i:i + 2] for i in range(0, 12, 2)),
+                'distance': round(distance, 2),
+                'rssi': rssi,
+                'id': f'{device_id:08x}'
+            }
+            for mac, distance, rssi, device_id in zip(
+                scan['mac'].tolist(), scan['distance'].tolist(),
+                scan['rssi'].tolist(), scan['id'].tolist())
+        ]}).encode()
+    return encode_binary_scan(scan)
+
+
+def check_crowd_size(n_devices, payload_format='binary', chunk_size=180):
+    """Raise ValueError if a scan hearing the whole crowd would need more than MAX_CHUNKS chunks"""
+    # Widest fields a heard device can have; the size grows linearly per device
+    sample = np.zeros(64, dtype=SCAN_DTYPE)
+    sample['mac'] = (1 << 48) - 1
+    sample['distance'] = 10 ** ((TX_POWER - SENSITIVITY) / (10 * PATH_LOSS_EXPONENT))
+    sample['rssi'] = SENSITIVITY
+    sample['id'] = (1 << 32) - 1
+    empty = len(encode_scan(sample[:0], payload_format))
+    per_device = (len(encode_scan(sample, payload_format)) - empty) / len(sample)
+    chunks = -(-int(np.ceil(empty + per_device * n_devices)) // chunk_size)
+    if chunks > MAX_CHUNKS:
+        raise ValueError(f"{n_devices} devices need up to {chunks} chunks per {payload_format} "
+                         f"scan (max {MAX_CHUNKS}); use fewer devices"
+                         + (" or the binary format" if payload_format != 'binary' else ""))
+
+
+def random_macs(rng, n):
+    """Random 48-bit MACs with the locally-administered bit set, like phones use"""
+    macs = rng.integers(0, 1 << 48, size=n, dtype=np.uint64)
+    return (macs | np.uint64(0x020000000000)) & ~np.uint64(0x010000000000)
+
+
+class SimulatedClient:
+    """Just enough of BleakClient for ESP32Receiver"""
+
+    def __init__(self, address):
+        self.address = address
+        self.is_connected = False
+        self.handler = None
+
+    async def connect(self):
+        self.is_connected = True
+        return True
+
+    async def start_notify(self, char_uuid, handler):
+        self.handler = handler
+
+    async def stop_notify(self, char_uuid):
+        self.handler = None
+
+    async def disconnect(self):
+        self.is_connected = False
+        return True
+
+
+class CrowdSimulator:
+    def __init__(self, registry, n_devices=1000, bounds=FLOOR_BOUNDS, seed=0,
+                 walk_speed=0.8, scan_interval=2.0, chunk_size=180, chunk_interval=0.0,
+                 payload_format='binary', mac_rotation=0.0, rssi_noise=RSSI_NOISE, speed=1.0,
+                 epoch=None):
+        self.registry = registry
+        self.n_devices = n_devices
+        self.bounds = np.array(bounds, dtype=float)
+        self.rng = np.random.default_rng(seed)
+        self.walk_speed = walk_speed           # m/s
+        self.scan_interval = scan_interval     # seconds between scans of one node
+        self.chunk_size = chunk_size
+        self.chunk_interval = chunk_interval   # seconds between notifications
+        self.payload_format = payload_format   # 'binary' or 'json'
+        self.mac_rotation = mac_rotation       # mean seconds between MAC changes, 0 = never
+        self.rssi_noise = rssi_noise           # dB
+        self.speed = speed                     # simulated seconds per wall second, 0 = unthrottled
+        check_crowd_size(n_devices, payload_format, chunk_size)
+        # time.monotonic() at simulated time 0; run() keeps to it, so copies
+        # sharing an epoch stay in step and a late one catches up
+        self.epoch = epoch
+
+        low, high = self.bounds[:2], self.bounds[2:]
+        self.positions = self.rng.uniform(low, high, size=(n_devices, 2))
+        self.velocities = self._random_velocities(n_devices)
+        self.macs = random_macs(self.rng, n_devices)
+        self.ids = self.rng.integers(0, 1 << 32, size=n_devices, dtype=np.uint32)
+        self.time = 0.0
+
+        self.clients = []
+        self.receivers = []
+        self.notifications = 0
+        self.task = None
+
+    def _random_velocities(self, n):
+        heading = self.rng.uniform(0, 2 * np.pi, n)
+        speed = self.rng.uniform(0, 2 * self.walk_speed, n)
+        return np.column_stack([np.cos(heading), np.sin(heading)]) * speed[:, None]
+
+    def attach(self, receivers):
+        """
+        Connect every receiver to a simulated node instead of a real ESP32
+        A None entry is a node another process simulates: its scans are still
+        drawn, so every copy of the crowd (same seed) stays identical, but
+        never encoded or delivered
+        """
+        self.receivers = list(receivers)
+        self.clients = []
+        for k, receiver in enumerate(self.receivers):
+            client = SimulatedClient(f"SIM:{k:02d}")
+            client.is_connected = True
+            if receiver is not None:
+                client.handler = receiver.notification_handler
+                receiver.address = client.address
+                receiver.client = client
+                receiver.link_state = 'online'
+            self.clients.append(client)
+        local = sum(receiver is not None for receiver in self.receivers)
+        print(f"🧪 Simulating {self.n_devices} devices on {local} nodes")
+
+    def step(self, dt):
+        """Move the crowd dt seconds, bouncing off the floor edges"""
+        if dt <= 0:
+            return
+        self.time += dt
+
+        # Occasionally pick a new heading so the crowd drifts instead of streaming
+        turn = self.rng.random(self.n_devices) < dt / 10.0
+        if turn.any():
+            self.velocities[turn] = self._random_velocities(int(turn.sum()))
+
+        self.positions += self.velocities * dt
+        low, high = self.bounds[:2], self.bounds[2:]
+        below = self.positions < low
+        above = self.positions > high
+        self.positions = np.where(below, 2 * low - self.positions, self.positions)
+        self.positions = np.where(above, 2 * high - self.positions, self.positions)
+        self.velocities = np.where(below | above, -self.velocities, self.velocities)
+
+        if self.mac_rotation:
+            rotate = self.rng.random(self.n_devices) < dt / self.mac_rotation
+            if rotate.any():
+                self.macs[rotate] = random_macs(self.rng, int(rotate.sum()))
+
+    def scan(self, node):
+        """One node's scan of the whole crowd as a SCAN_DTYPE array"""
+        position = self.registry.positions()[node]
+        true_distance = np.maximum(np.linalg.norm(self.positions - position, axis=1), 0.1)
+
+        rssi = (TX_POWER - 10 * PATH_LOSS_EXPONENT * np.log10(true_distance)
+                + self.rng.normal(0, self.rssi_noise, self.n_devices))
+        heard = rssi >= SENSITIVITY
+        rssi = rssi[heard]
+
+        scan = np.empty(len(rssi), dtype=SCAN_DTYPE)
+        scan['mac'] = self.macs[heard]
+        scan['distance'] = 10 ** ((TX_POWER - rssi) / (10 * PATH_LOSS_EXPONENT))
+        scan['rssi'] = np.round(rssi)
+        scan['id'] = self.ids[heard]
+        return scan
+
+    def payload(self, scan):
+        return encode_scan(scan, self.payload_format)
+
+    def notifications_for(self, node):
+        scan = self.scan(node)
+        if self.clients and self.clients[node].handler is None:
+            return []
+        return chunk_payload(self.payload(scan), self.chunk_size)
+
+    def deliver(self, node, chunks):
+        client = self.clients[node]
+        if client.handler is None:
+            return
+        for chunk in chunks:
+            client.handler(client, bytearray(chunk))
+        self.notifications += len(chunks)
+
+    def pump(self, duration):
+        """Run `duration` simulated seconds synchronously, as fast as possible"""
+        tick = self.scan_interval / max(1, len(self.clients))
+        end = self.time + duration
+        node = 0
+        while self.time < end:
+            self.step(tick)
+            self.deliver(node, self.notifications_for(node))
+            node = (node + 1) % len(self.clients)
+
+    def start(self):
+        """Schedule run() on the current event loop"""
+        self.task = asyncio.ensure_future(self.run())
+        self.task.add_done_callback(self._stopped)
+        return self.task
+
+    def _stopped(self, task):
+        # Nothing awaits the task, so an error would otherwise only surface at exit
+        if not task.cancelled() and task.exception() is not None:
+            error = task.exception()
+            print(f"❌ Simulator stopped: {error!r}")
+            traceback.print_exception(type(error), error, error.__traceback__)
+
+    def fast_forward(self, node, until):
+        """Draw ticks up to simulated time `until` without delivering; returns the next node"""
+        tick = self.scan_interval / max(1, len(self.clients))
+        start = self.time
+        while self.time + tick <= until:
+            self.step(tick)
+            self.scan(node)
+            node = (node + 1) % len(self.clients)
+        if self.time > start:
+            print(f"⏩ Simulator skipped {self.time - start:.0f}s to catch up")
+        return node
+
+    async def run(self):
+        """Stream scans at the firmware cadence, nodes staggered across the interval"""
+        tick = self.scan_interval / max(1, len(self.clients))
+        node = 0
+        if self.speed:
+            if self.epoch is None:
+                self.epoch = time.monotonic() - self.time / self.speed
+            # A copy started late (a restarted worker) replays what it missed
+            # unseen; a few late ticks are still delivered
+            behind = (time.monotonic() - self.epoch) * self.speed
+            if behind - self.time > self.scan_interval:
+                node = self.fast_forward(node, behind)
+
+        while True:
+            self.step(tick)
+            chunks = self.notifications_for(node)
+
+            if self.chunk_interval and self.speed:
+                for chunk in chunks:
+                    self.deliver(node, [chunk])
+                    await asyncio.sleep(self.chunk_interval / self.speed)
+            else:
+                self.deliver(node, chunks)
+
+            node = (node + 1) % len(self.clients)
+            if self.speed:
+                await asyncio.sleep(max(0.0, self.epoch + self.time / self.speed - time.monotonic()))
+            else:
+                await asyncio.sleep(0)
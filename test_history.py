@@ -0,0 +1,54 @@
+"""Tests for HistoryStore level selection"""
+
+import numpy as np
+
+from history import HistoryStore
+
+T0 = 1_700_000_000.0
+
+# Short retentions so aged-out data shows up within a few simulated minutes
+LEVELS = [
+    ('tick', 0, 64, 30),
+    ('1s', 1, 60, 120),
+    ('1m', 60, 64, 3600),
+]
+
+
+def fill(store, seconds, interval=0.5):
+    grid = np.zeros((2, 3))
+    for i in range(int(seconds / interval)):
+        store.append(T0 + i * interval, 10, ['a'], [1], grid)
+    return T0 + seconds
+
+
+def test_startup_uses_the_finest_level_with_rows(tmp_path):
+    store = HistoryStore(str(tmp_path), LEVELS)
+    end = fill(store, 25)
+
+    result = store.query(end - 60, end)
+    assert result['resolution'] == '1s'
+    assert len(result['time']) >= 20
+
+
+def test_step_falls_back_to_finer_levels_before_coarse_data_exists(tmp_path):
+    store = HistoryStore(str(tmp_path), LEVELS)
+    end = fill(store, 25)
+
+    result = store.query(end - 60, end, step=60)
+    assert result['resolution'] == '1s'
+    assert len(result['time']) >= 20
+
+
+def test_aged_out_range_comes_from_the_coarser_level(tmp_path):
+    store = HistoryStore(str(tmp_path), LEVELS)
+    end = fill(store, 600)
+
+    # 1s keeps about two minutes; only 1m still reaches the start
+    assert store.levels[1].first(T0, end) > T0 + 300
+    result = store.query(T0, end, step=1)
+    assert result['resolution'] == '1m'
+    assert result['time'][0] < T0 + 60
+
+    # A range 1s still fully covers stays at 1s
+    result = store.query(end - 60, end, step=1)
+    assert result['resolution'] == '1s'
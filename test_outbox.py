@@ -0,0 +1,81 @@
+"""Tests for merging queued 'map_delta' frames"""
+
+from delta import DeltaEncoder
+from outbox import merge_deltas
+
+NODES = [{'id': 'A'}]
+
+
+def device(device_id, x, y):
+    return {'id': device_id, 'position': [x, y]}
+
+
+def apply(state, frame):
+    """What a client holds after applying frame to state (id -> position)"""
+    if frame['keyframe']:
+        return {d['id']: d['position'] for d in frame['devices']}
+    state = dict(state)
+    for d in frame['added']:
+        state[d['id']] = d['position']
+    for device_id, x, y in frame['moved']:
+        state[device_id] = [x, y]
+    for device_id in frame['removed']:
+        del state[device_id]
+    return state
+
+
+def frames(*steps):
+    encoder = DeltaEncoder(keyframe_interval=100, move_threshold=0.5)
+    return [encoder.encode(NODES, devices) for devices in steps]
+
+
+def test_merged_delta_matches_applying_both():
+    keyframe, first, second = frames(
+        [device('a', 0, 0), device('b', 5, 5)],
+        [device('a', 2, 0), device('b', 5, 5), device('c', 1, 1)],
+        [device('a', 2, 0), device('c', 3, 3), device('d', 4, 4)],
+    )
+    base = apply({}, keyframe)
+
+    merged = merge_deltas(first, second)
+    assert merged['seq'] == second['seq']
+    assert merged['since'] == first['seq'] - 1
+    assert apply(base, merged) == apply(apply(base, first), second)
+
+
+def test_device_added_then_removed_never_reaches_the_client():
+    keyframe, first, second = frames(
+        [device('a', 0, 0)],
+        [device('a', 0, 0), device('b', 1, 1)],
+        [device('a', 0, 0)],
+    )
+
+    merged = merge_deltas(first, second)
+    assert merged['added'] == []
+    assert merged['removed'] == []
+    assert apply(apply({}, keyframe), merged) == {'a': [0, 0]}
+
+
+def test_delta_folds_into_a_pending_keyframe():
+    keyframe, delta = frames(
+        [device('a', 0, 0), device('b', 1, 1)],
+        [device('a', 3, 0), device('c', 2, 2)],
+    )
+
+    merged = merge_deltas(keyframe, delta)
+    assert merged['keyframe']
+    assert merged['seq'] == delta['seq']
+    assert apply({}, merged) == {'a': [3, 0], 'c': [2, 2]}
+
+
+def test_inputs_are_not_modified():
+    _, first, second = frames(
+        [device('a', 0, 0)],
+        [device('a', 0, 0), device('b', 1, 1)],
+        [device('a', 0, 0), device('b', 4, 4)],
+    )
+    added = [dict(d) for d in first['added']]
+
+    merge_deltas(first, second)
+    assert first['added'] == added
+    assert 'since' not in first
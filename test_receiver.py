@@ -0,0 +1,96 @@
+"""Regression tests for ChunkReassembler session boundaries"""
+
+import numpy as np
+
+from receiver import ChunkReassembler
+from scan_format import SCAN_DTYPE, decode_binary_scan, encode_binary_scan
+from simulator import chunk_payload
+
+
+def make_scan(k, n=6):
+    """n devices with the same MACs every scan; scan k differs in every chunk and the last distance is k"""
+    scan = np.zeros(n, dtype=SCAN_DTYPE)
+    scan['mac'] = np.arange(1, n + 1)
+    scan['distance'] = 0.5 * k
+    scan['distance'][-1] = k
+    scan['rssi'] = -60 - k
+    scan['id'] = np.arange(n)
+    return scan
+
+
+def feed_all(reassembler, chunks):
+    out = []
+    for chunk in chunks:
+        payload = reassembler.feed(chunk)
+        if payload is not None:
+            out.append(decode_binary_scan(payload))
+    return out
+
+
+def test_lost_chunk_abandons_scan_instead_of_splicing():
+    reassembler = ChunkReassembler()
+    chunks = []
+    for k in range(1, 6):
+        scan_chunks = chunk_payload(encode_binary_scan(make_scan(k)), 12)
+        if k == 1:
+            del scan_chunks[2]
+        chunks.extend(scan_chunks)
+
+    scans = feed_all(reassembler, chunks)
+    assert [float(scan['distance'][-1]) for scan in scans] == [2.0, 3.0, 4.0, 5.0]
+    assert reassembler.abandoned == 1
+    assert reassembler.duplicates == 0
+
+
+def test_repeated_chunk_is_a_duplicate():
+    reassembler = ChunkReassembler()
+    chunks = chunk_payload(encode_binary_scan(make_scan(7)), 12)
+    repeated = [chunks[0], chunks[0]] + chunks[1:3] + [chunks[2]] + chunks[3:]
+
+    scans = feed_all(reassembler, repeated)
+    assert len(scans) == 1
+    assert float(scans[0]['distance'][-1]) == 7.0
+    assert reassembler.duplicates == 2
+    assert reassembler.abandoned == 0
+
+
+def test_later_repeat_is_a_duplicate():
+    reassembler = ChunkReassembler()
+    chunks = chunk_payload(encode_binary_scan(make_scan(4)), 12)
+    assert len(chunks) > 3
+    repeated = chunks[:3] + [chunks[0], chunks[1]] + chunks[3:]
+
+    scans = feed_all(reassembler, repeated)
+    assert [float(scan['distance'][-1]) for scan in scans] == [4.0]
+    assert reassembler.duplicates == 2
+    assert reassembler.abandoned == 0
+
+
+def test_changed_chunk_starts_next_scan():
+    reassembler = ChunkReassembler()
+    first = chunk_payload(encode_binary_scan(make_scan(1)), 12)
+    second = chunk_payload(encode_binary_scan(make_scan(2)), 12)
+    assert len(first) == len(second)
+
+    scans = feed_all(reassembler, first[:2] + [second[1], second[0]] + second[2:])
+    assert [float(scan['distance'][-1]) for scan in scans] == [2.0]
+    assert reassembler.abandoned == 1
+
+
+def test_first_chunk_after_later_chunks_still_reassembles():
+    reassembler = ChunkReassembler()
+    chunks = chunk_payload(encode_binary_scan(make_scan(3)), 12)
+    late_first = [chunks[1], chunks[0]] + chunks[2:]
+
+    scans = feed_all(reassembler, late_first)
+    assert [float(scan['distance'][-1]) for scan in scans] == [3.0]
+    assert reassembler.abandoned == 0
+
+
+def test_reversed_chunks_still_reassemble():
+    reassembler = ChunkReassembler()
+    chunks = chunk_payload(encode_binary_scan(make_scan(3)), 12)
+
+    scans = feed_all(reassembler, chunks[::-1])
+    assert [float(scan['distance'][-1]) for scan in scans] == [3.0]
+    assert reassembler.abandoned == 0
@@ -0,0 +1,58 @@
+"""Tests for the shared-memory scan rings between ingest workers and the aggregator"""
+
+import numpy as np
+import pytest
+
+from scan_format import SCAN_DTYPE
+from sharding import SharedScanRing
+
+
+def make_scan(k, n=3):
+    scan = np.zeros(n, dtype=SCAN_DTYPE)
+    scan['mac'] = np.arange(1, n + 1)
+    scan['distance'] = k
+    scan['rssi'] = -50 - np.arange(n)
+    return scan
+
+
+@pytest.fixture
+def rings():
+    writer = SharedScanRing.create(slots=4, devices=8)
+    reader = SharedScanRing.attach(writer.name, slots=4, devices=8)
+    yield writer, reader
+    reader.close()
+    writer.close()
+    writer.unlink()
+
+
+def test_scans_arrive_in_order(rings):
+    writer, reader = rings
+    assert reader.read() == []
+
+    for k in (1, 2, 3):
+        writer.write(make_scan(k))
+    scans = reader.read()
+    assert [float(scan['distance'][0]) for scan in scans] == [1.0, 2.0, 3.0]
+    assert reader.read() == []
+    assert reader.dropped == 0
+
+
+def test_lapped_reader_counts_dropped_scans(rings):
+    writer, reader = rings
+    for k in range(1, 7):
+        writer.write(make_scan(k))
+
+    scans = reader.read()
+    assert [float(scan['distance'][0]) for scan in scans] == [3.0, 4.0, 5.0, 6.0]
+    assert reader.dropped == 2
+
+
+def test_oversized_scan_keeps_the_strongest_devices(rings):
+    writer, reader = rings
+    scan = make_scan(1, n=10)
+    writer.write(scan)
+
+    (received,) = reader.read()
+    assert len(received) == 8
+    assert sorted(received['mac'].tolist()) == list(range(1, 9))
+    assert int(writer.header['truncated']) == 1
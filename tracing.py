@@ -0,0 +1,110 @@
+"""
+Low-overhead span tracing for the ingest -> broadcast pipeline
+Spans go into a fixed-size ring buffer (oldest dropped first) while tracing
+is on, and are dumped as Chrome trace JSON for chrome://tracing or Perfetto
+While tracing is off, span() returns a shared no-op context manager
+"""
+
+import collections
+import json
+import os
+import threading
+import time
+
+
+# Spans kept in the ring buffer; ~100 bytes each
+TRACE_CAPACITY = 200000
+
+
+class Span:
+    __slots__ = ('events', 'name', 'args', 'start')
+
+    def __init__(self, events, name, args):
+        self.events = events
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter_ns()
+        # deque.append is atomic, so threads need no lock
+        self.events.append((self.name, self.start, end - self.start,
+                            threading.get_ident(), self.args))
+        return False
+
+
+class NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+class Tracer:
+    def __init__(self, capacity=TRACE_CAPACITY):
+        self.events = collections.deque(maxlen=capacity)
+        self.enabled = False
+        self.thread_names = {}
+
+    def span(self, name, args=None):
+        """Context manager timing one pipeline stage; args (a dict) ends up in the trace"""
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self.events, name, args)
+
+    def set_capacity(self, capacity):
+        self.events = collections.deque(self.events, maxlen=capacity)
+
+    def start(self):
+        self.events.clear()
+        self._remember_threads()
+        self.enabled = True
+
+    def stop(self):
+        self.enabled = False
+
+    def _remember_threads(self):
+        for thread in threading.enumerate():
+            self.thread_names[thread.ident] = thread.name
+
+    def to_chrome(self):
+        """Buffered spans as a Chrome trace document"""
+        self._remember_threads()
+        events = list(self.events)
+        pid = os.getpid()
+
+        trace = [{'name': 'process_name', 'ph': 'M', 'pid': pid, 'tid': 0,
+                  'args': {'name': 'crowdmap'}}]
+        for tid in sorted({event[3] for event in events}):
+            trace.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid,
+                          'args': {'name': self.thread_names.get(tid, f'thread-{tid}')}})
+
+        for name, start, duration, tid, args in events:
+            event = {'name': name, 'ph': 'X', 'pid': pid, 'tid': tid,
+                     'ts': start / 1000, 'dur': duration / 1000}
+            if args:
+                event['args'] = args
+            trace.append(event)
+        return {'traceEvents': trace, 'displayTimeUnit': 'ms'}
+
+    def dump(self, path):
+        """Write the buffer to a trace.json; returns the number of spans written"""
+        document = self.to_chrome()
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(document, f)
+        os.replace(tmp, path)
+        return sum(event['ph'] == 'X' for event in document['traceEvents'])
+
+
+TRACER = Tracer()
+span = TRACER.span
@@ -0,0 +1,189 @@
+"""
+Vectorized multi-target tracking
+One constant-velocity Kalman filter per device, all stored in stacked arrays
+so predict and update run as batched matrix operations
+"""
+
+import time
+
+import numpy as np
+
+
+class KalmanTracker:
+    """
+    Tracks are keyed by MAC. A track is confirmed after `confirm_hits`
+    detections and deleted after `max_misses` ticks without one.
+    """
+
+    def __init__(self, process_noise=1.0, measurement_noise=3.0, confirm_hits=2,
+                 max_misses=5, capacity=1024, clock=time.monotonic):
+        self.process_noise = process_noise          # acceleration std, m/s^2
+        self.measurement_noise = measurement_noise  # position std, m
+        self.confirm_hits = confirm_hits
+        self.max_misses = max_misses
+        self.clock = clock
+        self.time = None
+        self.size = 0
+        self.next_id = 0
+
+        self._sorted_keys = np.zeros(0, dtype=np.uint64)
+        self._sorted_index = np.zeros(0, dtype=np.int64)
+        self._allocate(capacity)
+
+    def _allocate(self, capacity):
+        self.capacity = capacity
+        self.keys = np.zeros(capacity, dtype=np.uint64)
+        self.track_ids = np.zeros(capacity, dtype=np.int64)  # stable, never reused
+        self.x = np.zeros((capacity, 4))             # [x, y, vx, vy]
+        self.P = np.zeros((capacity, 4, 4))
+        self.hits = np.zeros(capacity, dtype=np.int32)
+        self.misses = np.zeros(capacity, dtype=np.int32)
+        self.last_seen = np.zeros(capacity)          # monotonic time of last detection
+
+    def _columns(self):
+        return (self.keys, self.track_ids, self.x, self.P, self.hits, self.misses, self.last_seen)
+
+    def _grow(self, needed):
+        capacity = self.capacity
+        while capacity < needed:
+            capacity *= 2
+        old = self._columns()
+        self._allocate(capacity)
+        for new, previous in zip(self._columns(), old):
+            new[:self.size] = previous[:self.size]
+
+    def _reindex(self):
+        order = np.argsort(self.keys[:self.size], kind='stable')
+        self._sorted_keys = self.keys[:self.size][order]
+        self._sorted_index = order
+
+    def lookup(self, keys):
+        """Track index for each key, -1 if untracked"""
+        keys = np.asarray(keys, dtype=np.uint64)
+        if not self.size:
+            return np.full(len(keys), -1, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(self._sorted_keys, keys), self.size - 1)
+        return np.where(self._sorted_keys[pos] == keys, self._sorted_index[pos], -1)
+
+    def predict(self, dt):
+        """Advance every track by dt seconds"""
+        n = self.size
+        if not n or dt <= 0:
+            return
+
+        F = np.eye(4)
+        F[0, 2] = F[1, 3] = dt
+        q = self.process_noise ** 2
+        Q = np.zeros((4, 4))
+        Q[[0, 1], [0, 1]] = dt ** 4 / 4 * q
+        Q[[0, 1], [2, 3]] = Q[[2, 3], [0, 1]] = dt ** 3 / 2 * q
+        Q[[2, 3], [2, 3]] = dt ** 2 * q
+
+        self.x[:n] = self.x[:n] @ F.T
+        self.P[:n] = F @ self.P[:n] @ F.T + Q
+
+    def update(self, index, z, weights=None):
+        """
+        Fuse (K, 2) position fixes into the given tracks
+        A fix with weight w < 1 counts as w of an independent one: its
+        measurement variance is divided by w
+        """
+        if not len(index):
+            return
+        x = self.x[index]
+        P = self.P[index]
+
+        # S = H P H^T + R with H = [I 0]; 2x2 inverse in closed form
+        r = self.measurement_noise ** 2
+        if weights is not None:
+            r = r / np.asarray(weights, dtype=float)
+        a = P[:, 0, 0] + r
+        b = P[:, 0, 1]
+        c = P[:, 1, 0]
+        d = P[:, 1, 1] + r
+        det = a * d - b * c
+        S_inv = np.empty((len(index), 2, 2))
+        S_inv[:, 0, 0] = d / det
+        S_inv[:, 0, 1] = -b / det
+        S_inv[:, 1, 0] = -c / det
+        S_inv[:, 1, 1] = a / det
+
+        K = P[:, :, :2] @ S_inv
+        y = z - x[:, :2]
+        self.x[index] = x + (K @ y[..., None])[..., 0]
+        self.P[index] = P - K @ P[:, :2, :]
+
+    def _spawn(self, keys, z, now):
+        n = len(keys)
+        start = self.size
+        if start + n > self.capacity:
+            self._grow(start + n)
+        index = np.arange(start, start + n)
+
+        self.keys[index] = keys
+        self.track_ids[index] = np.arange(self.next_id, self.next_id + n)
+        self.next_id += n
+        self.x[index] = 0.0
+        self.x[index, :2] = z
+        self.P[index] = np.diag([
+            self.measurement_noise ** 2, self.measurement_noise ** 2, 4.0, 4.0
+        ])
+        self.hits[index] = 0
+        self.misses[index] = 0
+        self.last_seen[index] = now
+        self.size = start + n
+        return index
+
+    def _drop(self, keep):
+        kept = np.flatnonzero(keep)
+        for column in self._columns():
+            column[:len(kept)] = column[kept]
+        self.size = len(kept)
+
+    def step(self, keys, positions, now=None, weights=None):
+        """
+        One tracker tick: predict all tracks, update those with a fix in
+        `positions` (keyed by `keys`), spawn new tracks and delete stale ones
+        weights (per key, default 1) is the share of each fix's measurements
+        that is new since the previous tick. A fix with weight 0 only keeps
+        its track alive; the rest are fused with their weight, so ranges
+        reused across ticks never count as fresh evidence
+        """
+        if now is None:
+            now = self.clock()
+        dt = 0.0 if self.time is None else now - self.time
+        self.time = now
+        self.predict(dt)
+
+        keys = np.asarray(keys, dtype=np.uint64)
+        positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+        weights = np.ones(len(keys)) if weights is None else np.asarray(weights, dtype=float)
+        index = self.lookup(keys)
+        known = index >= 0
+        updated = known & (weights > 0)
+
+        present = np.zeros(self.size, dtype=bool)
+        present[index[known]] = True
+        detected = np.zeros(self.size, dtype=bool)
+        detected[index[updated]] = True
+        self.update(index[updated], positions[updated], weights[updated])
+
+        if not known.all():
+            new = self._spawn(keys[~known], positions[~known], now)
+            present = np.concatenate([present, np.ones(len(new), dtype=bool)])
+            detected = np.concatenate([detected, np.ones(len(new), dtype=bool)])
+
+        n = self.size
+        self.hits[:n][detected] += 1
+        self.misses[:n][present] = 0
+        self.misses[:n][~present] += 1
+        self.last_seen[:n][detected] = now
+
+        stale = self.misses[:n] > self.max_misses
+        if stale.any():
+            self._drop(~stale)
+        self._reindex()
+
+    def confirmed(self):
+        """Indices of tracks with enough detections to report"""
+        return np.flatnonzero(self.hits[:self.size] >= self.confirm_hits)
@@ -0,0 +1,276 @@
+"""
+Localization engines shared by map.py and map_websocket.py
+Solves many devices at once against a cached node geometry
+"""
+
+from collections import OrderedDict
+
+import numpy as np
+
+from density import FLOOR_BOUNDS
+
+
+# Ranges below this are clamped when deriving weights, so a device sitting
+# on top of a node does not get an infinite weight
+MIN_RANGE = 1.0
+
+# Relative singular value below which the heard nodes count as collinear
+DEGENERATE = 1e-10
+
+# Radio map KD-trees are per heard-node subset and cost ~10 ms each over the
+# whole floor grid. Only subsets shared by at least RADIOMAP_MIN_ROWS devices
+# get one, at most RADIOMAP_BUILDS new trees per solve, and the
+# RADIOMAP_MAX_TREES most recently used are kept; other devices fall back to
+# multilateration snapped onto the grid
+RADIOMAP_MIN_ROWS = 25
+RADIOMAP_BUILDS = 8
+RADIOMAP_MAX_TREES = 64
+
+
+def _batched_solve(matrices, vectors):
+    """
+    Solve a stack of small symmetric systems with light Tikhonov damping,
+    so a badly scaled but well-posed system still solves
+    """
+    n, size = vectors.shape
+    if n == 0:
+        return np.zeros((0, size))
+    damping = 1e-12 * np.trace(matrices, axis1=1, axis2=2)[:, None, None] + 1e-300
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        return np.linalg.solve(matrices + damping * np.eye(size),
+                               vectors[..., None])[..., 0]
+
+
+class Multilateration:
+    """
+    Weighted least-squares multilateration against any number of nodes
+    Each device is solved from whichever nodes heard it (at least min_nodes)
+    """
+
+    def __init__(self, positions, min_nodes=3, iterations=5, tolerance=1e-3):
+        self.min_nodes = min_nodes
+        self.iterations = iterations
+        self.tolerance = tolerance
+        self.set_positions(positions)
+
+    def set_positions(self, positions):
+        """Store node positions and rebuild the cached linear system"""
+        self.positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+
+        # |p - p_k|^2 = d_k^2 is linear in (x, y, x^2 + y^2):
+        #   -2 x_k x - 2 y_k y + R = d_k^2 - |p_k|^2
+        self.A = np.column_stack([-2 * self.positions, np.ones(len(self.positions))])
+        self.norms = (self.positions ** 2).sum(axis=1)
+        self.outer = np.einsum('ki,kj->kij', self.A, self.A)
+
+    def solve(self, distances, weights=None):
+        """
+        Multilaterate an (N, M) distance matrix; NaN marks nodes that did not
+        hear the device. Optional weights are per measurement (N, M).
+        Returns an (N, 2) masked array; unsolvable rows are masked.
+        """
+        distances = np.asarray(distances, dtype=float).reshape(-1, len(self.positions))
+        n = len(distances)
+
+        heard = np.isfinite(distances) & (distances >= 0)
+        d = np.where(heard, distances, 0.0)
+        clamped = np.maximum(d, MIN_RANGE)
+
+        # BLE ranging error grows with distance, so default to inverse variance
+        if weights is None:
+            w = 1.0 / (clamped * clamped)
+        else:
+            w = np.asarray(weights, dtype=float).reshape(n, -1)
+        w = np.where(heard & np.isfinite(w), w, 0.0)
+
+        solvable = heard.sum(axis=1) >= self.min_nodes
+        if n == 0 or not solvable.any():
+            return np.ma.masked_all((n, 2))
+
+        # Only the geometry of the heard nodes decides whether a device can be
+        # solved: collinear (or coincident) nodes leave the system rank deficient
+        unit = heard[solvable] / heard[solvable].sum(axis=1, keepdims=True)
+        singular = np.linalg.svd(np.einsum('nk,kij->nij', unit, self.outer), compute_uv=False)
+        ok = singular[:, -1] > DEGENERATE * singular[:, 0]
+
+        # Initial estimate: weighted linear least squares, normalized per row
+        wl = w[solvable] / np.maximum(w[solvable].sum(axis=1, keepdims=True),
+                                      np.finfo(float).tiny)
+        b = d[solvable] * d[solvable] - self.norms
+        normal = np.einsum('nk,kij->nij', wl, self.outer)
+        rhs = np.einsum('nk,ki->ni', wl * b, self.A)
+        linear = _batched_solve(normal[ok], rhs[ok])
+
+        rows = np.flatnonzero(solvable)[ok]
+        p = linear[:, :2]
+        d = d[rows]
+        w = w[rows]
+
+        # Refine on the true range residuals with batched Gauss-Newton. Each
+        # row stops on its own once it converges or its step blows up, so one
+        # bad device never freezes the rest of the batch
+        eye = np.eye(2)
+        active = np.isfinite(p).all(axis=1)
+        for _ in range(self.iterations):
+            idx = np.flatnonzero(active)
+            if not len(idx):
+                break
+            diff = p[idx, None, :] - self.positions[None, :, :]
+            rng = np.maximum(np.sqrt((diff * diff).sum(axis=2)), 1e-9)
+            J = diff / rng[..., None]
+            r = rng - d[idx]
+            JtWJ = np.einsum('nk,nki,nkj->nij', w[idx], J, J)
+            JtWr = np.einsum('nk,nki,nk->ni', w[idx], J, r)
+
+            # Light damping keeps the step finite near a node
+            damping = 1e-9 * np.trace(JtWJ, axis1=1, axis2=2)[:, None, None] + 1e-12
+            with np.errstate(invalid='ignore', over='ignore'):
+                step = np.linalg.solve(JtWJ + damping * eye, JtWr[..., None])[..., 0]
+            finite = np.isfinite(step).all(axis=1)
+            p[idx[finite]] -= step[finite]
+            active[idx[~finite | (np.abs(step).max(axis=1) < self.tolerance)]] = False
+
+        positions = np.ma.masked_all((n, 2))
+        good = np.isfinite(p).all(axis=1)
+        positions[rows[good]] = p[good]
+        return positions
+
+
+class Trilateration:
+    """
+    Three fixed ESP32 positions; the original trilateration API, now a thin
+    wrapper over Multilateration
+    """
+
+    def __init__(self, p1, p2, p3):
+        self.set_positions(p1, p2, p3)
+
+    def set_positions(self, p1, p2, p3):
+        """Store node positions and rebuild the cached geometry"""
+        self.p1 = np.asarray(p1, dtype=float)
+        self.p2 = np.asarray(p2, dtype=float)
+        self.p3 = np.asarray(p3, dtype=float)
+        self.solver = Multilateration([self.p1, self.p2, self.p3])
+
+        # Coincident or collinear nodes cannot be trilaterated at all
+        a, b = self.p2 - self.p1, self.p3 - self.p1
+        area = abs(a[0] * b[1] - a[1] * b[0])
+        scale = max(a @ a, b @ b)
+        self.degenerate = not (np.isfinite(area) and area > DEGENERATE * scale)
+
+    def solve(self, distances):
+        """
+        Trilaterate an (N, 3) array of distance triples
+        Returns an (N, 2) masked array; degenerate rows are masked
+        """
+        distances = np.asarray(distances, dtype=float).reshape(-1, 3)
+        if self.degenerate:
+            return np.ma.masked_all((len(distances), 2))
+        return self.solver.solve(distances)
+
+    def triangulate(self, d1, d2, d3):
+        """Trilaterate a single device, returning (x, y) or None"""
+        position = self.solve([[d1, d2, d3]])
+        if position.mask.any():
+            return None
+        return position.data[0]
+
+
+class RadioMapLocator:
+    """
+    Nearest-neighbour lookup in a precomputed radio map
+    Every cell of a grid over the floor stores its expected distance to each
+    node; a device is placed at the cell whose distances best match its own
+    measurements. Results always lie on the floor plan, and noisy ranges whose
+    circles never intersect still get the closest consistent cell.
+    Same interface as Multilateration.
+    """
+
+    def __init__(self, positions, bounds=FLOOR_BOUNDS, resolution=0.5, min_nodes=3,
+                 min_rows=RADIOMAP_MIN_ROWS, builds=RADIOMAP_BUILDS,
+                 max_trees=RADIOMAP_MAX_TREES):
+        self.bounds = bounds
+        self.resolution = resolution    # grid spacing in metres
+        self.min_nodes = min_nodes
+        self.min_rows = min_rows
+        self.builds = builds
+        self.max_trees = max_trees
+        self.fallback = Multilateration(positions, min_nodes=min_nodes)
+
+        x_min, y_min, x_max, y_max = bounds
+        xs = np.arange(x_min, x_max + resolution / 2, resolution)
+        ys = np.arange(y_min, y_max + resolution / 2, resolution)
+        gx, gy = np.meshgrid(xs, ys)
+        self.grid = np.column_stack([gx.ravel(), gy.ravel()])
+        self.set_positions(positions)
+
+    def set_positions(self, positions):
+        """Store node positions; the radio map is rebuilt on the next solve"""
+        self.positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+        self.expected = None
+        # heard-node bitmask -> cKDTree over those nodes' columns, oldest first
+        self.trees = OrderedDict()
+        self.fallback.set_positions(self.positions)
+
+    def _build(self, code, columns):
+        from scipy.spatial import cKDTree
+
+        if self.expected is None:
+            diff = self.grid[:, None, :] - self.positions[None, :, :]
+            self.expected = np.sqrt((diff * diff).sum(axis=2))
+        self.trees[code] = cKDTree(self.expected[:, columns],
+                                   balanced_tree=False, compact_nodes=False)
+        while len(self.trees) > self.max_trees:
+            self.trees.popitem(last=False)
+
+    def solve(self, distances, weights=None):
+        """
+        Locate an (N, M) distance matrix; NaN marks nodes that did not hear
+        the device. Weights are accepted for compatibility and ignored.
+        Returns an (N, 2) masked array; rows heard by too few nodes are masked.
+        """
+        m = len(self.positions)
+        distances = np.asarray(distances, dtype=float).reshape(-1, m)
+        n = len(distances)
+        positions = np.ma.masked_all((n, 2))
+
+        heard = np.isfinite(distances) & (distances >= 0)
+        solvable = heard.sum(axis=1) >= self.min_nodes
+        if n == 0 or not solvable.any():
+            return positions
+
+        # Devices heard by the same nodes share one tree and one batched query;
+        # the largest uncached subsets get new trees first
+        codes = heard.astype(np.int64) @ (1 << np.arange(m, dtype=np.int64))
+        subsets, counts = np.unique(codes[solvable], return_counts=True)
+        builds = self.builds
+        rest = solvable.copy()
+        for i in np.argsort(-counts, kind='stable').tolist():
+            code = int(subsets[i])
+            columns = np.flatnonzero(code >> np.arange(m) & 1)
+            if code in self.trees:
+                self.trees.move_to_end(code)
+            elif counts[i] >= self.min_rows and builds > 0:
+                self._build(code, columns)
+                builds -= 1
+            else:
+                continue
+            rows = np.flatnonzero(codes == code)
+            _, cells = self.trees[code].query(distances[np.ix_(rows, columns)])
+            positions[rows] = self.grid[cells]
+            rest[rows] = False
+
+        # Rare subsets: multilaterate and snap to the nearest cell on the floor
+        rest = np.flatnonzero(rest)
+        if len(rest):
+            origin = self.grid[0]
+            p = np.clip(self.fallback.solve(distances[rest]), origin, self.grid[-1])
+            positions[rest] = np.round((p - origin) / self.resolution) * self.resolution + origin
+        return positions
+
+
+# Localization engines selectable on the server
+LOCATORS = {
+    'multilateration': Multilateration,
+    'radiomap': RadioMapLocator,
+}
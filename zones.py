@@ -0,0 +1,134 @@
+"""
+Zone occupancy for CrowdMap
+Zone polygons (floor-plan metres, same frame as the nodes) are rasterized
+once into a label mask; counting a frame is then one mask lookup per device
+and a bincount, however many zones there are
+"""
+
+import json
+
+import numpy as np
+
+from density import FLOOR_BOUNDS
+
+
+class Zone:
+    def __init__(self, zone_id, name, polygon):
+        self.id = zone_id
+        self.name = name
+        self.polygon = np.array(polygon, dtype=float).reshape(-1, 2)
+        if len(self.polygon) < 3:
+            raise ValueError(f"Zone {zone_id} needs at least 3 vertices")
+
+    def to_dict(self):
+        return {'id': self.id, 'name': self.name, 'polygon': self.polygon.tolist()}
+
+
+def rasterize(zones, bounds, cell_size):
+    """
+    (height, width) int16 mask: 0 outside every zone, k + 1 inside zones[k]
+    Cells are tested at their centres (even-odd rule); a later zone wins
+    where zones overlap
+    """
+    x0, y0, x1, y1 = bounds
+    width = max(1, int(np.ceil((x1 - x0) / cell_size)))
+    height = max(1, int(np.ceil((y1 - y0) / cell_size)))
+    xs = x0 + (np.arange(width) + 0.5) * cell_size
+    ys = y0 + (np.arange(height) + 0.5) * cell_size
+    px, py = np.meshgrid(xs, ys)
+
+    mask = np.zeros((height, width), dtype=np.int16)
+    for k, zone in enumerate(zones):
+        inside = np.zeros((height, width), dtype=bool)
+        for (ax, ay), (bx, by) in zip(zone.polygon, np.roll(zone.polygon, -1, axis=0)):
+            if ay == by:
+                continue
+            crosses = (ay > py) != (by > py)
+            x_cross = ax + (py - ay) * (bx - ax) / (by - ay)
+            inside ^= crosses & (px < x_cross)
+        mask[inside] = k + 1
+    return mask
+
+
+class ZoneMap:
+    def __init__(self, zones=(), bounds=FLOOR_BOUNDS, cell_size=0.5):
+        self.bounds = tuple(float(b) for b in bounds)
+        self.cell_size = float(cell_size)
+        self.state = ([], None, 0)
+        self.set_zones(zones)
+
+    @classmethod
+    def from_config(cls, config, **kwargs):
+        """Build from a list of {id, name, polygon} dicts"""
+        return cls(zones_from_config(config), **kwargs)
+
+    @classmethod
+    def from_file(cls, path, **kwargs):
+        with open(path) as f:
+            return cls.from_config(json.load(f), **kwargs)
+
+    def __len__(self):
+        return len(self.zones)
+
+    def set_zones(self, zones):
+        """Replace every zone and rebuild the mask; the only time rasterizing happens"""
+        zones = list(zones)
+        ids = [zone.id for zone in zones]
+        if len(set(ids)) != len(ids):
+            raise ValueError("Duplicate zone id")
+        mask = rasterize(zones, self.bounds, self.cell_size)
+        # One swap, so a count running on another thread sees old or new, never a mix
+        self.state = (zones, mask, self.state[2] + 1)
+
+    @property
+    def zones(self):
+        return self.state[0]
+
+    @property
+    def version(self):
+        return self.state[2]
+
+    def count(self, positions):
+        """Devices per zone for (N, 2) positions, plus the number in no zone"""
+        zones, mask, _ = self.state
+        return self._count(zones, mask, positions)
+
+    def _count(self, zones, mask, positions):
+        height, width = mask.shape
+        positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+
+        x0, y0, x1, y1 = self.bounds
+        x, y = positions[:, 0], positions[:, 1]
+        inside = (x >= x0) & (x <= x1) & (y >= y0) & (y <= y1)
+        x, y = x[inside], y[inside]
+
+        # The far edges belong to the last row / column
+        col = np.minimum(np.floor((x - x0) / self.cell_size), width - 1).astype(np.int64)
+        row = np.minimum(np.floor((y - y0) / self.cell_size), height - 1).astype(np.int64)
+
+        labels = np.zeros(len(positions), dtype=np.int64)
+        labels[inside] = mask[row, col]
+        counts = np.bincount(labels, minlength=len(zones) + 1)
+        return counts[1:], int(counts[0])
+
+    def to_event(self, positions):
+        """Small 'zone_update' payload: a count per zone"""
+        # Zones, mask and version from one snapshot, so an edit mid-count cannot mix them
+        zones, mask, version = self.state
+        counts, unzoned = self._count(zones, mask, positions)
+        return {
+            'version': version,
+            'zones': [{'id': zone.id, 'name': zone.name, 'count': int(count)}
+                      for zone, count in zip(zones, counts.tolist())],
+            'unzoned': unzoned
+        }
+
+    def to_config(self):
+        """'zone_config' payload: the polygons, sent on connect and after edits"""
+        zones, _, version = self.state
+        return {'version': version, 'zones': [zone.to_dict() for zone in zones]}
+
+
+def zones_from_config(config):
+    return [Zone(entry['id'], entry.get('name', entry['id']), entry['polygon'])
+            for entry in config]